@@ -0,0 +1,80 @@
+'''
+Measure cold start against warm start for the linearizer process.
+
+Each sample runs in a fresh interpreter and reports:
+- module import time of hls_vod_linearizer
+- boto3 client construction, paid once per process by the pooled clients (it used to be paid on every invocation)
+- the first (cold) child playlist request and the median of the following warm requests, on in-memory backends
+
+Usage:
+    python benchmarks/bench_coldstart.py --samples 5
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SAMPLE_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, %(benchmarks)r)
+sys.path.insert(0, %(repository)r)
+import hls_vod_linearizer
+import_ms = (time.perf_counter() - started) * 1000
+
+import fixtures
+s3_client, db_client, client_id = fixtures.buildChannel(asset_length=600, segment_duration=6, history=10, session_age=900)
+fixtures.resetEngine(s3_client, db_client, 30)
+
+started = time.perf_counter()
+hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id), None)
+cold_ms = (time.perf_counter() - started) * 1000
+
+warm = []
+for iteration in range(50):
+    started = time.perf_counter()
+    hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id), None)
+    warm.append((time.perf_counter() - started) * 1000)
+warm.sort()
+
+client_ms = None
+try:
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    started = time.perf_counter()
+    hls_vod_linearizer.createClient('s3')
+    hls_vod_linearizer.createClient('dynamodb')
+    client_ms = (time.perf_counter() - started) * 1000
+except ImportError:
+    pass
+
+print(json.dumps({"import_ms": import_ms, "cold_request_ms": cold_ms, "warm_request_ms": warm[len(warm) // 2], "boto3_clients_ms": client_ms}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start vs warm start measurement for the linearizer")
+    parser.add_argument("--samples",type=int,default=5)
+    args = parser.parse_args()
+
+    benchmarks = os.path.dirname(os.path.abspath(__file__))
+    repository = os.path.dirname(benchmarks)
+    samples = []
+    for sample in range(args.samples):
+        output = subprocess.check_output([sys.executable,"-c",SAMPLE_SCRIPT % {"benchmarks":benchmarks,"repository":repository}])
+        samples.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+    print("%-22s %10s" % ("measurement","median ms"))
+    for measurement in ("import_ms","cold_request_ms","warm_request_ms","boto3_clients_ms"):
+        values = [sample[measurement] for sample in samples if sample[measurement] is not None]
+        print("%-22s %10s" % (measurement,"%.3f" % (statistics.median(values)) if values else "n/a"))
+
+    client_values = [sample['boto3_clients_ms'] for sample in samples if sample['boto3_clients_ms'] is not None]
+    if client_values:
+        print("\nPer invocation saving from pooled clients : %.3f ms" % (statistics.median(client_values)))
+
+
+if __name__ == "__main__":
+    main()
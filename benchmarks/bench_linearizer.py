@@ -0,0 +1,135 @@
+'''
+Benchmark the linearizer request paths against in-memory S3 and DynamoDB.
+
+For each request path (master, child, new client bootstrap) the handler is driven with warm process caches and the
+report shows cold start latency, p50/p99 latency, peak traced allocation per request and backend calls per request.
+Each sweep varies one parameter around the base configuration, so scaling shows up as a curve. segment_index=0 serves
+assets ingested before segment indexes, from their child playlists.
+
+Usage:
+    python benchmarks/bench_linearizer.py
+    python benchmarks/bench_linearizer.py --sweep session_age=60,3600,86400 --iterations 500
+    python benchmarks/bench_linearizer.py --json > bench_output.json
+'''
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import fixtures
+import hls_vod_linearizer
+
+BASE_CONFIG = {
+    "asset_length":600,
+    "segment_duration":6,
+    "sliding_window":30,
+    "history":0,
+    "session_age":300,
+    "segment_index":1
+}
+
+DEFAULT_SWEEPS = {
+    "asset_length":[60,600,3600,14400],
+    "segment_duration":[2,6,10],
+    "sliding_window":[30,300,1800],
+    "history":[0,10,100,1000],
+    "session_age":[60,3600,86400],
+    "segment_index":[0,1]
+}
+
+
+def percentile(samples,fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1,int(fraction * len(ordered)))]
+
+
+def backendCalls(s3_client,db_client):
+    return sum(s3_client.calls.values()) + sum(db_client.calls.values())
+
+
+def measure(request,s3_client,db_client,iterations):
+    '''
+    Time <iterations> calls of request(), then repeat a smaller pass under tracemalloc for the allocation figures
+    '''
+    calls_before = backendCalls(s3_client,db_client)
+    latencies = []
+    for iteration in range(iterations):
+        started = time.perf_counter()
+        response = request()
+        latencies.append(time.perf_counter() - started)
+        if response['statusCode'] not in (200,301):
+            raise Exception("Benchmark request failed : %s" % (response))
+    calls = backendCalls(s3_client,db_client) - calls_before
+
+    tracemalloc.start()
+    peaks = []
+    for iteration in range(max(1,iterations // 10)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        request()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    return {
+        "p50_ms":percentile(latencies,0.50) * 1000,
+        "p99_ms":percentile(latencies,0.99) * 1000,
+        "peak_alloc_kib":sum(peaks) / len(peaks) / 1024,
+        "backend_calls_per_request":calls / iterations
+    }
+
+
+def benchmarkConfig(config,iterations):
+    results = dict()
+
+    # warm paths : known client polling the master and a rendition playlist
+    s3_client, db_client, client_id = fixtures.buildChannel(**dict(config,segment_index=bool(config['segment_index'])))
+    fixtures.resetEngine(s3_client,db_client,config['sliding_window'])
+
+    started = time.perf_counter()
+    hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id),None)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    results['child'] = measure(lambda: hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id),None),s3_client,db_client,iterations)
+    results['child']['cold_ms'] = cold_ms
+    results['master'] = measure(lambda: hls_vod_linearizer.lambda_handler(fixtures.masterEvent(client_id),None),s3_client,db_client,iterations)
+    results['bootstrap'] = measure(lambda: hls_vod_linearizer.lambda_handler(fixtures.masterEvent(),None),s3_client,db_client,iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the linearizer master, child and bootstrap request paths")
+    parser.add_argument("--iterations",type=int,default=200)
+    parser.add_argument("--sweep",action="append",help="parameter=value,value,... (repeatable), defaults to every parameter")
+    parser.add_argument("--json",action="store_true",help="Print results as JSON")
+    args = parser.parse_args()
+
+    sweeps = DEFAULT_SWEEPS
+    if args.sweep:
+        sweeps = dict()
+        for sweep in args.sweep:
+            parameter, values = sweep.split("=",1)
+            sweeps[parameter] = [int(value) for value in values.split(",")]
+
+    report = []
+    for parameter in sweeps:
+        for value in sweeps[parameter]:
+            config = dict(BASE_CONFIG)
+            config[parameter] = value
+            report.append({"parameter":parameter,"value":value,"config":config,"results":benchmarkConfig(config,args.iterations)})
+
+    if args.json:
+        print(json.dumps(report,indent=2))
+        return
+
+    print("%-18s %8s  %-9s %9s %9s %9s %11s %9s" % ("parameter","value","path","cold ms","p50 ms","p99 ms","alloc KiB","calls/req"))
+    for row in report:
+        for path in ("master","child","bootstrap"):
+            result = row['results'][path]
+            print("%-18s %8s  %-9s %9s %9.3f %9.3f %11.1f %9.2f" % (row['parameter'],row['value'],path,
+                "%.3f" % (result['cold_ms']) if 'cold_ms' in result else "-",
+                result['p50_ms'],result['p99_ms'],result['peak_alloc_kib'],result['backend_calls_per_request']))
+
+
+if __name__ == "__main__":
+    main()
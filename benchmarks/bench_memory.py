@@ -0,0 +1,111 @@
+'''
+Benchmark the memory held by parsed rendition playlists in the manifest cache, for very long assets with short
+segments (eg. 24 hours of 2 second segments is 43200 segments per rendition).
+
+For each segment count the report shows the memory retained by one parsed rendition, and the peak while parsing it,
+per 10k segments : from a segment index with a URI pattern, from a segment index listing every URI, and from the child
+playlist of an asset ingested before segment indexes. The previous layout (one Python string per segment plus the
+pre-encoded output lines for one CDN URL) is measured as a baseline. The last column projects a manifest cache holding
+MANIFEST_CACHE_SIZE renditions of that length.
+
+Usage:
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --segments 10000,43200 --segment-duration 2 --json
+'''
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+import fixtures
+import hls_vod_linearizer
+
+CHILD_URL = "https://d1234abcd.cloudfront.net/assets/bench/"
+
+
+def previousLayout(segment_index_raw):
+    '''
+    Segment table as it was held before SegmentTable : the EXTINF and URI lines of every segment as strings, a list of
+    float end offsets and the output lines of every segment pre-encoded for one segment base URL
+    '''
+    segment_index = json.loads(segment_index_raw)
+    pattern = segment_index['uri_pattern']
+    uris = ["%s%0*d%s" % (pattern['prefix'],pattern['width'],pattern['first'] + position,pattern['suffix']) for position in range(len(segment_index['durations']))]
+    segment_lines = ["#EXTINF:%s,\n%s\n" % (hls_vod_linearizer.extinfDuration(duration),uri) for duration, uri in zip(segment_index['durations'],uris)]
+    fragments = []
+    for line in segment_lines:
+        head, newline, tail = line.partition("\n")
+        fragments.append((head.encode('utf-8'),("\n"+CHILD_URL+tail).encode('utf-8')))
+    return {"segments":segment_lines,"segment_ends":segment_index['offsets'],"fragments":{CHILD_URL:fragments}}
+
+
+def measureParse(parser,raw):
+    '''
+    Bytes retained by the parsed object, and the peak traced while parsing
+    '''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    parsed = parser(raw)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del parsed
+    return retained - before, peak - before
+
+
+def benchmarkSegments(segments,segment_duration,cache_entries):
+    asset_name = "bench"
+    child_manifest, segment_count = fixtures.childManifest(asset_name,0,segments * segment_duration,segment_duration)
+    segment_index = fixtures.vod_content_ingest.segmentIndex(child_manifest)
+    pattern_index = json.dumps(segment_index)
+    listed_index = dict(segment_index)
+    pattern = listed_index.pop('uri_pattern')
+    listed_index['uris'] = ["%s%0*d%s" % (pattern['prefix'],pattern['width'],pattern['first'] + position,pattern['suffix']) for position in range(segment_count)]
+    listed_index = json.dumps(listed_index)
+
+    rows = []
+    for layout, parser, raw in (
+            ("previous layout",previousLayout,pattern_index),
+            ("index, URI pattern",hls_vod_linearizer.parseSegmentIndex,pattern_index),
+            ("index, listed URIs",hls_vod_linearizer.parseSegmentIndex,listed_index),
+            ("child playlist",hls_vod_linearizer.parseChildManifest,child_manifest)):
+        retained, peak = measureParse(parser,raw)
+        rows.append({
+            "segments":segment_count,
+            "layout":layout,
+            "retained_kib":round(retained / 1024,1),
+            "retained_kib_per_10k":round(retained / 1024 * 10000 / segment_count,1),
+            "bytes_per_segment":round(retained / segment_count,1),
+            "parse_peak_kib":round(peak / 1024,1),
+            "cache_mib":round(retained * cache_entries / 1048576,1)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory held by parsed rendition playlists")
+    parser.add_argument("--segments",default="10000,21600,43200",help="Comma separated segment counts per rendition")
+    parser.add_argument("--segment-duration",type=int,default=2)
+    parser.add_argument("--cache-entries",type=int,default=hls_vod_linearizer.MANIFEST_CACHE.max_entries,help="Renditions held by the manifest cache, MANIFEST_CACHE_SIZE by default")
+    parser.add_argument("--json",action="store_true",help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for segments in [int(segments) for segments in args.segments.split(",")]:
+        rows.extend(benchmarkSegments(segments,args.segment_duration,args.cache_entries))
+
+    if args.json:
+        print(json.dumps(rows,indent=2))
+        return
+
+    print("%9s  %-20s %12s %14s %10s %14s %12s" % ("segments","layout","retained KiB","KiB per 10k","B/segment","parse peak KiB","cache MiB"))
+    for row in rows:
+        print("%9s  %-20s %12.1f %14.1f %10.1f %14.1f %12.1f" % (row['segments'],row['layout'],row['retained_kib'],row['retained_kib_per_10k'],
+            row['bytes_per_segment'],row['parse_peak_kib'],row['cache_mib']))
+    print("")
+    print("cache MiB : %s cached renditions of this length" % (args.cache_entries))
+
+
+if __name__ == "__main__":
+    main()
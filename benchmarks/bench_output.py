@@ -0,0 +1,88 @@
+'''
+Benchmark playlist response encoding : bytes on the wire and CPU per response for identity, gzip and brotli (when the
+brotli module is installed) across sliding window sizes, for full playlists and _HLS_skip=YES delta updates.
+
+Usage:
+    python benchmarks/bench_output.py
+    python benchmarks/bench_output.py --sliding-windows 30,300,3600 --iterations 500
+'''
+
+import argparse
+import base64
+import json
+import os
+import time
+
+import fixtures
+import hls_vod_linearizer
+
+
+def encodingsAvailable():
+    encodings = ["identity","gzip"]
+    if hls_vod_linearizer.brotli is not None:
+        encodings.append("br")
+    return encodings
+
+
+def measureEncoding(client_id,encoding,iterations,delta=False):
+    '''
+    CPU time per child playlist response and the size of the body the player receives
+    '''
+    def request():
+        event = fixtures.childEvent(client_id)
+        event['headers'] = {"Accept-Encoding":encoding}
+        if delta:
+            event['queryStringParameters']['_HLS_skip'] = "YES"
+        return hls_vod_linearizer.lambda_handler(event,None)
+
+    response = request()
+    if response['statusCode'] != 200:
+        raise Exception("Benchmark request failed : %s" % (response))
+    if response.get('isBase64Encoded'):
+        wire_bytes = len(base64.b64decode(response['body']))
+    else:
+        wire_bytes = len(response['body'].encode('utf-8'))
+
+    started = time.process_time()
+    for iteration in range(iterations):
+        request()
+    cpu_ms = (time.process_time() - started) * 1000 / iterations
+
+    return {"bytes":wire_bytes,"cpu_ms":cpu_ms,"content_encoding":response['headers'].get('Content-Encoding','identity'),"playlist":"delta" if delta else "full"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed playlist responses")
+    parser.add_argument("--iterations",type=int,default=200)
+    parser.add_argument("--sliding-windows",default="30,300,1800,7200")
+    parser.add_argument("--can-skip-until",type=int,default=36,help="CAN_SKIP_UNTIL seconds used for the delta playlist rows")
+    parser.add_argument("--json",action="store_true",help="Print results as JSON")
+    args = parser.parse_args()
+
+    os.environ['CAN_SKIP_UNTIL'] = str(args.can_skip_until)
+
+    report = []
+    for sliding_window in [int(value) for value in args.sliding_windows.split(",")]:
+        s3_client, db_client, client_id = fixtures.buildChannel(asset_length=3600,segment_duration=6,sliding_window=sliding_window,history=0,session_age=sliding_window+300)
+        fixtures.resetEngine(s3_client,db_client,sliding_window)
+        results = dict()
+        for encoding in encodingsAvailable():
+            results[encoding] = measureEncoding(client_id,encoding,args.iterations)
+            results[encoding+" delta"] = measureEncoding(client_id,encoding,args.iterations,delta=True)
+        report.append({"sliding_window":sliding_window,"results":results})
+
+    if args.json:
+        print(json.dumps(report,indent=2))
+        return
+
+    print("%-14s %-9s %-8s %10s %8s %9s" % ("sliding window","accept","playlist","bytes","saved","cpu ms"))
+    for row in report:
+        identity_bytes = row['results']['identity']['bytes']
+        for encoding in row['results']:
+            result = row['results'][encoding]
+            print("%-14s %-9s %-8s %10d %7.1f%% %9.3f" % (row['sliding_window'],encoding.split(" ")[0],result['playlist'],result['bytes'],
+                100.0 * (identity_bytes - result['bytes']) / identity_bytes,result['cpu_ms']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+'''
+Load test the linearizer with a population of simulated players, in real time, against in-memory S3 and DynamoDB.
+
+Players join at random over the join period. Each one fetches the master playlist, follows the 301 redirect to its
+client_id URL (or takes the client_id from the rendition URIs with BOOTSTRAP_MODE=direct), picks a rendition and then
+reloads that rendition playlist every target duration (with some jitter) until the run ends. Requests are handed to lambda_handler on a thread pool, like hls_vod_linearizer_server.py does.
+Schedule changes (ingest events making a new asset the now playing item) can be replayed while players are polling.
+
+Every report interval prints the request rate, latency percentiles and errors; the final report breaks them down per
+request type, with backend calls per request. Latency is measured from when the player wanted to send the request, so
+time spent waiting for a worker shows up when the engine can't keep up.
+
+Usage:
+    python benchmarks/bench_players.py --players 5000 --join-seconds 60 --duration 300
+    python benchmarks/bench_players.py --players 1000 --duration 120 --ingest-at 30,90 --set TIMELINE_MODE=channel --set CHANNEL_EPOCH=1700000000
+    python benchmarks/bench_players.py --players 2000 --duration 120 --ingest-at 30 --ingest-lead 20 --backend-latency-ms 30
+    python benchmarks/bench_players.py --players 2000 --duration 60 --backend-latency-ms 10 --set BOOTSTRAP_MODE=direct
+'''
+
+import argparse
+import collections
+import concurrent.futures
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import fixtures
+import hls_vod_linearizer
+
+
+def percentile(samples,fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1,int(fraction * len(ordered)))]
+
+
+def backendCalls(s3_client,db_client):
+    return {"s3":sum(s3_client.calls.values()),"dynamodb":sum(db_client.calls.values())}
+
+
+class Player(object):
+    '''
+    One player session : bootstrap (master without client_id), redirect (master with client_id), then rendition polls.
+    A direct bootstrap goes straight to the rendition polls
+    '''
+    def __init__(self,player_id,join_at):
+        self.player_id = player_id
+        self.next_request = join_at
+        self.request_type = "bootstrap"
+        self.client_id = None
+        self.rendition = None
+        self.reload_interval = None
+
+    def event(self):
+        if self.request_type == "bootstrap":
+            return fixtures.masterEvent()
+        if self.request_type == "redirect":
+            return fixtures.masterEvent(self.client_id)
+        return fixtures.childEvent(self.client_id,self.rendition)
+
+    def advance(self,response,requested_at):
+        '''
+        Move on to the next request from a response. Returns False when the player gives up
+        '''
+        if self.request_type == "bootstrap":
+            if response['statusCode'] == 200:
+                return self.pickRendition(response)
+            if response['statusCode'] != 301:
+                return False
+            location = urllib.parse.urlsplit(response['headers']['Location'])
+            self.client_id = urllib.parse.parse_qs(location.query)['client_id'][0]
+            self.request_type = "redirect"
+            return True
+
+        if self.request_type == "redirect":
+            if response['statusCode'] != 200:
+                return False
+            return self.pickRendition(response)
+
+        if response['statusCode'] == 200 and self.reload_interval is None:
+            for line in response['body'].split("\n"):
+                if line.startswith("#EXT-X-TARGETDURATION:"):
+                    self.reload_interval = float(line.split(":",1)[1])
+        # players retry a failed reload after a target duration too
+        self.next_request = requested_at + (self.reload_interval or 6) * random.uniform(0.9,1.1)
+        return True
+
+    def pickRendition(self,response):
+        renditions = [line for line in response['body'].split("\n") if ".m3u8" in line and not line.startswith("#")]
+        if self.client_id is None:
+            if len(renditions) == 0 or "client_id=" not in renditions[0]:
+                return False
+            self.client_id = urllib.parse.parse_qs(urllib.parse.urlsplit(renditions[0]).query)['client_id'][0]
+        self.rendition = random.randrange(max(1,len(renditions)))
+        self.request_type = "poll"
+        return True
+
+
+class LoadTest(object):
+    def __init__(self,s3_client,db_client,workers,verbose=True):
+        self.s3_client = s3_client
+        self.verbose = verbose
+        self.db_client = db_client
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.queue = []
+        self.sequence = 0
+        self.samples = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.interval_samples = []
+        self.interval_errors = 0
+        self.active_players = 0
+
+    def schedule(self,player):
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.queue,(player.next_request,self.sequence,player))
+
+    def request(self,player,requested_at):
+        started = time.time()
+        try:
+            response = hls_vod_linearizer.lambda_handler(player.event(),None)
+            status = response['statusCode']
+        except Exception:
+            response = None
+            status = "exception"
+        finished = time.time()
+
+        request_type = player.request_type
+        error = status == "exception" or status >= 400
+        with self.lock:
+            self.samples[request_type].append((finished - requested_at,finished - started))
+            self.statuses[request_type][status] += 1
+            self.interval_samples.append(finished - requested_at)
+            self.interval_errors += 1 if error else 0
+
+        if response is not None and player.advance(response,requested_at):
+            self.schedule(player)
+        else:
+            with self.lock:
+                self.active_players -= 1
+
+    def run(self,players,duration,ingest_at,report_every,on_ingest):
+        started = time.time()
+        run_end = started + duration
+        ingest_at = sorted(started + offset for offset in ingest_at)
+        next_report = started + report_every
+        interval_started = started
+        intervals = []
+        calls_before = backendCalls(self.s3_client,self.db_client)
+
+        self.active_players = len(players)
+        for player in players:
+            player.next_request += started
+            self.schedule(player)
+
+        while True:
+            now = time.time()
+            if now >= run_end:
+                break
+
+            while len(ingest_at) > 0 and ingest_at[0] <= now:
+                ingest_at.pop(0)
+                on_ingest()
+
+            if now >= next_report:
+                with self.lock:
+                    interval_samples, self.interval_samples = self.interval_samples, []
+                    interval_errors, self.interval_errors = self.interval_errors, 0
+                    active_players = self.active_players
+                interval = {
+                    "elapsed_seconds":round(now - started,1),
+                    "players":active_players,
+                    "requests_per_second":round(len(interval_samples) / (now - interval_started),1),
+                    "p50_ms":round(percentile(interval_samples,0.50) * 1000,3) if interval_samples else 0,
+                    "p99_ms":round(percentile(interval_samples,0.99) * 1000,3) if interval_samples else 0,
+                    "errors":interval_errors
+                }
+                intervals.append(interval)
+                if self.verbose:
+                    print("%8.1fs %8s players %9.1f req/s  p50 %8.3f ms  p99 %8.3f ms  %s errors" % (interval['elapsed_seconds'],
+                        interval['players'],interval['requests_per_second'],interval['p50_ms'],interval['p99_ms'],interval['errors']))
+                interval_started = now
+                next_report += report_every
+
+            with self.lock:
+                due = None
+                if len(self.queue) > 0 and self.queue[0][0] <= now:
+                    due = heapq.heappop(self.queue)
+                next_due = self.queue[0][0] if len(self.queue) > 0 else run_end
+            if due is not None:
+                self.executor.submit(self.request,due[2],due[0])
+                continue
+            time.sleep(max(0,min(next_due,next_report,run_end,ingest_at[0] if ingest_at else run_end) - time.time()))
+
+        self.executor.shutdown(wait=True)
+        elapsed = time.time() - started
+        calls_after = backendCalls(self.s3_client,self.db_client)
+        return self.report(elapsed,intervals,dict((service,calls_after[service] - calls_before[service]) for service in calls_after))
+
+    def report(self,elapsed,intervals,backend_calls):
+        request_types = dict()
+        total_requests = 0
+        for request_type, samples in self.samples.items():
+            latencies = [sample[0] for sample in samples]
+            service_times = [sample[1] for sample in samples]
+            errors = sum(count for status, count in self.statuses[request_type].items() if status == "exception" or status >= 400)
+            total_requests += len(samples)
+            request_types[request_type] = {
+                "requests":len(samples),
+                "requests_per_second":round(len(samples) / elapsed,1),
+                "p50_ms":round(percentile(latencies,0.50) * 1000,3),
+                "p90_ms":round(percentile(latencies,0.90) * 1000,3),
+                "p99_ms":round(percentile(latencies,0.99) * 1000,3),
+                "max_ms":round(max(latencies) * 1000,3),
+                "service_p50_ms":round(percentile(service_times,0.50) * 1000,3),
+                "error_rate":round(errors / len(samples),5),
+                "statuses":dict((str(status),count) for status, count in self.statuses[request_type].items())
+            }
+        return {
+            "elapsed_seconds":round(elapsed,1),
+            "requests":total_requests,
+            "requests_per_second":round(total_requests / elapsed,1),
+            "backend_calls_per_request":dict((service,round(calls / max(1,total_requests),4)) for service, calls in backend_calls.items()),
+            "request_types":request_types,
+            "intervals":intervals
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the linearizer with simulated players")
+    parser.add_argument("--players",type=int,default=5000)
+    parser.add_argument("--join-seconds",type=float,default=60,help="Players join at random over this many seconds")
+    parser.add_argument("--duration",type=float,default=300,help="Length of the run in seconds")
+    parser.add_argument("--workers",type=int,default=32,help="Threads calling lambda_handler concurrently")
+    parser.add_argument("--asset-length",type=int,default=600)
+    parser.add_argument("--segment-duration",type=int,default=6)
+    parser.add_argument("--renditions",type=int,default=3)
+    parser.add_argument("--sliding-window",type=int,default=30)
+    parser.add_argument("--ingest-at",default="",help="Comma separated seconds into the run at which a new asset is ingested")
+    parser.add_argument("--ingest-lead",type=float,default=0,help="Seconds after ingest at which the new asset starts playing, 0 starts it straight away")
+    parser.add_argument("--backend-latency-ms",type=float,default=0,help="Latency added to every S3 and DynamoDB read")
+    parser.add_argument("--set",action="append",default=[],help="Engine environment variable NAME=VALUE (repeatable), eg. TIMELINE_MODE=channel")
+    parser.add_argument("--report-every",type=float,default=10)
+    parser.add_argument("--json",action="store_true",help="Print the final report as JSON")
+    args = parser.parse_args()
+
+    for setting in args.set:
+        name, value = setting.split("=",1)
+        os.environ[name] = value
+
+    s3_client, db_client, client_id = fixtures.buildChannel(asset_length=args.asset_length,segment_duration=args.segment_duration,
+        sliding_window=args.sliding_window,renditions=args.renditions)
+    fixtures.resetEngine(s3_client,db_client,args.sliding_window)
+    s3_client.latency = db_client.latency = args.backend_latency_ms / 1000.0
+
+    ingested = []
+    def ingestAsset():
+        asset_name = "ingested_%s" % (len(ingested))
+        asset = fixtures.putAsset(s3_client,asset_name,args.asset_length,args.segment_duration,args.renditions)
+        fixtures.scheduleAsset(db_client,asset_name,asset,int(time.time() + args.ingest_lead))
+        ingested.append(asset_name)
+        if not args.json:
+            print("Ingested %s" % (asset_name))
+
+    players = [Player(player_id,random.uniform(0,args.join_seconds)) for player_id in range(args.players)]
+    load_test = LoadTest(s3_client,db_client,args.workers,verbose=not args.json)
+    ingest_at = [float(offset) for offset in args.ingest_at.split(",") if offset]
+    report = load_test.run(players,args.duration,ingest_at,args.report_every,ingestAsset)
+    report['ingested'] = ingested
+
+    if args.json:
+        print(json.dumps(report,indent=2))
+        return
+
+    print("")
+    print("%d requests in %.1fs, %.1f req/s, backend calls per request : %s" % (report['requests'],report['elapsed_seconds'],
+        report['requests_per_second'],", ".join("%s %.3f" % (service,calls) for service, calls in report['backend_calls_per_request'].items())))
+    print("%-10s %9s %9s %9s %9s %9s %9s %11s %10s" % ("request","count","req/s","p50 ms","p90 ms","p99 ms","max ms","service p50","error rate"))
+    for request_type in ("bootstrap","redirect","poll"):
+        if request_type not in report['request_types']:
+            continue
+        result = report['request_types'][request_type]
+        print("%-10s %9s %9.1f %9.3f %9.3f %9.3f %9.3f %11.3f %10.5f" % (request_type,result['requests'],result['requests_per_second'],
+            result['p50_ms'],result['p90_ms'],result['p99_ms'],result['max_ms'],result['service_p50_ms'],result['error_rate']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+'''
+Benchmark rendering every rendition playlist of one session at one request time, with the window plan worked out for
+each rendition and with the plan shared between them (see hls_vod_linearizer.windowPlan).
+
+Each request is sampled by the engine metrics, and the report shows the time per rendition spent planning the window
+(schedule walk, loop arithmetic and segment window selection), emitting the segment lines and assembling the playlist.
+With a shared plan only the first rendition of a window plans it, the others only emit and assemble. Stage timings
+are medians over every request, wall time is the median per rendition over every window.
+
+Usage:
+    python benchmarks/bench_renditions.py
+    python benchmarks/bench_renditions.py --sliding-windows 30,300,3600 --renditions 8 --iterations 100
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+import fixtures
+import hls_vod_linearizer
+
+
+def median(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2]
+
+
+def renderRenditions(client_id,renditions,shared_plan):
+    '''
+    Request every rendition once, returns the wall time per rendition and the engine stage timings of every request in ms
+    '''
+    stages = []
+    started = time.perf_counter()
+    metrics_output = io.StringIO()
+    with contextlib.redirect_stdout(metrics_output):
+        for rendition in range(renditions):
+            if not shared_plan:
+                hls_vod_linearizer.WINDOW_PLAN_CACHE.clear()
+            response = hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id,rendition),None)
+            if response['statusCode'] != 200:
+                raise Exception("Benchmark request failed : %s" % (response))
+    elapsed = time.perf_counter() - started
+
+    for line in metrics_output.getvalue().splitlines():
+        emf = json.loads(line)
+        stages.append(dict((stage_name,emf.get(stage_name,0)) for stage_name in ("plan","render","assemble")))
+    return elapsed * 1000 / renditions, stages
+
+
+def benchmarkWindow(sliding_window,args):
+    s3_client, db_client, client_id = fixtures.buildChannel(asset_length=args.asset_length,segment_duration=args.segment_duration,
+        sliding_window=sliding_window,history=args.history,session_age=args.session_age,renditions=args.renditions)
+    fixtures.resetEngine(s3_client,db_client,sliding_window)
+    # every request is timed stage by stage
+    hls_vod_linearizer.CONFIG['metrics_sample_rate'] = 1
+
+    # warm the manifest and schedule caches
+    renderRenditions(client_id,args.renditions,True)
+
+    rows = []
+    for shared_plan in (False,True):
+        wall_times = []
+        stages = []
+        for iteration in range(args.iterations):
+            # a new window every iteration, as when a segment is added to the playlist
+            hls_vod_linearizer.WINDOW_PLAN_CACHE.clear()
+            wall_time, request_stages = renderRenditions(client_id,args.renditions,shared_plan)
+            wall_times.append(wall_time)
+            stages.extend(request_stages)
+        rows.append({
+            "sliding_window":sliding_window,
+            "plan":"shared" if shared_plan else "per rendition",
+            "ms_per_rendition":round(median(wall_times),4),
+            "plan_ms":round(median([request['plan'] for request in stages]),4),
+            "render_ms":round(median([request['render'] for request in stages]),4),
+            "assemble_ms":round(median([request['assemble'] for request in stages]),4)
+        })
+    hls_vod_linearizer.CONFIG['metrics_sample_rate'] = 0
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering every rendition from one window plan")
+    parser.add_argument("--iterations",type=int,default=200)
+    parser.add_argument("--sliding-windows",default="30,300,1800")
+    parser.add_argument("--renditions",type=int,default=6)
+    parser.add_argument("--asset-length",type=int,default=600)
+    parser.add_argument("--segment-duration",type=int,default=2)
+    parser.add_argument("--history",type=int,default=10)
+    parser.add_argument("--session-age",type=int,default=3600)
+    parser.add_argument("--json",action="store_true",help="Print results as JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('METRICS_SAMPLE_RATE','0')
+    rows = []
+    for sliding_window in [int(sliding_window) for sliding_window in args.sliding_windows.split(",")]:
+        rows.extend(benchmarkWindow(sliding_window,args))
+
+    if args.json:
+        print(json.dumps(rows,indent=2))
+        return
+
+    print("%14s  %-14s %12s %10s %10s %12s" % ("sliding window","plan","ms/rendition","plan ms","render ms","assemble ms"))
+    for row in rows:
+        print("%14s  %-14s %12.4f %10.4f %10.4f %12.4f" % (row['sliding_window'],row['plan'],row['ms_per_rendition'],row['plan_ms'],row['render_ms'],row['assemble_ms']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+'''
+Synthetic channels for the linearizer benchmarks. Assets, schedules and clients are written to the in-memory
+S3 and DynamoDB stand-ins from local_backends.py, with every time relative to the current wall clock so the
+handler can be driven without patching its clock.
+'''
+
+import os
+import sys
+import math
+import time
+import logging
+import importlib
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_vod_linearizer
+import local_backends
+
+vod_content_ingest = importlib.import_module("vod-content-ingest")
+
+BUCKET = "vod-bucket"
+TENANT = "00001"
+CHANNEL = "bench"
+
+
+def masterManifest(asset_name,renditions):
+    master_lines = ["#EXTM3U","#EXT-X-VERSION:3","#EXT-X-INDEPENDENT-SEGMENTS"]
+    for rendition in range(renditions):
+        master_lines.append('#EXT-X-STREAM-INF:BANDWIDTH=%s,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"' % ((rendition+1)*1500000))
+        master_lines.append("%s_%s.m3u8" % (asset_name,rendition))
+    return "\n".join(master_lines) + "\n"
+
+
+def childManifest(asset_name,rendition,asset_length,segment_duration,segment_durations=None):
+    '''
+    Child playlist of asset_length seconds of segment_duration second segments, or of segments of segment_durations
+    '''
+    if segment_durations is None:
+        segment_durations = [segment_duration] * int(asset_length // segment_duration)
+    child_lines = ["#EXTM3U","#EXT-X-VERSION:3","#EXT-X-TARGETDURATION:%s" % (int(math.ceil(max(segment_durations)))),"#EXT-X-MEDIA-SEQUENCE:1","#EXT-X-PLAYLIST-TYPE:VOD"]
+    for segment, duration in enumerate(segment_durations):
+        child_lines.append("#EXTINF:%s," % (duration))
+        child_lines.append("%s_%s_%05d.ts" % (asset_name,rendition,segment+1))
+    child_lines.append("#EXT-X-ENDLIST")
+    return "\n".join(child_lines) + "\n", len(segment_durations)
+
+
+def putAsset(s3_client,asset_name,asset_length,segment_duration,renditions,segment_index=True,segment_durations=None):
+    '''
+    Write a MediaConvert style HLS package to S3, with the segment indexes ingest writes unless segment_index is False.
+    segment_durations gives uneven segments instead of asset_length seconds of segment_duration second ones.
+    Returns the schedule attributes of the asset
+    '''
+    prefix = "assets/%s/" % (asset_name)
+    s3_client.put_object(Bucket=BUCKET,Key=prefix+asset_name+".m3u8",Body=masterManifest(asset_name,renditions))
+    segment_indexes = []
+    for rendition in range(renditions):
+        child_key = "%s%s_%s.m3u8" % (prefix,asset_name,rendition)
+        child_manifest, segments = childManifest(asset_name,rendition,asset_length,segment_duration,segment_durations)
+        s3_client.put_object(Bucket=BUCKET,Key=child_key,Body=child_manifest)
+        if segment_index:
+            segment_indexes.append(vod_content_ingest.analyseRendition(s3_client,"s3://%s/%s" % (BUCKET,child_key)))
+    duration = segments*segment_duration if segment_durations is None else sum(segment_durations)
+    asset = {"location":"s3://%s/%s%s.m3u8" % (BUCKET,prefix,asset_name),"duration":duration,"segments":segments}
+    if segment_index:
+        asset['segmentindex'] = vod_content_ingest.SEGMENT_INDEX_VERSION
+        asset['segmenttimeline'] = vod_content_ingest.segmentTimeline(segment_indexes[0]['durations'])
+    return asset
+
+
+def scheduleItem(endtimeepoch,asset_name,asset):
+    item = {
+        "endtimeepoch":{"N":str(endtimeepoch)},
+        "assetname":{"S":asset_name},
+        "assetlocation":{"S":asset['location']},
+        "duration":{"N":str(asset['duration'])},
+        "segments":{"N":str(asset['segments'])},
+        "genre":{"S":"demo"}
+    }
+    if 'segmentindex' in asset:
+        item['segmentindex'] = {"S":asset['segmentindex']}
+    if 'segmenttimeline' in asset:
+        item['segmenttimeline'] = {"S":asset['segmenttimeline']}
+    return item
+
+
+def buildChannel(asset_length=600,segment_duration=6,sliding_window=30,history=0,session_age=300,renditions=3,now=None,segment_index=True):
+    '''
+    Build backends holding one tenant with a now playing asset, <history> schedule changes during the session, and a
+    client whose session started <session_age> seconds ago. Returns (s3_client, db_client, client_id)
+    '''
+    now = int(time.time()) if now is None else now
+    s3_client = local_backends.MemoryS3()
+    db_client = local_backends.MemoryDynamoDB()
+    db_client.createTable("%s_ContentManagement" % (TENANT),"endtimeepoch")
+    db_client.createTable("%s_ContentLibrary" % (TENANT),"assetname")
+    db_client.createTable("%s_Clients" % (TENANT),"client_id")
+
+    session_start = now - session_age
+
+    # history items cycle through a handful of packages, each schedule change still costs the engine a lookup
+    history_assets = [putAsset(s3_client,"history_%s" % (n),asset_length,segment_duration,renditions,segment_index) for n in range(min(history,4))]
+    history_end = now - sliding_window - 1
+    for n in range(history):
+        endtimeepoch = session_start + int((n+1) * (history_end - session_start) / (history + 1))
+        db_client.put_item(TableName="%s_ContentManagement" % (TENANT),Item=scheduleItem(endtimeepoch,"history_%s" % (n % 4),history_assets[n % 4]))
+
+    now_playing = putAsset(s3_client,"now_playing",asset_length,segment_duration,renditions,segment_index)
+    db_client.put_item(TableName="%s_ContentManagement" % (TENANT),Item=scheduleItem(hls_vod_linearizer.NOW_PLAYING_EPOCH,"now_playing",now_playing))
+
+    client_id = "bench-client"
+    db_client.put_item(TableName="%s_Clients" % (TENANT),Item={"client_id":{"S":client_id},"session_start":{"N":str(session_start)}})
+
+    s3_client.calls.clear()
+    db_client.calls.clear()
+    return s3_client, db_client, client_id
+
+
+def scheduleAsset(db_client,asset_name,asset,now=None):
+    '''
+    Make an asset the now playing item from now on, writing the schedule the way vod-content-ingest.py does when a
+    MediaConvert job completes : the current now playing row is moved to end now, and the schedule version is bumped
+    '''
+    now = int(time.time()) if now is None else now
+    table_name = "%s_ContentManagement" % (TENANT)
+    now_playing_key = {"endtimeepoch":{"N":hls_vod_linearizer.NOW_PLAYING_EPOCH}}
+    now_playing = db_client.get_item(TableName=table_name,Key=now_playing_key).get('Item')
+    if now_playing is not None:
+        db_client.delete_item(TableName=table_name,Key=now_playing_key)
+        db_client.put_item(TableName=table_name,Item=dict(now_playing,endtimeepoch={"N":str(now)}))
+    new_playing = scheduleItem(hls_vod_linearizer.NOW_PLAYING_EPOCH,asset_name,asset)
+    new_playing['scheduleversion'] = {"N":str(int(time.time() * 1000))}
+    db_client.put_item(TableName=table_name,Item=new_playing)
+
+
+def masterEvent(client_id=None):
+    path = "/%s/%s.m3u8" % (TENANT,CHANNEL)
+    return {
+        "path":path,
+        "queryStringParameters":{"client_id":client_id} if client_id else None,
+        "requestContext":{"domainName":"bench.example.com","path":"/v1"+path}
+    }
+
+
+def childEvent(client_id,rendition=0):
+    path = "/%s/%s/%s.m3u8" % (TENANT,CHANNEL,rendition)
+    return {
+        "path":path,
+        "queryStringParameters":{"client_id":client_id},
+        "requestContext":{"domainName":"bench.example.com","path":"/v1"+path}
+    }
+
+
+def resetEngine(s3_client,db_client,sliding_window):
+    '''
+    Point the engine at fresh backends with cold process caches
+    '''
+    os.environ['SLIDING_WINDOW'] = str(sliding_window)
+    os.environ.setdefault('CDN','d1234abcd.cloudfront.net')
+    logging.disable(logging.CRITICAL)
+    hls_vod_linearizer.reloadConfig()
+    hls_vod_linearizer.setBackends(db_client=db_client,s3_client=s3_client)
+    for cache in (hls_vod_linearizer.MANIFEST_CACHE,hls_vod_linearizer.SCHEDULE_CACHE,hls_vod_linearizer.RENDERED_PLAYLIST_CACHE,hls_vod_linearizer.WINDOW_PLAN_CACHE):
+        cache.clear()
@@ -26,44 +26,1661 @@ Original Author: Scott Cunningham
 
 import json
 import logging
-import boto3
 import time
 import datetime
 import uuid
+import hmac
+import hashlib
+import base64
+import random
+import gzip
 import os
 import math
+import bisect
+import array
+import threading
+import concurrent.futures
+import collections
+
+# brotli is optional, responses fall back to gzip when it isn't packaged with the function
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# endtimeepoch of the schedule item that is playing until another asset is ingested
+NOW_PLAYING_EPOCH = "999999999999"
+
 '''
 DynamoDB database names
 00001_ContentLibrary
 00001_ContentManagement
+00001_ChannelSchedule
 00001_Clients
 '''
 
+class SegmentTable(object):
+    '''
+    Compact segment table of one rendition, parsed once and kept in the manifest cache. Segment end offsets (in seconds
+    from the start of the asset) are held in an array of doubles, each segment's EXTINF line as an index into the few
+    distinct EXTINF lines of the rendition, and the segment URIs either as a numbered pattern or as offsets into one
+    shared byte buffer. Output lines are only encoded for the segments a playlist window renders.
+    '''
+    __slots__ = ("headers","segment_ends","timeline","extinf_lines","extinf_ids","uri_pattern","uri_buffer","uri_offsets")
+
+    def __init__(self,headers,segment_ends,extinf_lines,extinf_ids,uri_pattern=None,uri_buffer=None,uri_offsets=None):
+        self.headers = headers
+        self.segment_ends = segment_ends
+        # digest of the segment end offsets, renditions with the same digest share window plans
+        self.timeline = hashlib.blake2b(segment_ends.tobytes(),digest_size=16).digest()
+        self.extinf_lines = extinf_lines
+        self.extinf_ids = extinf_ids
+        self.uri_pattern = uri_pattern
+        self.uri_buffer = uri_buffer
+        self.uri_offsets = uri_offsets
+
+    def __len__(self):
+        return len(self.segment_ends)
+
+    def uriLine(self,position):
+        '''
+        URI line of a segment, with its newline, as bytes
+        '''
+        if self.uri_pattern is not None:
+            prefix, width, first, suffix = self.uri_pattern
+            return b"%s%0*d%s\n" % (prefix,width,first + position,suffix)
+        return self.uri_buffer[self.uri_offsets[position]:self.uri_offsets[position+1]]
+
+    def fragments(self,child_url,first_segment,last_segment):
+        '''
+        Output lines of the segments first_segment -> last_segment for one segment base URL, as (head, tail) byte pairs
+        that sit either side of the media sequence number written at request time
+        '''
+        url_line = ("\n"+child_url).encode('utf-8')
+        extinf_lines = self.extinf_lines
+        extinf_ids = self.extinf_ids
+        return [(extinf_lines[extinf_ids[position]],url_line + self.uriLine(position)) for position in range(first_segment,last_segment)]
+
+def segmentTable(headers,segment_ends,extinf_lines,uri_pattern=None,uri_lines=None):
+    '''
+    Build a SegmentTable from the EXTINF line of every segment, and either a (prefix, width, first, suffix) URI pattern
+    or the URI line of every segment
+    '''
+    distinct_lines = dict()
+    extinf_ids = [distinct_lines.setdefault(line,len(distinct_lines)) for line in extinf_lines]
+
+    uri_buffer = None
+    uri_offsets = None
+    if uri_pattern is None:
+        encoded_lines = [line.encode('utf-8') for line in uri_lines]
+        uri_offsets = array.array('I',[0])
+        for line in encoded_lines:
+            uri_offsets.append(uri_offsets[-1] + len(line))
+        uri_buffer = b"".join(encoded_lines)
+
+    return SegmentTable(
+        headers,
+        array.array('d',segment_ends),
+        [line.encode('utf-8') for line in distinct_lines],
+        array.array('H' if len(distinct_lines) <= 65536 else 'I',extinf_ids),
+        uri_pattern,
+        uri_buffer,
+        uri_offsets
+    )
+
+def parseChildManifest(childmanifestraw):
+    '''
+    Parse a VOD child playlist once into a segment table. Only used for assets ingested before segment indexes, see
+    parseSegmentIndex
+    '''
+    manifest_parts = childmanifestraw.split("#")
+
+    extinf_lines = []
+    uri_lines = []
+    segment_ends = []
+    manifest_timeline = 0
+    for line in manifest_parts:
+        if 'EXTINF' in line:
+            manifest_timeline = round(manifest_timeline + float(line.split(",")[0].split(":")[1]),6)
+            head, newline, tail = line.partition("\n")
+            extinf_lines.append("#"+head)
+            uri_lines.append(tail)
+            segment_ends.append(manifest_timeline)
+
+    return segmentTable('#'.join(manifest_parts[0:4]),segment_ends,extinf_lines,uri_lines=uri_lines)
+
+def parseSegmentIndex(segment_index_raw):
+    '''
+    Load the segment index that ingest writes next to each child playlist into the same segment table as
+    parseChildManifest, without parsing the playlist
+    '''
+    segment_index = json.loads(segment_index_raw)
+
+    durations = segment_index['durations']
+    extinf_by_duration = dict((duration,"#EXTINF:%s," % (extinfDuration(duration))) for duration in set(durations))
+    extinf_lines = [extinf_by_duration[duration] for duration in durations]
+
+    if 'uris' in segment_index:
+        return segmentTable(segment_index['headers'],segment_index['offsets'],extinf_lines,uri_lines=[uri + "\n" for uri in segment_index['uris']])
+
+    pattern = segment_index['uri_pattern']
+    uri_pattern = (pattern['prefix'].encode('utf-8'),pattern['width'],pattern['first'],pattern['suffix'].encode('utf-8'))
+    return segmentTable(segment_index['headers'],segment_index['offsets'],extinf_lines,uri_pattern=uri_pattern)
+
+def extinfDuration(duration):
+    return ("%.6f" % (duration)).rstrip("0").rstrip(".")
+
+def segmentIndexKey(playlist_key):
+    '''
+    S3 key of the segment index written by ingest next to a child playlist. vod-content-ingest.py uses the same naming
+    '''
+    return playlist_key.rsplit(".m3u8",1)[0] + ".index.json"
+
+def minimumVersion(child_headers,version):
+    '''
+    Raise the EXT-X-VERSION of the playlist headers to at least version
+    '''
+    header_lines = child_headers.split("\n")
+    for line_number, line in enumerate(header_lines):
+        if line.startswith("#EXT-X-VERSION:") and int(line.split(":")[1]) < version:
+            header_lines[line_number] = "#EXT-X-VERSION:%s" % (version)
+    return "\n".join(header_lines)
+
+def parseMasterManifest(master_manifest_original):
+    '''
+    Parse a VOD master manifest, keeping the original text and the rendition playlist lines in order
+    '''
+    rendition_lines = []
+    for line in master_manifest_original.split('\n'):
+        if ".m3u8" in line:
+            rendition_lines.append(line)
+    return {"manifest":master_manifest_original,"rendition_lines":rendition_lines}
+
+def createSessionToken(session_secret,tenant,session_start):
+    '''
+    Create a signed client_id carrying the tenant and the session start, so rendition polls don't need a Clients table read.
+    Format is v1.<tenant>.<session_start>.<nonce>.<signature>
+    '''
+    payload = "v1.%s.%s.%s" % (tenant,session_start,uuid.uuid4().hex[:8])
+    return "%s.%s" % (payload,sessionSignature(session_secret,payload))
+
+def verifySessionToken(session_secret,tenant,client_id):
+    '''
+    Return the session start of a signed client_id, or None if the token was not signed by us for this tenant
+    '''
+    token_parts = client_id.split(".")
+    if len(token_parts) != 5 or token_parts[0] != "v1" or token_parts[1] != tenant:
+        return None
+    payload = client_id.rsplit(".",1)[0]
+    if not hmac.compare_digest(sessionSignature(session_secret,payload),token_parts[4]):
+        return None
+    try:
+        return int(token_parts[2])
+    except ValueError:
+        return None
+
+def isSessionToken(client_id):
+    return client_id.startswith("v1.")
+
+def sessionSignature(session_secret,payload):
+    digest = hmac.new(session_secret.encode('utf-8'),payload.encode('utf-8'),hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode('utf-8')
+
+class RequestMetrics(object):
+    '''
+    Stage timings and backend counters for one sampled request. Emitted as a single CloudWatch embedded metric format
+    (EMF) line, and optionally returned to the client in a Server-Timing header.
+    '''
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+
+    def stage(self,stage_name):
+        return MetricsStage(self,stage_name)
+
+    def addStage(self,stage_name,started):
+        self.stages[stage_name] = self.stages.get(stage_name,0) + time.perf_counter() - started
+
+    def count(self,counter_name,value=1):
+        self.counters[counter_name] += value
+
+    def serverTiming(self,total):
+        server_timing = ["%s;dur=%.3f" % (stage_name,seconds * 1000) for stage_name, seconds in self.stages.items()]
+        server_timing.append("total;dur=%.3f" % (total * 1000))
+        return ", ".join(server_timing)
+
+    def embeddedMetricFormat(self,dimensions,total):
+        metric_values = dict()
+        metric_definitions = []
+        for stage_name, seconds in self.stages.items():
+            metric_values[stage_name] = round(seconds * 1000,3)
+            metric_definitions.append({"Name":stage_name,"Unit":"Milliseconds"})
+        metric_values['total'] = round(total * 1000,3)
+        metric_definitions.append({"Name":"total","Unit":"Milliseconds"})
+        for counter_name, value in self.counters.items():
+            metric_values[counter_name] = value
+            metric_definitions.append({"Name":counter_name,"Unit":"Bytes" if counter_name.endswith("_bytes") else "Count"})
+
+        emf = {
+            "_aws":{
+                "Timestamp":int(time.time() * 1000),
+                "CloudWatchMetrics":[{
+                    "Namespace":METRICS_NAMESPACE,
+                    "Dimensions":[["RequestType"],["Tenant","RequestType"]],
+                    "Metrics":metric_definitions
+                }]
+            }
+        }
+        emf.update(dimensions)
+        emf.update(metric_values)
+        return emf
+
+class MetricsStage(object):
+    def __init__(self,request_metrics,stage_name):
+        self.request_metrics = request_metrics
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.request_metrics.addStage(self.stage_name,self.started)
+        return False
+
+class NullMetrics(object):
+    '''
+    Stand-in for requests that are not sampled, every call is a no-op
+    '''
+    def stage(self,stage_name):
+        return NULL_STAGE
+
+    def addStage(self,stage_name,started):
+        pass
+
+    def count(self,counter_name,value=1):
+        pass
+
+class NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+class RequestProfiler(object):
+    '''
+    cProfile and tracemalloc around one request. tracemalloc traces the whole process, so only one request is profiled
+    at a time (see PROFILE_LOCK). The profiling modules are only imported once a request is profiled
+    '''
+    def __init__(self):
+        import cProfile
+        import tracemalloc
+        self.tracemalloc = tracemalloc
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.snapshot = self.tracemalloc.take_snapshot()
+        self.peak_bytes = self.tracemalloc.get_traced_memory()[1]
+        self.tracemalloc.stop()
+
+    def report(self,event,response):
+        '''
+        Text report : the request, the functions taking the most cumulative CPU time and the lines allocating the most memory
+        '''
+        import io
+        import pstats
+        report = io.StringIO()
+        report.write("path : %s\nquery : %s\nstatus : %s\npeak traced memory : %s bytes\n\n" % (event.get('path'),
+            event.get('queryStringParameters'),response.get('statusCode',response.get('blockUntil')),self.peak_bytes))
+        pstats.Stats(self.profile,stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        report.write("Top allocators\n")
+        for statistic in self.snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATORS]:
+            report.write("%s\n" % (statistic))
+        return report.getvalue()
+
+    def write(self,event,response):
+        '''
+        Write the text report and the raw pstats dump to PROFILE_DESTINATION, a local directory or s3://bucket/prefix/.
+        Returns the location of the text report
+        '''
+        import marshal
+        request_path_to_list = event.get('path','').split("/")
+        tenant = request_path_to_list[1] if len(request_path_to_list) > 1 else "unknown"
+        report_name = "%s/%s-%s" % (tenant,datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S'),uuid.uuid4().hex[:8])
+
+        # the raw stats are dumped first, pstats.Stats takes them over from the profile
+        self.profile.create_stats()
+        reports = {".pstats":marshal.dumps(self.profile.stats)}
+        reports['.txt'] = self.report(event,response).encode('utf-8')
+
+        destination = CONFIG['profile_destination']
+        if destination.startswith("s3://"):
+            bucket = destination.split("/")[2]
+            prefix = '/'.join(destination.split("/")[3:])
+            for extension, body in reports.items():
+                backendClient('s3').put_object(Bucket=bucket,Key=prefix+report_name+extension,Body=body)
+            return "s3://%s/%s%s.txt" % (bucket,prefix,report_name)
+
+        for extension, body in reports.items():
+            file_path = os.path.join(destination,report_name+extension)
+            os.makedirs(os.path.dirname(file_path),exist_ok=True)
+            with open(file_path,'wb') as report_file:
+                report_file.write(body)
+        return os.path.join(destination,report_name+".txt")
+
+def createProfileToken(profile_secret,expires_epoch):
+    '''
+    Value of the X-Linearizer-Profile header that asks for a request to be profiled, valid until expires_epoch
+    '''
+    payload = "profile.%s" % (expires_epoch)
+    return "%s.%s" % (payload,sessionSignature(profile_secret,payload))
+
+def profileRequested(event):
+    '''
+    True if a request is to be profiled : sampled at PROFILE_SAMPLE_RATE, or carrying an unexpired X-Linearizer-Profile
+    header signed with PROFILE_SECRET
+    '''
+    if CONFIG['profile_sample_rate'] > 0 and random.random() < CONFIG['profile_sample_rate']:
+        return True
+    if not CONFIG['profile_secret']:
+        return False
+    headers = event.get('headers') or {}
+    for header_name in headers:
+        if header_name.lower() == "x-linearizer-profile":
+            token_parts = (headers[header_name] or "").split(".")
+            if len(token_parts) != 3 or token_parts[0] != "profile" or not token_parts[1].isdigit() or int(token_parts[1]) < time.time():
+                return False
+            return hmac.compare_digest(sessionSignature(CONFIG['profile_secret'],"profile.%s" % (token_parts[1])),token_parts[2])
+    return False
+
+# marker placed between loops and assets in the list of segment fragments
+DISCONTINUITY_FRAGMENT = None
+DISCONTINUITY_LINE = b"#EXT-X-DISCONTINUITY\n"
+
+# EXT-X-SKIP needs protocol version 9
+SKIP_PLAYLIST_VERSION = 9
+
+# blocking reloads for more than this many segments past the end of the playlist are rejected
+BLOCKING_RELOAD_MAX_AHEAD = 2
+# seconds of Lambda time kept back to return the response when a blocking reload times out
+BLOCKING_RELOAD_MARGIN = 1
+# times a held blocking reload is rendered again before it is answered with a 503
+BLOCKING_RELOAD_MAX_RENDERS = 16
+
+# seconds either side of a segment boundary within which a window plan isn't reused, covers float rounding of offsets
+WINDOW_PLAN_MARGIN = 0.001
+
+# seconds of Lambda time kept back when publishing, so the last tick is written before the function times out
+PUBLISH_MARGIN = 2
+
+# seconds of Lambda time kept back from the request budget, so a timed out backend call still returns an error response
+REQUEST_BUDGET_MARGIN = 0.5
+
+# hedged manifest reads : the hedge delay is the HEDGE_PERCENTILE of the last HEDGE_LATENCY_SAMPLES read latencies,
+# recomputed every HEDGE_RECOMPUTE_EVERY reads. Reads aren't hedged until HEDGE_MIN_SAMPLES latencies are known
+HEDGE_LATENCY_SAMPLES = 512
+HEDGE_MIN_SAMPLES = 20
+HEDGE_RECOMPUTE_EVERY = 16
+HEDGE_MIN_DELAY = 0.005
+
+# profiling reports : number of functions and of allocating lines listed, and traceback depth traced by tracemalloc
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATORS = 25
+PROFILE_TRACEBACK_FRAMES = 1
+# held by the request being profiled
+PROFILE_LOCK = threading.Lock()
+
+NULL_METRICS = NullMetrics()
+NULL_STAGE = NullStage()
+METRICS_NAMESPACE = "HlsVodLinearizer"
+
+# metrics of the request being handled on this thread
+METRICS_CONTEXT = threading.local()
+
+def currentMetrics():
+    return getattr(METRICS_CONTEXT,'metrics',NULL_METRICS)
+
+# deadline (epoch seconds) of the request being handled on this thread
+DEADLINE_CONTEXT = threading.local()
+
+def remainingBudget():
+    '''
+    Seconds left before the deadline of the request being handled, None outside of a request or without a budget
+    '''
+    deadline = getattr(DEADLINE_CONTEXT,'deadline',None)
+    return None if deadline is None else deadline - time.time()
+
+class ManifestCache(object):
+    '''
+    Process wide LRU cache of parsed S3 manifests. VOD outputs are immutable, so the cache lives outside of
+    lambda_handler and survives warm invocations. Entries older than the TTL are revalidated with a conditional
+    GET on the ETag rather than downloaded and parsed again. A manifest is only fetched once at a time, requests that
+    miss on a manifest being fetched wait for that fetch rather than going to S3 as well.
+    '''
+    def __init__(self,max_entries,ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.loading = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self,s3_client,bucket,key,parser):
+        cache_key = (bucket,key)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                self.entries.move_to_end(cache_key)
+                if now - entry['checked'] < self.ttl:
+                    self.hits += 1
+                    currentMetrics().count("manifest_cache_hits")
+                    return entry['parsed']
+            loading = self.loading.get(cache_key)
+            if loading is None:
+                loading = self.loading[cache_key] = concurrent.futures.Future()
+                fetching = True
+            else:
+                self.coalesced += 1
+                fetching = False
+
+        if not fetching:
+            currentMetrics().count("manifest_coalesced")
+            try:
+                return loading.result(remainingBudget())
+            except concurrent.futures.TimeoutError:
+                raise BackendTimeout("No response for s3://%s/%s within the request budget" % (bucket,key))
+
+        try:
+            parsed = self.load(s3_client,bucket,key,parser,entry,now)
+            loading.set_result(parsed)
+            return parsed
+        except Exception as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.loading.pop(cache_key,None)
+
+    def load(self,s3_client,bucket,key,parser,entry,now):
+        '''
+        Fetch and parse a manifest, revalidating the cached entry when there is one
+        '''
+        cache_key = (bucket,key)
+        get_object_args = {"Bucket":bucket,"Key":key}
+        if entry is not None and entry['etag']:
+            get_object_args['IfNoneMatch'] = entry['etag']
+
+        request_metrics = currentMetrics()
+        request_metrics.count("s3_calls")
+        try:
+            LOGGER.debug("Getting object from S3 : s3://%s/%s" % (bucket,key))
+            response = backendCall(s3_client.get_object,True,**get_object_args)
+        except Exception as e:
+            if 'IfNoneMatch' not in get_object_args or not isNotModified(e):
+                raise
+            LOGGER.debug("Object not modified since last fetch, reusing cached copy : s3://%s/%s" % (bucket,key))
+            request_metrics.count("s3_not_modified")
+            with self.lock:
+                entry['checked'] = now
+                self.revalidations += 1
+            return entry['parsed']
+
+        manifest_body = response['Body'].read()
+        request_metrics.count("s3_bytes",len(manifest_body))
+        parsed = parser(manifest_body.decode('utf-8'))
+
+        with self.lock:
+            self.misses += 1
+            self.entries[cache_key] = {"etag":response.get('ETag'),"checked":now,"parsed":parsed}
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return parsed
+
+    def fresh(self,bucket,key):
+        '''
+        True if a manifest is cached and doesn't need revalidating yet
+        '''
+        with self.lock:
+            entry = self.entries.get((bucket,key))
+            return entry is not None and time.monotonic() - entry['checked'] < self.ttl
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries":len(self.entries),
+                "hits":self.hits,
+                "misses":self.misses,
+                "revalidations":self.revalidations,
+                "evictions":self.evictions,
+                "coalesced":self.coalesced
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class LRUCache(object):
+    '''
+    Small thread safe LRU cache with hit/miss counters
+    '''
+    def __init__(self,max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self,key,value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self,key,value):
+        '''
+        Put value unless key is already cached, returns whether it was added
+        '''
+        with self.lock:
+            if key in self.entries:
+                return False
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def discard(self,key):
+        with self.lock:
+            self.entries.pop(key,None)
+
+    def stats(self):
+        with self.lock:
+            return {"entries":len(self.entries),"hits":self.hits,"misses":self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class BackendTimeout(Exception):
+    '''
+    Raised when a backend call hasn't answered before the request deadline
+    '''
+
+class ReadLatencies(object):
+    '''
+    Latencies of the latest manifest reads, the hedge delay is their HEDGE_PERCENTILE
+    '''
+    def __init__(self,max_samples):
+        self.samples = collections.deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+        self.added = 0
+        self.delay = None
+
+    def add(self,seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.added += 1
+            if len(self.samples) >= HEDGE_MIN_SAMPLES and (self.delay is None or self.added % HEDGE_RECOMPUTE_EVERY == 0):
+                ordered = sorted(self.samples)
+                self.delay = max(HEDGE_MIN_DELAY,ordered[min(len(ordered)-1,int(CONFIG['hedge_percentile'] * len(ordered)))])
+
+    def hedgeDelay(self):
+        return self.delay
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.delay = None
+
+def isNotModified(e):
+    '''
+    True if a botocore exception is the 304 returned by a conditional GET
+    '''
+    response = getattr(e,'response',None) or {}
+    if response.get('ResponseMetadata',{}).get('HTTPStatusCode') == 304:
+        return True
+    return response.get('Error',{}).get('Code') in ("304","NotModified")
+
+class ScheduleCache(object):
+    '''
+    Process wide snapshot of each ContentManagement table, or of each channel of a ChannelSchedule table, sorted by
+    endtimeepoch. The schedule is only read again once the TTL has expired and the schedule version stamped on the now
+    playing row by the ingest function has changed.
+    Channel schedules are read with a Query for the items ending after the oldest session start served so far (since),
+    a request for an older session start widens the snapshot.
+    '''
+    def __init__(self,ttl,max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.snapshots = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.version_checks = 0
+        self.loads = 0
+
+    def get(self,db_client,table_name,channel=None,since=None):
+        now = time.monotonic()
+        snapshot_key = (table_name,channel)
+        since = None if channel is None else (since or 0)
+
+        with self.lock:
+            snapshot = self.snapshots.get(snapshot_key)
+            covered = snapshot is not None and scheduleCovers(snapshot,since)
+            if covered and now - snapshot['checked'] < self.ttl:
+                self.hits += 1
+                return snapshot
+
+        if covered and snapshot['version'] is not None:
+            with self.lock:
+                self.version_checks += 1
+            if scheduleVersion(db_client,table_name,channel) == snapshot['version']:
+                with self.lock:
+                    snapshot['checked'] = now
+                return snapshot
+
+        # a snapshot only ever widens, so sessions that started earlier keep being served from it
+        if snapshot is not None and snapshot['since'] is not None:
+            since = min(since,snapshot['since'])
+
+        snapshot = self.load(db_client,table_name,now,channel,since)
+        with self.lock:
+            self.loads += 1
+            snapshot['generation'] = self.loads
+            self.snapshots[snapshot_key] = snapshot
+        return snapshot
+
+    def load(self,db_client,table_name,now,channel=None,since=None):
+        LOGGER.debug("Loading schedule snapshot from DynamoDB table : %s, channel : %s" % (table_name,channel))
+        items = []
+        if channel is None:
+            read_args = {"TableName":table_name}
+            read_call = db_client.scan
+        else:
+            read_args = {
+                "TableName":table_name,
+                "KeyConditionExpression":"channel = :channel AND endtimeepoch > :since",
+                "ExpressionAttributeValues":{":channel":{"S":channel},":since":{"N":str(since)}}
+            }
+            read_call = db_client.query
+        request_metrics = currentMetrics()
+        request_metrics.count("schedule_loads")
+        while True:
+            response = backendCall(read_call,**read_args)
+            request_metrics.count("dynamodb_calls")
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            read_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        items.sort(key=lambda item: int(item['endtimeepoch']['N']))
+
+        version = None
+        if len(items) > 0 and items[-1]['endtimeepoch']['N'] == NOW_PLAYING_EPOCH and 'scheduleversion' in items[-1]:
+            version = items[-1]['scheduleversion']['N']
+
+        return {
+            "items":items,
+            "end_times":[int(item['endtimeepoch']['N']) for item in items],
+            "version":version,
+            "since":since,
+            "checked":now,
+            "session_offsets":collections.OrderedDict()
+        }
+
+    def fresh(self,table_name,channel=None,since=None):
+        '''
+        True if get() would be served from the snapshot without reading the table
+        '''
+        since = None if channel is None else (since or 0)
+        with self.lock:
+            snapshot = self.snapshots.get((table_name,channel))
+            return snapshot is not None and scheduleCovers(snapshot,since) and time.monotonic() - snapshot['checked'] < self.ttl
+
+    def sessionOffsets(self,snapshot,session_start_epoch):
+        '''
+        Get the schedule offsets for a session start, computed once per snapshot and session start
+        '''
+        with self.lock:
+            offsets = snapshot['session_offsets'].get(session_start_epoch)
+            if offsets is not None:
+                snapshot['session_offsets'].move_to_end(session_start_epoch)
+                return offsets
+
+        offsets = calculateSessionOffsets(snapshot,session_start_epoch)
+
+        with self.lock:
+            snapshot['session_offsets'][session_start_epoch] = offsets
+            while len(snapshot['session_offsets']) > self.max_sessions:
+                snapshot['session_offsets'].popitem(last=False)
+        return offsets
+
+    def stats(self):
+        with self.lock:
+            return {"tables":len(self.snapshots),"hits":self.hits,"version_checks":self.version_checks,"loads":self.loads}
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+
+def scheduleTimeline(segment_timeline):
+    '''
+    Segment end offsets of a schedule item, from the run length encoded segment durations that ingest stores on the row
+    (see vod-content-ingest.segmentTimeline), or that assetSegmentTimeline reads for rows written before that
+    '''
+    schedule_ends = SCHEDULE_TIMELINES.get(segment_timeline)
+    if schedule_ends is not None:
+        return schedule_ends
+
+    segment_ends = []
+    segment_end = 0
+    for run in segment_timeline.split(","):
+        run_duration, run_segments = run.split(":")
+        for segment in range(int(run_segments)):
+            # rounded as ingest rounds the offsets of the segment index
+            segment_end = round(segment_end + float(run_duration),6)
+            segment_ends.append(segment_end)
+
+    schedule_ends = array.array('d',segment_ends)
+    SCHEDULE_TIMELINES.put(segment_timeline,schedule_ends)
+    return schedule_ends
+
+def encodeSegmentTimeline(segment_ends):
+    '''
+    Run length encoded segment durations of a segment table, as vod-content-ingest.segmentTimeline writes them
+    '''
+    runs = []
+    segment_start = 0
+    for segment_end in segment_ends:
+        duration = round(segment_end - segment_start,6)
+        if len(runs) > 0 and runs[-1][0] == duration:
+            runs[-1][1] += 1
+        else:
+            runs.append([duration,1])
+        segment_start = segment_end
+    return ",".join("%s:%s" % (duration,count) for duration, count in runs)
+
+def assetSegmentTimeline(s3_client,item):
+    '''
+    Segment timeline of a schedule row written before ingest stored one, read from the segment index (or the playlist)
+    of the first rendition of its asset. The durations of short assets can't be told from the asset duration and segment
+    count, so they are read rather than estimated
+    '''
+    asseturl = item['assetlocation']['S']
+    asset_bucket = asseturl.split("/")[2]
+    path_to_object = '/'.join(asseturl.split("/")[3:]).rsplit("/",1)[0] + "/"
+    master_object = MANIFEST_CACHE.get(s3_client,asset_bucket,'/'.join(asseturl.split("/")[3:]),parseMasterManifest)
+    playlist_key = path_to_object + master_object['rendition_lines'][0]
+    if 'segmentindex' in item:
+        child_timeline = MANIFEST_CACHE.get(s3_client,asset_bucket,segmentIndexKey(playlist_key),parseSegmentIndex)
+    else:
+        child_timeline = MANIFEST_CACHE.get(s3_client,asset_bucket,playlist_key,parseChildManifest)
+    return encodeSegmentTimeline(child_timeline.segment_ends)
+
+def loopSegments(schedule_ends,loop_offset):
+    '''
+    Number of segments of a loop that have finished playing loop_offset seconds into it. The one rule for the loop
+    playing now and for the last loop of a finished item, so media sequence numbers don't move when an item ends
+    '''
+    return bisect.bisect_right(schedule_ends,loop_offset)
+
+def loopPosition(elapsed,duration):
+    '''
+    Number of complete loops of an asset after elapsed seconds, and the offset into the loop playing
+    '''
+    loops, loop_offset = divmod(elapsed,duration)
+    return int(loops), loop_offset
+
+def windowPlan(session_schedule,time_window_start,time_window_end,segment_timelines):
+    '''
+    Work out which segments a playlist window holds, from the session schedule and the segment table of each item the
+    window covers : runs of (item position, first segment, last segment), with a discontinuity before every loop after
+    the first, and the media and discontinuity sequences. Segments are counted on the schedule timeline of each item
+    (see scheduleTimeline) as calculateSessionOffsets counts them, and only the segment end offsets of the renditions are
+    used, so every rendition with the same segment timelines renders from the same plan, see windowPlanCovers for how
+    long it holds
+    '''
+    item_media_sequence = session_schedule['media_sequence']
+    item_discontinuity_sequence = session_schedule['discontinuity_sequence']
+
+    assetstartepoch = session_schedule['asset_start_epoch']
+
+    # media sequence and discontinuity sequence of the first segment in the window, and of the next segment to play
+    media_sequence = None
+    discontinuity_sequence = None
+    next_media_sequence = item_media_sequence
+    next_discontinuity_sequence = item_discontinuity_sequence
+    # time at which the next segment finishes playing, and so is added to the playlist
+    next_segment_epoch = time_window_end + 1
+    # time at which the first segment of the window finishes playing, it leaves the window sliding_window seconds later
+    first_segment_epoch = None
+    runs = []
+
+    # end time (seconds from the start of the playlist) and list position of every segment, for delta updates
+    segment_end_times = []
+    segment_positions = []
+    playlist_duration = 0
+    playlist_length = 0
+
+    for item_position, (item, child_timeline) in enumerate(zip(session_schedule['schedule'],segment_timelines)):
+        endtimeepoch = int(item['EndTimeEpoch'])
+        segments = int(item['AssetSegments'])
+        duration = float(item['AssetDuration'])
+        schedule_ends = scheduleTimeline(item['SegmentTimeline'])
+        segment_ends = child_timeline.segment_ends
+
+        epoch_start = max(time_window_start,assetstartepoch)
+        epoch_end = min(time_window_end,endtimeepoch)
+        item_finished = endtimeepoch <= time_window_end
+
+        loops_to_epoch_start,manifest_start = loopPosition(epoch_start - assetstartepoch,duration)
+        loops_to_epoch_end,epoch_end_offset = loopPosition(epoch_end - assetstartepoch,duration)
+
+        # only the loops the window overlaps are rendered, every loop starts with a discontinuity
+        for loop in range(loops_to_epoch_start,loops_to_epoch_end+1):
+            first_segment = bisect.bisect_left(schedule_ends,manifest_start)
+            if loop < loops_to_epoch_end:
+                last_segment = len(segment_ends)
+            else:
+                last_segment = min(len(segment_ends),loopSegments(schedule_ends,epoch_end_offset))
+
+            if last_segment > first_segment:
+                if media_sequence is None:
+                    media_sequence = item_media_sequence + loop * segments + first_segment
+                    discontinuity_sequence = item_discontinuity_sequence + loop
+                    first_segment_epoch = assetstartepoch + loop * duration + schedule_ends[first_segment]
+                elif first_segment == 0:
+                    runs.append(DISCONTINUITY_FRAGMENT)
+                    playlist_length += 1
+
+                run_start = playlist_duration - (segment_ends[first_segment-1] if first_segment > 0 else 0)
+                segment_positions.extend(range(playlist_length,playlist_length+last_segment-first_segment))
+                segment_end_times.extend(run_start + segment_end for segment_end in segment_ends[first_segment:last_segment])
+                playlist_duration = segment_end_times[-1]
+                runs.append((item_position,first_segment,last_segment))
+                playlist_length += last_segment - first_segment
+            next_media_sequence = item_media_sequence + loop * segments + max(first_segment,last_segment)
+            next_discontinuity_sequence = item_discontinuity_sequence + loop
+            manifest_start = 0
+
+        if not item_finished:
+            loop_start_epoch = assetstartepoch + loops_to_epoch_end * duration
+            if last_segment < len(schedule_ends):
+                next_segment_epoch = loop_start_epoch + schedule_ends[last_segment]
+            else:
+                next_segment_epoch = loop_start_epoch + duration + schedule_ends[0]
+            # the next item's segments are worked out once it starts
+            next_segment_epoch = min(next_segment_epoch,endtimeepoch)
+
+        # media sequence and discontinuity sequence reached at the end of the item, for the next one
+        loops_to_item_end,item_end_offset = loopPosition(endtimeepoch - assetstartepoch,duration)
+        last_loop_segments = loopSegments(schedule_ends,item_end_offset)
+        item_media_sequence += loops_to_item_end * segments + last_loop_segments
+        item_discontinuity_sequence += loops_to_item_end + (1 if last_loop_segments > 0 else 0)
+
+        assetstartepoch = endtimeepoch
+
+    if media_sequence is None:
+        media_sequence = next_media_sequence
+        discontinuity_sequence = next_discontinuity_sequence
+
+    return {
+        "runs":runs,
+        "media_sequence":media_sequence,
+        "discontinuity_sequence":discontinuity_sequence,
+        "next_media_sequence":next_media_sequence,
+        "next_segment_epoch":next_segment_epoch,
+        "segment_end_times":segment_end_times,
+        "segment_positions":segment_positions,
+        "playlist_duration":playlist_duration,
+        "first_segment_epoch":first_segment_epoch,
+        "window_end":time_window_end,
+        "timelines":tuple(child_timeline.timeline for child_timeline in segment_timelines)
+    }
+
+def windowPlanCovers(plan,time_window_start,time_window_end):
+    '''
+    True if a window plan still holds for a later window : no segment has finished playing since, and the first segment
+    hasn't left the window. Windows within WINDOW_PLAN_MARGIN of either boundary are planned again
+    '''
+    if time_window_end < plan['window_end'] or time_window_end >= plan['next_segment_epoch'] - WINDOW_PLAN_MARGIN:
+        return False
+    return plan['first_segment_epoch'] is None or time_window_start < plan['first_segment_epoch'] - WINDOW_PLAN_MARGIN
+
+def calculateSessionOffsets(snapshot,session_start_epoch):
+    '''
+    Walk the schedule once for a session start, and record the media sequence and discontinuity sequence reached at the
+    end of every schedule item. Items that ended before the session started keep the starting values.
+    Every loop of an asset starts with a discontinuity, the discontinuity sequence counts the loops started.
+    '''
+    media_sequence_offsets = []
+    discontinuity_sequence_offsets = []
+
+    media_sequence = 1
+    discontinuity_sequence = 0
+    assetstartepoch = session_start_epoch
+    for item, endtimeepoch in zip(snapshot['items'],snapshot['end_times']):
+        if endtimeepoch > session_start_epoch:
+            duration = float(item['duration']['N'])
+            segments = int(item['segments']['N'])
+            schedule_ends = scheduleTimeline(item['segmenttimeline']['S'])
+            loops_to_epoch_end,epoch_end_offset = loopPosition(endtimeepoch - assetstartepoch,duration)
+            last_loop_segments = loopSegments(schedule_ends,epoch_end_offset)
+            media_sequence += loops_to_epoch_end * segments + last_loop_segments
+            discontinuity_sequence += loops_to_epoch_end + (1 if last_loop_segments > 0 else 0)
+            assetstartepoch = endtimeepoch
+        media_sequence_offsets.append(media_sequence)
+        discontinuity_sequence_offsets.append(discontinuity_sequence)
+
+    return {"media_sequence":media_sequence_offsets,"discontinuity_sequence":discontinuity_sequence_offsets}
+
+def scheduleItem(item):
+    '''
+    Convert a ContentManagement DB item to the schedule item used by the linearizer
+    '''
+    return {"AssetLocation":item['assetlocation']['S'],"AssetDuration":item['duration']['N'],"EndTimeEpoch":int(item['endtimeepoch']['N']),"AssetSegments":item['segments']['N'],"SegmentIndex":item.get('segmentindex',{}).get('S',''),"SegmentTimeline":item.get('segmenttimeline',{}).get('S',''),"NowPlaying":"False"}
+
+def scheduleCovers(snapshot,since):
+    '''
+    True if a schedule snapshot holds every item ending after since. Scanned snapshots hold the whole table
+    '''
+    return snapshot['since'] is None or snapshot['since'] <= since
+
+def scheduleKey(endtimeepoch,channel=None):
+    '''
+    Key of a schedule row, ContentManagement tables are keyed by endtimeepoch, ChannelSchedule tables by channel and endtimeepoch
+    '''
+    key = {"endtimeepoch":{"N":str(endtimeepoch)}}
+    if channel is not None:
+        key['channel'] = {"S":channel}
+    return key
+
+def scheduleVersion(db_client,table_name,channel=None):
+    '''
+    Get the schedule version that the ingest function stamps on the now playing row
+    '''
+    currentMetrics().count("dynamodb_calls")
+    response = backendCall(db_client.get_item,TableName=table_name,Key=scheduleKey(NOW_PLAYING_EPOCH,channel),ProjectionExpression="scheduleversion")
+    if 'Item' not in response or 'scheduleversion' not in response['Item']:
+        return None
+    return response['Item']['scheduleversion']['N']
+
+def putClient(db_client,clients_db,client_id,session_start_epoch):
+    '''
+    Write the Clients row of a new session
+    '''
+    currentMetrics().count("dynamodb_calls")
+    return backendCall(db_client.put_item,TableName=clients_db,Item={"client_id":{"S":client_id},"session_start":{"N":str(session_start_epoch)}})
+
+def clientRegistered(future):
+    '''
+    Done callback of a Clients write left to finish after the response, the session doesn't depend on it
+    '''
+    if future.exception() is not None:
+        LOGGER.warning("Unable to write client analytics row, got exception: %s" % (future.exception()))
+
+MANIFEST_CACHE = ManifestCache(int(os.environ.get('MANIFEST_CACHE_SIZE','512')),int(os.environ.get('MANIFEST_CACHE_TTL','300')))
+RENDERED_PLAYLIST_CACHE = LRUCache(int(os.environ.get('RENDERED_PLAYLIST_CACHE_SIZE','1024')))
+READ_LATENCIES = ReadLatencies(HEDGE_LATENCY_SAMPLES)
+WINDOW_PLAN_CACHE = LRUCache(int(os.environ.get('WINDOW_PLAN_CACHE_SIZE','4096')))
+SCHEDULE_TIMELINES = LRUCache(int(os.environ.get('SCHEDULE_TIMELINES_SIZE','256')))
+SCHEDULE_CACHE = ScheduleCache(int(os.environ.get('SCHEDULE_CACHE_TTL','5')),int(os.environ.get('SESSION_OFFSETS_CACHE_SIZE','4096')))
+
+def acceptedEncoding(event):
+    '''
+    Pick the response encoding from the Accept-Encoding request header : br (when brotli is available), gzip or identity
+    '''
+    headers = event.get('headers') or {}
+    accept_encoding = ""
+    for header_name in headers:
+        if header_name.lower() == "accept-encoding":
+            accept_encoding = headers[header_name] or ""
+
+    accepted = set()
+    for token in accept_encoding.split(","):
+        token_parts = token.strip().split(";")
+        quality = [part.strip() for part in token_parts[1:] if part.strip().startswith("q=")]
+        if len(quality) > 0:
+            # an unreadable q value is taken as 0, so a client header typo doesn't fail the request
+            try:
+                quality_value = float(quality[0][2:])
+            except ValueError:
+                quality_value = 0
+            if not quality_value > 0:
+                continue
+        accepted.add(token_parts[0].strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return "identity"
+
+def playlistResponse(body,content_encoding):
+    '''
+    Build the 200 response for a playlist body. Compressed bodies are returned base64 encoded, so API Gateway passes them
+    to the player as binary
+    '''
+    if isinstance(body,str):
+        body = body.encode('utf-8')
+
+    headers = {
+        "Content-Type": "application/vnd.apple.mpegURL",
+        "Access-Control-Allow-Origin":"*",
+        "Vary":"Accept-Encoding"
+    }
+
+    if content_encoding == "identity" or len(body) < CONFIG['compression_min_bytes']:
+        return {"statusCode": 200,"headers": headers,"body": body.decode('utf-8')}
+
+    with currentMetrics().stage("encode"):
+        if content_encoding == "br":
+            compressed_body = brotli.compress(body,quality=CONFIG['brotli_quality'])
+        else:
+            compressed_body = gzip.compress(body,compresslevel=CONFIG['gzip_level'],mtime=0)
+    headers['Content-Encoding'] = content_encoding
+
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": base64.b64encode(compressed_body).decode('ascii'),
+        "isBase64Encoded": True
+    }
+
+def errorResponse(status_code,message):
+    response_status = {
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "application/vnd.apple.mpegURL",
+            "Access-Control-Allow-Origin":"*"
+        },
+        "body": message
+    }
+    return response_status
+
+# shortest key signed sessions are run with
+SESSION_SECRET_MIN_LENGTH = 32
+
+def loadConfig():
+    '''
+    Read the function configuration from the environment. This runs once per process, local tooling that changes the
+    environment afterwards calls reloadConfig()
+    '''
+    config = {
+        "sliding_window":int(os.environ.get('SLIDING_WINDOW','30')),
+        "cdn_base_url":os.environ.get('CDN',''),
+        "schedule_model":os.environ.get('SCHEDULE_MODEL','table'),
+        "session_mode":os.environ.get('SESSION_MODE','table'),
+        "session_secret":os.environ.get('SESSION_SECRET',''),
+        "session_analytics":os.environ.get('SESSION_ANALYTICS','False') == "True",
+        "bootstrap_mode":os.environ.get('BOOTSTRAP_MODE','redirect'),
+        "timeline_mode":os.environ.get('TIMELINE_MODE','session'),
+        "channel_epoch":int(os.environ.get('CHANNEL_EPOCH','0')),
+        "timeline_snap":int(os.environ.get('TIMELINE_SNAP_SECONDS','6')),
+        "metrics_sample_rate":float(os.environ.get('METRICS_SAMPLE_RATE','0')),
+        "profile_sample_rate":float(os.environ.get('PROFILE_SAMPLE_RATE','0')),
+        "profile_secret":os.environ.get('PROFILE_SECRET',''),
+        "profile_destination":os.environ.get('PROFILE_DESTINATION','/tmp/linearizer-profiles'),
+        "server_timing":os.environ.get('SERVER_TIMING','False') == "True",
+        "max_pool_connections":int(os.environ.get('MAX_POOL_CONNECTIONS','50')),
+        "fanout_workers":int(os.environ.get('FANOUT_WORKERS','8')),
+        "lookahead_seconds":int(os.environ.get('LOOKAHEAD_SECONDS','30')),
+        "connect_timeout":float(os.environ.get('CONNECT_TIMEOUT','1')),
+        "read_timeout":float(os.environ.get('READ_TIMEOUT','3')),
+        "request_budget":float(os.environ.get('REQUEST_BUDGET','2')),
+        "hedge_percentile":float(os.environ.get('HEDGE_PERCENTILE','0.95')),
+        "gzip_level":int(os.environ.get('GZIP_LEVEL','6')),
+        "brotli_quality":int(os.environ.get('BROTLI_QUALITY','5')),
+        "compression_min_bytes":int(os.environ.get('COMPRESSION_MIN_BYTES','1024')),
+        "can_skip_until":int(os.environ.get('CAN_SKIP_UNTIL','0')),
+        "blocking_reload_timeout":float(os.environ.get('BLOCKING_RELOAD_TIMEOUT','0')),
+        "prewarm_tenants":[tenant for tenant in os.environ.get('PREWARM_TENANTS','').split(",") if tenant],
+        "publish_bucket":os.environ.get('PUBLISH_BUCKET',''),
+        "publish_prefix":os.environ.get('PUBLISH_PREFIX',''),
+        "publish_duration":float(os.environ.get('PUBLISH_DURATION','0')),
+        "publish_channels":[channel for channel in os.environ.get('PUBLISH_CHANNELS','').split(",") if channel]
+    }
+
+    # tokens signed with an empty or short key can be forged, keep registering clients in the table instead
+    if config['session_mode'] == "signed" and len(config['session_secret']) < SESSION_SECRET_MIN_LENGTH:
+        LOGGER.error("SESSION_MODE is signed but SESSION_SECRET is not set or shorter than %s characters, falling back to table sessions" % (SESSION_SECRET_MIN_LENGTH))
+        config['session_mode'] = "table"
+
+    # without an epoch the channel clock would start in 1970, with the timeline somewhere many loops into the schedule
+    if config['timeline_mode'] == "channel" and config['channel_epoch'] <= 0:
+        LOGGER.error("TIMELINE_MODE is channel but CHANNEL_EPOCH is not set, falling back to session timelines")
+        config['timeline_mode'] = "session"
+    return config
+
+CONFIG = loadConfig()
+
+def reloadConfig():
+    CONFIG.update(loadConfig())
+
+# Storage backends used by the handler, created once per process and reused by every invocation. A long running server
+# can plug in any object implementing the same client calls (see local_backends.py for in-memory stand-ins)
+BACKENDS = {"dynamodb":None,"s3":None,"publish":None}
+BACKENDS_LOCK = threading.Lock()
+
+def setBackends(db_client=None,s3_client=None,publish_client=None):
+    with BACKENDS_LOCK:
+        BACKENDS['dynamodb'] = db_client
+        BACKENDS['s3'] = s3_client
+        BACKENDS['publish'] = publish_client
+
+def publishClient():
+    '''
+    Storage the publisher writes playlists to, the S3 client unless another one is plugged in
+    '''
+    return BACKENDS['publish'] or backendClient('s3')
+
+def backendClient(service_name):
+    client = BACKENDS[service_name]
+    if client is None:
+        with BACKENDS_LOCK:
+            if BACKENDS[service_name] is None:
+                BACKENDS[service_name] = createClient(service_name)
+            client = BACKENDS[service_name]
+    return client
+
+def createClient(service_name):
+    '''
+    Create a pooled boto3 client with keep-alive. boto3 is only imported here, so requests served from plugged in
+    backends never pay for the import
+    '''
+    import boto3
+    from botocore.config import Config
+
+    # calls are made on the request thread, so the request budget is enforced by the botocore timeouts
+    connect_timeout = CONFIG['connect_timeout']
+    read_timeout = CONFIG['read_timeout']
+    if CONFIG['request_budget'] > 0:
+        connect_timeout = min(connect_timeout,CONFIG['request_budget'])
+        read_timeout = min(read_timeout,CONFIG['request_budget'])
+
+    client_config = Config(
+        max_pool_connections=CONFIG['max_pool_connections'],
+        tcp_keepalive=True,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={"max_attempts":3,"mode":"standard"}
+    )
+    return boto3.client(service_name,config=client_config)
+
+def loadItemManifests(s3_client,asseturl,segment_index,rendition_numbers=None):
+    '''
+    Load the master manifest of a schedule item and the segment indexes (or child playlists) of its renditions, all of
+    them unless rendition_numbers is given, into the manifest cache. Returns the number of manifests loaded
+    '''
+    asset_bucket = asseturl.split("/")[2]
+    path_to_object = '/'.join(asseturl.split("/")[3:]).rsplit("/",1)[0] + "/"
+    master_object = MANIFEST_CACHE.get(s3_client,asset_bucket,'/'.join(asseturl.split("/")[3:]),parseMasterManifest)
+    rendition_lines = master_object['rendition_lines']
+    if rendition_numbers is not None:
+        rendition_lines = [rendition_lines[rendition_number] for rendition_number in rendition_numbers]
+    for line in rendition_lines:
+        if segment_index:
+            MANIFEST_CACHE.get(s3_client,asset_bucket,segmentIndexKey(path_to_object+line),parseSegmentIndex)
+        else:
+            MANIFEST_CACHE.get(s3_client,asset_bucket,path_to_object+line,parseChildManifest)
+    return 1 + len(rendition_lines)
+
+# Thread pool for backend calls made concurrently within a request, created on first use
+FANOUT_EXECUTOR = None
+
+def fanOutExecutor():
+    global FANOUT_EXECUTOR
+    if FANOUT_EXECUTOR is None:
+        with BACKENDS_LOCK:
+            if FANOUT_EXECUTOR is None:
+                FANOUT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['fanout_workers'],thread_name_prefix="fanout")
+    return FANOUT_EXECUTOR
+
+def fanOut(function,*args):
+    '''
+    Run a backend call on the fan-out pool, recording its metrics against the request being handled. Returns the future
+    '''
+    request_metrics = currentMetrics()
+    request_deadline = getattr(DEADLINE_CONTEXT,'deadline',None)
+
+    def call():
+        METRICS_CONTEXT.metrics = request_metrics
+        DEADLINE_CONTEXT.deadline = request_deadline
+        try:
+            return function(*args)
+        finally:
+            METRICS_CONTEXT.metrics = NULL_METRICS
+            DEADLINE_CONTEXT.deadline = None
+    return fanOutExecutor().submit(call)
+
+def fanOutWait(futures):
+    '''
+    Wait for calls made with fanOut. They only warm the process caches : a call that failed is made again in request
+    order by the code that needs its result, and fails there the way it always has
+    '''
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            LOGGER.debug("Concurrent backend call failed, got exception: %s" % (e))
+
+# Thread pool the backend calls of a request are made on when they are bounded by its deadline or hedged. It is separate
+# from the fan-out pool, whose calls wait on it. Calls a request gave up on finish in the background, bounded by the
+# botocore timeouts
+BACKEND_EXECUTOR = None
+BACKEND_STATS = collections.Counter()
+
+def backendExecutor():
+    global BACKEND_EXECUTOR
+    if BACKEND_EXECUTOR is None:
+        with BACKENDS_LOCK:
+            if BACKEND_EXECUTOR is None:
+                BACKEND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['max_pool_connections'],thread_name_prefix="backend")
+    return BACKEND_EXECUTOR
+
+def timedCall(function,latencies,kwargs):
+    started = time.perf_counter()
+    try:
+        return function(**kwargs)
+    finally:
+        if latencies is not None:
+            latencies.add(time.perf_counter() - started)
+
+def backendCall(function,hedge=False,**kwargs):
+    '''
+    Make a backend call, raising BackendTimeout if the request deadline has already passed. Calls are made on the calling
+    thread, the botocore connect and read timeouts are capped at the request budget (see createClient).
+    Reads of immutable objects (hedge=True) are made on the backend pool once there is a hedge delay : a second request
+    is sent when the first one hasn't answered within it, and the first answer is returned. When one attempt fails while
+    the other is still running, the other one is waited for within the time left
+    '''
+    latencies = READ_LATENCIES if hedge else None
+    hedge_delay = READ_LATENCIES.hedgeDelay() if hedge and CONFIG['hedge_percentile'] > 0 else None
+    remaining = remainingBudget()
+
+    request_metrics = currentMetrics()
+    if remaining is not None and remaining <= 0:
+        request_metrics.count("backend_timeouts")
+        BACKEND_STATS['timeouts'] += 1
+        raise BackendTimeout("Request budget spent before calling %s" % (getattr(function,'__name__','backend')))
+
+    if hedge_delay is None or (remaining is not None and hedge_delay >= remaining):
+        return timedCall(function,latencies,kwargs)
+
+    # only the first attempt is timed, hedges answering sooner would pull the hedge delay down
+    attempts = [backendExecutor().submit(timedCall,function,latencies,kwargs)]
+    done, pending = concurrent.futures.wait(attempts,timeout=hedge_delay)
+    if len(done) == 0:
+        attempts.append(backendExecutor().submit(timedCall,function,None,kwargs))
+        request_metrics.count("hedged_reads")
+        BACKEND_STATS['hedged_reads'] += 1
+
+    pending = set(attempts)
+    while True:
+        timeout = None if remaining is None else max(0,remainingBudget())
+        done, pending = concurrent.futures.wait(pending,timeout=timeout,return_when=concurrent.futures.FIRST_COMPLETED)
+        if len(done) == 0:
+            request_metrics.count("backend_timeouts")
+            BACKEND_STATS['timeouts'] += 1
+            raise BackendTimeout("No response from %s within the request budget" % (getattr(function,'__name__','backend')))
+
+        for attempt in attempts:
+            if attempt in done and attempt.exception() is None:
+                if attempt is not attempts[0]:
+                    request_metrics.count("hedge_wins")
+                    BACKEND_STATS['hedge_wins'] += 1
+                return attempt.result()
+
+        # every attempt failed, raise the error of the first one
+        if len(pending) == 0:
+            return attempts[0].result()
+
+def requestDeadline(context):
+    '''
+    Time by which a request gives up on its backend calls : REQUEST_BUDGET from now, bounded by the Lambda time left
+    when running in Lambda. None without a budget
+    '''
+    if CONFIG['request_budget'] <= 0:
+        return None
+    deadline = time.time() + CONFIG['request_budget']
+    if context is not None and hasattr(context,'get_remaining_time_in_millis'):
+        deadline = min(deadline,time.time() + context.get_remaining_time_in_millis() / 1000.0 - REQUEST_BUDGET_MARGIN)
+    return deadline
+
+# schedule items whose manifests have been loaded around their start, by asset location and start time
+LOOKAHEAD_STARTED = LRUCache(256)
+LOOKAHEAD_STATS = collections.Counter()
+
+def upcomingItems(schedule_snapshot,now,horizon):
+    '''
+    Schedule items starting within horizon seconds either side of now, as (start epoch, item) : the items about to start,
+    and the item that has just started when the schedule was changed to start it straight away, as ingest does
+    '''
+    end_times = schedule_snapshot['end_times']
+    upcoming = []
+    for next_item in range(max(1,bisect.bisect_right(end_times,now - horizon) + 1),len(end_times)):
+        if end_times[next_item-1] > now + horizon:
+            break
+        upcoming.append((end_times[next_item-1],schedule_snapshot['items'][next_item]))
+    return upcoming
+
+def lookaheadPrefetch(s3_client,schedule_snapshot,now):
+    '''
+    Load the manifests of every rendition of the items starting within LOOKAHEAD_SECONDS of now in the background, once
+    per item, so the polls around a schedule change, when every player moves to the new asset at once, are served from
+    the cache. Requests that get there first wait for the same fetches, see ManifestCache. An item whose prefetch failed
+    is tried again by the next request. In Lambda the sandbox is frozen once the handler returns, so the loads only run
+    while requests are being handled and this is best effort there. Returns the number of items queued
+    '''
+    queued = 0
+    for item_start, item in upcomingItems(schedule_snapshot,now,CONFIG['lookahead_seconds']):
+        asseturl = item['assetlocation']['S']
+        if not LOOKAHEAD_STARTED.add((asseturl,item_start),True):
+            continue
+
+        def prefetched(future,asseturl=asseturl,item_start=item_start):
+            if future.exception() is None:
+                LOOKAHEAD_STATS['prefetches'] += 1
+                return
+            # forgotten before it is counted, so the next request tries the item again
+            LOOKAHEAD_STARTED.discard((asseturl,item_start))
+            LOOKAHEAD_STATS['failures'] += 1
+            LOGGER.warning("Unable to prefetch manifests of upcoming item %s, got exception: %s" % (asseturl,future.exception()))
+
+        fanOutExecutor().submit(loadItemManifests,s3_client,asseturl,'segmentindex' in item).add_done_callback(prefetched)
+        queued += 1
+    return queued
+
+def prewarmEngine(tenants):
+    '''
+    Load the schedule snapshot of each tenant, and the master and rendition manifests of the current and next schedule
+    items, so the first player requests after a cold start or a schedule change are served from the process caches
+    '''
+    db_client = backendClient('dynamodb')
+    s3_client = backendClient('s3')
+    requesttime_epoch = int(time.time())
+
+    warmed = dict()
+    for tenant in tenants:
+        # channel schedules are named <tenant>/<channel>
+        if CONFIG['schedule_model'] == "channel":
+            tenant_id, channel = tenant.split("/",1)
+            schedule_snapshot = SCHEDULE_CACHE.get(db_client,"%s_ChannelSchedule" % (tenant_id),channel,requesttime_epoch)
+        else:
+            schedule_snapshot = SCHEDULE_CACHE.get(db_client,"%s_ContentManagement" % (tenant))
+        current_item = bisect.bisect_right(schedule_snapshot['end_times'],requesttime_epoch)
+
+        manifests = 0
+        for item in schedule_snapshot['items'][current_item:current_item+2]:
+            manifests += loadItemManifests(s3_client,item['assetlocation']['S'],'segmentindex' in item)
+        warmed[tenant] = manifests
+        LOGGER.info("Pre-warmed tenant %s : %s manifests" % (tenant,manifests))
+
+    return {"status":"WARM","tenants":warmed,"manifest_cache":MANIFEST_CACHE.stats(),"schedule_cache":SCHEDULE_CACHE.stats(),"lookahead":dict(LOOKAHEAD_STATS),
+        "backend":dict(BACKEND_STATS,hedge_delay=READ_LATENCIES.hedgeDelay())}
+
+def publishEvent(tenant,channel,rendition_number,publish_epoch):
+    '''
+    Request event for a playlist rendered by the publisher, for the master playlist when rendition_number is None
+    '''
+    path = "/%s/%s.m3u8" % (tenant,channel)
+    if rendition_number is not None:
+        path = "/%s/%s/%s.m3u8" % (tenant,channel,rendition_number)
+    return {
+        "path":path,
+        "headers":{},
+        "queryStringParameters":None,
+        "requestContext":{"domainName":"","path":path},
+        "publishEpoch":publish_epoch
+    }
+
+def renderChannel(tenant,channel,publish_epoch):
+    '''
+    Render the master and rendition playlists of a channel for publish_epoch. Returns a list of (key, body, cache control)
+    '''
+    timeline_snap = CONFIG['timeline_snap']
+    master_response = handleRequest(publishEvent(tenant,channel,None,publish_epoch),None)
+    if master_response['statusCode'] != 200:
+        raise Exception("Unable to render master playlist of %s/%s : %s" % (tenant,channel,master_response.get('body')))
+
+    # rendition playlists change at most once per snap boundary, masters only when the schedule does
+    playlists = [("%s%s/%s.m3u8" % (CONFIG['publish_prefix'],tenant,channel),master_response['body'],"max-age=%s" % (timeline_snap))]
+    for rendition_number in range(master_response['publishState']['renditions']):
+        child_response = handleRequest(publishEvent(tenant,channel,rendition_number,publish_epoch),None)
+        if child_response['statusCode'] != 200:
+            raise Exception("Unable to render rendition %s of %s/%s : %s" % (rendition_number,tenant,channel,child_response.get('body')))
+        playlists.append(("%s%s/%s/%s.m3u8" % (CONFIG['publish_prefix'],tenant,channel,rendition_number),child_response['body'],"max-age=%s" % (max(1,timeline_snap // 2))))
+    return playlists
+
+def publishChannels(channels,context):
+    '''
+    Publish-ahead mode for the channel timeline. The playlists of every channel (<tenant>/<channel>) are rendered for
+    the next TIMELINE_SNAP_SECONDS boundary ahead of time, and written to PUBLISH_BUCKET as that boundary passes, so a
+    CDN can serve them as static objects. Runs for PUBLISH_DURATION seconds, bounded by the Lambda time left, and
+    publishes once when it is 0. Playlists that haven't changed since the last tick aren't written again.
+    '''
+    if CONFIG['timeline_mode'] != "channel":
+        return {"status":"ERROR","message":"Playlists can only be published with TIMELINE_MODE channel"}
+
+    publish_client = publishClient()
+    timeline_snap = CONFIG['timeline_snap']
+    deadline = time.time() + CONFIG['publish_duration']
+    if context is not None and hasattr(context,'get_remaining_time_in_millis'):
+        deadline = min(deadline,time.time() + context.get_remaining_time_in_millis() / 1000.0 - PUBLISH_MARGIN)
+
+    published = dict()
+    totals = collections.Counter()
+    publish_epoch = int(time.time())
+    publish_epoch -= publish_epoch % timeline_snap
+    while True:
+        playlists = []
+        for channel_path in channels:
+            tenant, channel = channel_path.split("/",1)
+            try:
+                playlists.extend(renderChannel(tenant,channel,publish_epoch))
+            except Exception as e:
+                LOGGER.error("Unable to publish %s, got exception: %s" % (channel_path,e))
+                totals['errors'] += 1
+
+        time.sleep(max(0,publish_epoch - time.time()))
+        for key, body, cache_control in playlists:
+            if published.get(key) == body:
+                totals['unchanged'] += 1
+                continue
+            try:
+                publish_client.put_object(Bucket=CONFIG['publish_bucket'],Key=key,Body=body.encode('utf-8'),ContentType="application/vnd.apple.mpegURL",CacheControl=cache_control)
+            except Exception as e:
+                LOGGER.error("Unable to write %s, got exception: %s" % (key,e))
+                totals['errors'] += 1
+                continue
+            published[key] = body
+            totals['writes'] += 1
+        totals['ticks'] += 1
+
+        publish_epoch += timeline_snap
+        if publish_epoch > deadline:
+            break
+
+    LOGGER.info("Published %s : %s" % (channels,dict(totals)))
+    return {"status":"PUBLISHED","channels":channels,"ticks":totals['ticks'],"writes":totals['writes'],"unchanged":totals['unchanged'],"errors":totals['errors']}
+
 def lambda_handler(event, context):
+    '''
+    API Gateway proxy entry point. Blocking playlist reloads (_HLS_msn) are held here until the requested segment is
+    available, or the blocking reload deadline passes.
+    '''
+    # pre-warm event, eg. from a scheduled EventBridge rule : {"prewarm":{"tenants":["00001"]}}, or {"prewarm":{"tenants":["00001/channel1"]}} for channel schedules
+    if 'prewarm' in event:
+        return prewarmEngine(event['prewarm'].get('tenants') or CONFIG['prewarm_tenants'])
+
+    # publish event, eg. from a scheduled EventBridge rule : {"publish":{"channels":["00001/channel1"]}}
+    if 'publish' in event:
+        return publishChannels(event['publish'].get('channels') or CONFIG['publish_channels'],context)
+
+    deadline = blockingReloadDeadline(context)
+    response = handleRequest(event, context)
+    renders = 1
+    while 'blockUntil' in response:
+        delay = blockingReloadDelay(response['blockUntil'],deadline,renders)
+        if delay is None:
+            return errorResponse(503,"#EXT-X-STATUS: REQUESTED MEDIA SEQUENCE NOT AVAILABLE YET")
+        time.sleep(delay)
+        response = handleRequest(event, context)
+        renders += 1
+
+    return response
+
+def blockingReloadDeadline(context):
+    '''
+    Time until which a blocking playlist reload can be held, bounded by the Lambda time left when running in Lambda
+    '''
+    deadline = time.time() + CONFIG['blocking_reload_timeout']
+    if context is not None and hasattr(context,'get_remaining_time_in_millis'):
+        deadline = min(deadline,time.time() + context.get_remaining_time_in_millis() / 1000.0 - BLOCKING_RELOAD_MARGIN)
+    return deadline
+
+def blockingReloadDelay(block_until,deadline,renders):
+    '''
+    Seconds to hold a blocking reload before rendering it again, or None once it has to be answered with a 503. Requests
+    are rendered for whole seconds, so the playlist can't change before the next one
+    '''
+    if time.time() >= deadline or renders >= BLOCKING_RELOAD_MAX_RENDERS:
+        return None
+    return max(0,min(math.ceil(block_until),deadline) - time.time())
+
+def handleRequest(event, context):
+    '''
+    Build one response. A sampled fraction of requests (METRICS_SAMPLE_RATE) is timed stage by stage, and emits one EMF
+    metrics line. With SERVER_TIMING set to True the same breakdown is returned in a Server-Timing header.
+    Backend calls made for the request give up once REQUEST_BUDGET has passed, so a slow read fails the request in time
+    for the player to retry rather than stalling it past its target duration.
+    A blocking reload for a segment that isn't available yet returns {"blockUntil": <epoch>} instead of a response.
+    '''
+    request_metrics = NULL_METRICS
+    metrics_sample_rate = CONFIG['metrics_sample_rate']
+    if metrics_sample_rate > 0 and random.random() < metrics_sample_rate:
+        request_metrics = RequestMetrics()
+
+    # opt-in profiling (PROFILE_SAMPLE_RATE or a signed X-Linearizer-Profile header), skipped while another request is profiled
+    request_profiler = None
+    if (CONFIG['profile_sample_rate'] > 0 or CONFIG['profile_secret']) and profileRequested(event) and PROFILE_LOCK.acquire(blocking=False):
+        request_profiler = RequestProfiler()
+        request_profiler.start()
+
+    METRICS_CONTEXT.metrics = request_metrics
+    DEADLINE_CONTEXT.deadline = requestDeadline(context)
+    try:
+        response = linearizerRequest(event, context)
+    finally:
+        METRICS_CONTEXT.metrics = NULL_METRICS
+        DEADLINE_CONTEXT.deadline = None
+        if request_profiler is not None:
+            request_profiler.stop()
+            PROFILE_LOCK.release()
+
+    if request_profiler is not None:
+        try:
+            profile_report = request_profiler.write(event,response)
+            LOGGER.info("Profile report written to %s" % (profile_report))
+            if 'headers' in response:
+                response['headers'] = dict(response['headers'],**{"X-Linearizer-Profile-Report":profile_report})
+        except Exception as e:
+            LOGGER.error("Unable to write profile report, got exception: %s" % (e))
+
+    if request_metrics is not NULL_METRICS and 'blockUntil' not in response:
+        total = time.perf_counter() - request_metrics.started
+        request_path_to_list = event.get('path','').split("/")
+        dimensions = {
+            "RequestType":{3:"master",4:"child"}.get(len(request_path_to_list),"other"),
+            "Tenant":request_path_to_list[1] if len(request_path_to_list) > 1 else "",
+            "StatusCode":response.get('statusCode')
+        }
+        print(json.dumps(request_metrics.embeddedMetricFormat(dimensions,total)))
+        if CONFIG['server_timing']:
+            response.setdefault('headers',{})['Server-Timing'] = request_metrics.serverTiming(total)
+
+    return response
+
+def linearizerRequest(event, context):
 
     LOGGER.info("Printing Event:")
     LOGGER.info(event)
-    db_client = boto3.client('dynamodb')
-    sliding_window = int(os.environ['SLIDING_WINDOW'])
-    cdn_base_url = os.environ['CDN']
+    request_metrics = currentMetrics()
+    db_client = backendClient('dynamodb')
+    sliding_window = CONFIG['sliding_window']
+    cdn_base_url = CONFIG['cdn_base_url']
+
+    # session_mode : table | signed
+    # signed sessions carry session_start in an HMAC signed client_id, the Clients table is then only written for analytics
+    session_mode = CONFIG['session_mode']
+    session_secret = CONFIG['session_secret']
+    session_analytics = CONFIG['session_analytics']
+
+    # bootstrap_mode : redirect | direct
+    # redirect : a new client is registered and redirected to the master playlist URL carrying its client_id (default)
+    # direct : the master playlist is returned straight away with the client_id in its rendition URIs, and the Clients
+    # row is written while the schedule and master manifest are read
+    bootstrap_mode = CONFIG['bootstrap_mode']
+
+    # timeline_mode : session | channel | snapped
+    # session : every client starts at its own session start (default)
+    # channel : every client joins one channel clock that started at CHANNEL_EPOCH
+    # snapped : session starts are snapped down to TIMELINE_SNAP_SECONDS boundaries
+    # in the channel and snapped modes the render clock is snapped too, and rendered playlists are shared between clients
+    timeline_mode = CONFIG['timeline_mode']
+    channel_epoch = CONFIG['channel_epoch']
+    timeline_snap = CONFIG['timeline_snap']
+
+    # delta playlists : with CAN_SKIP_UNTIL set, players requesting _HLS_skip=YES get the older segments replaced by EXT-X-SKIP
+    can_skip_until = CONFIG['can_skip_until']
+
+    # blocking reloads : with BLOCKING_RELOAD_TIMEOUT set, _HLS_msn requests are held until that segment is in the playlist
+    can_block_reload = CONFIG['blocking_reload_timeout'] > 0
 
     # initialize s3 boto cliennt
-    s3_client = boto3.client('s3')
+    s3_client = backendClient('s3')
 
     ## Functions ## START ##
 
     # Function to get DB Item that needs playing
-    def dbGetItemToPlay(table_name,):
+    def dbGetItemToPlay(table_name,since_epoch):
         LOGGER.debug("Doing a call to Dynamo to get asset name that should be playing")
         try:
-            response = db_client.scan(TableName=table_name)
+            with request_metrics.stage("schedule"):
+                response = SCHEDULE_CACHE.get(db_client,table_name,schedule_channel,since_epoch)
         except Exception as e:
             exceptions.append("error getting data from DynamoDB, got exception: %s" %  (e))
             return e
+        # warm the manifests of the next item before it starts, the loads run on the fan-out pool after this response
+        if CONFIG['lookahead_seconds'] > 0 and CONFIG['fanout_workers'] > 0:
+            request_metrics.count("lookahead_prefetches",lookaheadPrefetch(s3_client,response,requesttime_epoch))
         return response
 
 
@@ -76,7 +1693,9 @@ def lambda_handler(event, context):
     def dbGetClientInfo(clients_db,client_id):
         LOGGER.debug("Doing a call to Dynamo to get client information")
         try:
-            get_item_response = db_client.get_item(TableName=clients_db,Key={"client_id":{"S":client_id}})
+            request_metrics.count("dynamodb_calls")
+            with request_metrics.stage("client_lookup"):
+                get_item_response = backendCall(db_client.get_item,TableName=clients_db,Key={"client_id":{"S":client_id}})
         except Exception as e:
             exceptions.append("#EXT-X-STATUS: UNABLE TO GET CLIENT INFO FROM DATABASE, GOT EXCEPTION %s" % (str(e).upper()))
             return "#EXT-X-STATUS: UNABLE TO GET CLIENT INFO FROM DATABASE, GOT EXCEPTION %s" % (str(e).upper())
@@ -86,7 +1705,8 @@ def lambda_handler(event, context):
     def dbCreateClient(clients_db,client_id,requesttime_epoch):
         LOGGER.debug("Doing a call to Dynamo to create client info")
         try:
-            create_item_response = db_client.put_item(TableName=clients_db,Item={"client_id":{"S":client_id},"session_start":{"N":str(requesttime_epoch)}})
+            with request_metrics.stage("client_register"):
+                create_item_response = putClient(db_client,clients_db,client_id,requesttime_epoch)
         except Exception as e:
             exceptions.append("#EXT-X-STATUS: UNABLE TO REGISTER CLIENT IN DATABASE, GOT EXCEPTION %s" % (str(e).upper()))
             return "#EXT-X-STATUS: UNABLE TO REGISTER CLIENT IN DATABASE, GOT EXCEPTION %s" % (str(e).upper())
@@ -106,257 +1726,182 @@ def lambda_handler(event, context):
 
         try:
             LOGGER.debug("Getting object from S3 : %s" % (path_to_object))
-            response = s3_client.get_object(Bucket=asset_bucket,Key=asset_key)
+            with request_metrics.stage("master_manifest"):
+                master_object = MANIFEST_CACHE.get(s3_client,asset_bucket,asset_key,parseMasterManifest)
         except Exception as e:
             LOGGER.error("Unable to get object from S3, got exception: %s " % (e))
             exceptions.append("Unable to get object from S3, got exception: %s " % (e))
             return errorOut("#EXT-X-STATUS: ERROR - UNABLE TO GET MASTER MANIFEST FROM ORIGIN")
 
-        master_manifest_original = response['Body'].read().decode('utf-8')
+        master_manifest_original = master_object['manifest']
 
         rendition_list = []
-        rendition_number = 0
-        for line in master_manifest_original.split('\n'):
-            if ".m3u8" in line:
-                master_manifest_original = master_manifest_original.replace(line,"%s/%s.m3u8" % (channel_name,rendition_number))
-                rendition_list.append(path_to_object+line)
-                rendition_number += 1
-        master_manifest_client_id = master_manifest_original.replace(".m3u8",".m3u8?client_id=%s" % (client_id))
+        for rendition_number, line in enumerate(master_object['rendition_lines']):
+            master_manifest_original = master_manifest_original.replace(line,"%s/%s.m3u8" % (channel_name,rendition_number))
+            rendition_list.append(path_to_object+line)
+        # published masters are shared by every player, their rendition playlists are static objects next to them
+        master_manifest_client_id = master_manifest_original
+        if client_id is not None:
+            master_manifest_client_id = master_manifest_original.replace(".m3u8",".m3u8?client_id=%s" % (client_id))
         return {"master_manifest_client_id":master_manifest_client_id,"rendition_list":rendition_list}
 
 
 
-    def manifestLinearizer(schedule,time_window_start,time_window_end,rendition_number):
+    def manifestLinearizer(session_schedule,time_window_start,time_window_end,rendition_number,skip_requested=False):
         LOGGER.debug("Performing manifest stitching")
-        # session_start_epoch
-        # sliding_window
-        media_sequence = 1
-
-        assetstartepoch = session_start_epoch
-        total_loops_for_discontinuity_sequence = 0
-
-        manifest_constructor = dict()
-        manifest_constructor['media_sequence'] = media_sequence
-        manifest_constructor['discontinuity_sequence'] = total_loops_for_discontinuity_sequence
-        manifest_constructor_segments = []
-
-
-        for item in schedule:
-            endtimeepoch = int(item['EndTimeEpoch'])
-            segments = int(item['AssetSegments'])
-            duration = int(item['AssetDuration'])
-            asseturl = item['AssetLocation']
-            nowplaying = item['NowPlaying']
-
-            if endtimeepoch > session_start_epoch:
-                #
-                # this captures all files that have been in the schedule since session start...
-                #
-
-                # Get manifest
-                # Get master manifest
-                master_manifest = master_manifest_constructor(item,"xxx")
-                child_full_url =  master_manifest['rendition_list'][rendition_number]
-
-                asset_bucket = child_full_url.split("/")[2]
-                asset_key = '/'.join(child_full_url.split("/")[3:])
-                path_to_segments = '/'.join(child_full_url.split("/")[3:]).rsplit("/",1)[0] + "/"
-
-                if len(cdn_base_url) > 6:
-                    # assume CDN is being used:
-                    cdn_no_protocol = cdn_base_url.replace("https://","").replace("http://","")
-
-                    child_url = "https://%s/%s" % (cdn_no_protocol,path_to_segments)
-
-                else:
-                    # assume clients can get directly from S3
-                    bucket_region = "us-west-2"
-                    child_url = "https://%s.s3.%s.amazonaws.com/%s" % (asset_bucket,bucket_region,path_to_segments)
-
-
-                try:
-                    LOGGER.debug("Getting object from S3: %s " % (asset_key))
-                    response = s3_client.get_object(Bucket=asset_bucket,Key=asset_key)
-                except Exception as e:
-                    LOGGER.error("Unable to get object from S3, got exception: %s " % (e))
-                    exceptions.append("Unable to get object from S3, got exception: %s " % (e))
-                    return errorOut("#EXT-X-STATUS: ERROR - UNABLE TO GET MANIFEST FROM ORIGIN")
-
-                childmanifestraw = response['Body'].read().decode('utf-8')
-                child_headers_list = childmanifestraw.split("#")[0:4]
-                #for manifest_line in child_manifest_list:
-
-
-                ###
-                ###
-                ###
-
-                def manifest_iterator(manifest_start_seconds,manifest_end_seconds,segments,oldest_loop):
-
-                    manifest_start = manifest_start_seconds
-                    manifest_end = manifest_end_seconds
-
-                    segment_index = []
-                    segment_index.clear()
-                    extinfstart = []
-                    extinfstart.clear()
-                    LOGGER.debug("segment index : " +str(len(segment_index)))
-                    manifest_timeline = 0
-
-                    for index, line in enumerate(childmanifestraw.split("#")):
-                        if 'EXTINF' in line:
-                            extinfstart.append(index)
-                            manifest_timeline = manifest_timeline + int(line.split(",")[0].split(":")[1])
-
-                            if manifest_timeline >= manifest_start and manifest_timeline <= manifest_end:
-                                segment_index.append(index)
-                                if segments:
-                                    manifest_constructor_segments.append("#"+line)
-
-                    if len(segment_index) == 0:
-                        segments_into_manifest = 0
-                        starting_segment = 0
-                    else:
-                        segments_into_manifest = segment_index[-1] - int(extinfstart[0])
-                        starting_segment = segment_index[0] - int(extinfstart[0])
-
-                    if oldest_loop:
-                        manifest_constructor['media_sequence'] += starting_segment
-                ###
-                ###
-                ###
-
-
-                if endtimeepoch < time_window_start:
-                    LOGGER.debug("Asset finished and is no longer in playlist : %s " % (asseturl))
-
-                    epoch_end = endtimeepoch
-                    loops_to_epoch_end = math.floor((epoch_end - assetstartepoch) / duration)
-                    manifest_constructor['discontinuity_sequence'] = manifest_constructor['discontinuity_sequence'] + loops_to_epoch_end
-
-                    starting_media_sequence_of_last_loop = loops_to_epoch_end * segments
-                    media_sequence += starting_media_sequence_of_last_loop
-                    manifest_constructor['media_sequence'] = media_sequence
-
-                    manifest_end = epoch_end - assetstartepoch - (loops_to_epoch_end * duration)
-                    manifest_start = 0
-
-                    manifest_iterator(manifest_start,manifest_end,False,False)
-
+        # session_schedule only holds the items overlapping the sliding window, items that finished before the window
+        # are accounted for by the media sequence and discontinuity sequence offsets computed for the session
+
+        # around a schedule change the window spans several items, the manifests that aren't cached are fetched
+        # concurrently up front and the items are then rendered in order from the manifest cache
+        if CONFIG['fanout_workers'] > 0:
+            uncached_items = []
+            item_start_epoch = session_schedule['asset_start_epoch']
+            for item in session_schedule['schedule']:
+                if item_start_epoch >= time_window_end:
+                    break
+                if not MANIFEST_CACHE.fresh(item['AssetLocation'].split("/")[2],'/'.join(item['AssetLocation'].split("/")[3:])):
+                    uncached_items.append(item)
+                item_start_epoch = int(item['EndTimeEpoch'])
+            if len(uncached_items) > 1:
+                with request_metrics.stage("fanout"):
+                    fanOutWait([fanOut(loadItemManifests,s3_client,item['AssetLocation'],item['SegmentIndex'],[rendition_number]) for item in uncached_items])
+
+        # segment base URL and segment table of the requested rendition of every item the window covers
+        renditions = []
+        assetstartepoch = session_schedule['asset_start_epoch']
+        for item in session_schedule['schedule']:
+            if assetstartepoch >= time_window_end:
+                break
+
+            # Get manifest
+            # Get master manifest
+            master_manifest = master_manifest_constructor(item,"xxx")
+            if len(exceptions) > 0:
+                return master_manifest
+            child_full_url =  master_manifest['rendition_list'][rendition_number]
 
-                if endtimeepoch > time_window_start:
-                    LOGGER.info("getting segments from this asset : %s " % (asseturl))
+            asset_bucket = child_full_url.split("/")[2]
+            asset_key = '/'.join(child_full_url.split("/")[3:])
+            path_to_segments = '/'.join(child_full_url.split("/")[3:]).rsplit("/",1)[0] + "/"
 
-                    epoch_start = requesttime_epoch - sliding_window
+            if len(cdn_base_url) > 6:
+                # assume CDN is being used:
+                cdn_no_protocol = cdn_base_url.replace("https://","").replace("http://","")
 
-                    if epoch_start < assetstartepoch:
-                        epoch_start = assetstartepoch
-                        #loops_to_epoch_start = 0
+                child_url = "https://%s/%s" % (cdn_no_protocol,path_to_segments)
 
-                    if requesttime_epoch < endtimeepoch:
-                        epoch_end = requesttime_epoch
+            else:
+                # assume clients can get directly from S3
+                bucket_region = "us-west-2"
+                child_url = "https://%s.s3.%s.amazonaws.com/%s" % (asset_bucket,bucket_region,path_to_segments)
+
+
+            # the segment index written at ingest (or the child playlist for older assets) is loaded once and cached across
+            # requests, every loop of the asset is then a binary search on this table
+            try:
+                with request_metrics.stage("child_manifest"):
+                    if item['SegmentIndex']:
+                        LOGGER.debug("Getting segment index from S3: %s " % (segmentIndexKey(asset_key)))
+                        child_timeline = MANIFEST_CACHE.get(s3_client,asset_bucket,segmentIndexKey(asset_key),parseSegmentIndex)
                     else:
-                        epoch_end = endtimeepoch
-                    loops_to_epoch_start = math.floor((epoch_start - assetstartepoch) / duration)
-                    if loops_to_epoch_start < 0:
-                        loops_to_epoch_start = 0
-
-                    loops_to_epoch_end = math.floor((epoch_end - assetstartepoch) / duration)
-                    manifest_constructor['discontinuity_sequence'] += loops_to_epoch_start
-                    starting_media_sequence_of_oldest_loop = loops_to_epoch_start * segments
-                    loops_of_asset = math.ceil((epoch_end - epoch_start) / duration)
-
-
-                    manifest_constructor['media_sequence'] += starting_media_sequence_of_oldest_loop
-
-                    manifest_start_epoch = epoch_start
-
-                    manifest_start = epoch_start - assetstartepoch - (loops_to_epoch_start * duration)
-
-                    if len(manifest_constructor_segments) > 0:
-                        manifest_constructor_segments.append("#EXT-X-DISCONTINUITY")
-
-
-                    oldest_loop = True
-                    looper = dict()
-                    for i in range(loops_of_asset,-1,-1):
-                        if i == 0:
-                            manifest_end = epoch_end - assetstartepoch - (loops_to_epoch_end * duration)
-                        else:
-                            manifest_end = duration
-
-
-                        LOGGER.debug("loop iteration : %s , manifest_start : %s , manifest_end : %s " % (str(i),str(manifest_start),str(manifest_end)) )
-
-                        looper[str(i)] = {
-                            "start":manifest_start,
-                            "end":manifest_end,
-                            "duration":manifest_end-manifest_start,
-                            "epoch": epoch_start + manifest_start
-
-                        }
-
-                        manifest_iterator(manifest_start,manifest_end,True,oldest_loop)
-                        LOGGER.debug("manifest_start:%s,manifest_end:%s" % (manifest_start,manifest_end))
-
-                        #oldest_loop = False
-
-                        if i > 0:
-                            manifest_start = 0
-                            manifest_constructor_segments.append("#EXT-X-DISCONTINUITY")
-                        oldest_loop = False
-                    LOGGER.warning(looper)
-                assetstartepoch = endtimeepoch
-
-
-        if manifest_constructor_segments[-1] == "#EXT-X-DISCONTINUITY":
-            manifest_constructor_segments.pop(-1)
-
-        manifest_constructor['discontinuity_sequence'] = manifest_constructor['discontinuity_sequence'] + manifest_constructor_segments.count("#EXT-X-DISCONTINUITY")
-        manifest_constructor['segments'] = manifest_constructor_segments
-
-        #return len(manifest_constructor['segments']) - manifest_constructor['segments'].count("#EXT-X-DISCONTINUITY")
+                        LOGGER.debug("Getting object from S3: %s " % (asset_key))
+                        child_timeline = MANIFEST_CACHE.get(s3_client,asset_bucket,asset_key,parseChildManifest)
+            except Exception as e:
+                LOGGER.error("Unable to get object from S3, got exception: %s " % (e))
+                exceptions.append("Unable to get object from S3, got exception: %s " % (e))
+                return errorOut("#EXT-X-STATUS: ERROR - UNABLE TO GET MANIFEST FROM ORIGIN")
+
+            LOGGER.info("getting segments from this asset : %s " % (item['AssetLocation']))
+            renditions.append((child_url,child_timeline))
+            assetstartepoch = int(item['EndTimeEpoch'])
+
+        # the window plan only depends on the session timeline and the segment timelines, so every rendition sharing
+        # them renders from one plan until the next segment is added to the window
+        plan_started = time.perf_counter()
+        timelines = tuple(child_timeline.timeline for child_url, child_timeline in renditions)
+        plan_key = (content_management_db,schedule_channel,session_schedule['generation'],session_schedule['asset_start_epoch'],session_schedule['media_sequence'],session_schedule['discontinuity_sequence'])
+        plan = WINDOW_PLAN_CACHE.get(plan_key)
+        if plan is None or plan['timelines'] != timelines or not windowPlanCovers(plan,time_window_start,time_window_end):
+            plan = windowPlan(session_schedule,time_window_start,time_window_end,[child_timeline for child_url, child_timeline in renditions])
+            request_metrics.count("window_plans")
+            WINDOW_PLAN_CACHE.put(plan_key,plan)
+        request_metrics.addStage("plan",plan_started)
+
+        render_started = time.perf_counter()
+        manifest_constructor_segments = []
+        for run in plan['runs']:
+            if run is DISCONTINUITY_FRAGMENT:
+                manifest_constructor_segments.append(DISCONTINUITY_FRAGMENT)
+            else:
+                item_position, first_segment, last_segment = run
+                child_url, child_timeline = renditions[item_position]
+                manifest_constructor_segments.extend(child_timeline.fragments(child_url,first_segment,last_segment))
+        request_metrics.addStage("render",render_started)
+
+        assemble_started = time.perf_counter()
+        child_headers = renditions[-1][1].headers if len(renditions) > 0 else "#EXTM3U\n"
+        media_sequence = plan['media_sequence']
+        discontinuity_sequence = plan['discontinuity_sequence']
+        next_media_sequence = plan['next_media_sequence']
+        next_segment_epoch = plan['next_segment_epoch']
+
+        # delta update : segments more than CAN-SKIP-UNTIL seconds from the end of the playlist are replaced by EXT-X-SKIP
+        segment_end_times = plan['segment_end_times']
+        segment_positions = plan['segment_positions']
+        skipped_segments = 0
+        if skip_requested and len(segment_end_times) > 0:
+            skipped_segments = bisect.bisect_right(segment_end_times,plan['playlist_duration'] - can_skip_until)
 
-        #media_sequence = manifest_constructor['media_sequence'] - len(manifest_constructor['segments']) + manifest_constructor['segments'].count("#EXT-X-DISCONTINUITY")
-        media_sequence = manifest_constructor['media_sequence']
         ## Construct manifest
 
 
         ## HEADERS
-        child_headers = '#'.join(child_headers_list)
+        if skipped_segments > 0:
+            child_headers = minimumVersion(child_headers,SKIP_PLAYLIST_VERSION)
+        server_control = []
+        if can_block_reload:
+            server_control.append("CAN-BLOCK-RELOAD=YES")
+        if can_skip_until > 0:
+            server_control.append("CAN-SKIP-UNTIL=%s" % (can_skip_until))
+        if len(server_control) > 0:
+            child_headers += "#EXT-X-SERVER-CONTROL:%s\n" % (",".join(server_control))
         child_headers += "#EXT-X-MEDIA-SEQUENCE:"+str(media_sequence)+"\n"
-        if manifest_constructor['discontinuity_sequence'] > 0:
-            child_headers += "#EXT-X-DISCONTINUITY-SEQUENCE:%s\n" % (str(manifest_constructor['discontinuity_sequence']))
+        if discontinuity_sequence > 0:
+            child_headers += "#EXT-X-DISCONTINUITY-SEQUENCE:%s\n" % (str(discontinuity_sequence))
 
         ## SEGMENTS in Manifest
-
-        new_child_manifest = []
-        for line in manifest_constructor['segments']:
-            if "EXTINF" in line:
-                new_child_manifest.append(line.replace("\n",str(media_sequence)+"\n"+str(child_url),1))
-                media_sequence += 1
+        # rendered straight into bytes from the pre-encoded fragments, only the media sequence numbers are formatted per request
+
+        new_child_manifest = [child_headers.encode('utf-8')]
+        first_position = 0
+        if skipped_segments > 0:
+            new_child_manifest.append(b"#EXT-X-SKIP:SKIPPED-SEGMENTS=%d\n" % (skipped_segments))
+            first_position = segment_positions[skipped_segments-1] + 1
+            media_sequence += skipped_segments
+
+        for fragment in manifest_constructor_segments[first_position:]:
+            if fragment is DISCONTINUITY_FRAGMENT:
+                new_child_manifest.append(DISCONTINUITY_LINE)
             else:
-                new_child_manifest.append(line+"\n")
-
-
+                new_child_manifest.append(fragment[0])
+                new_child_manifest.append(b"%d" % (media_sequence))
+                new_child_manifest.append(fragment[1])
+                media_sequence += 1
 
         # Stitch headers + old and new manifest
-        child_manifest = child_headers + ''.join(new_child_manifest)
+        child_manifest = b''.join(new_child_manifest)
+        request_metrics.addStage("assemble",assemble_started)
+
+        playlist_state['next_media_sequence'] = next_media_sequence
+        playlist_state['next_segment_epoch'] = next_segment_epoch
 
         return child_manifest
 
 
 
     def errorOut(message):
-        response_status = {
-            "statusCode": 404,
-            "headers": {
-                "Content-Type": "application/vnd.apple.mpegURL",
-                "Access-Control-Allow-Origin":"*"
-            },
-            "body": message
-        }
-        return response_status
+        return errorResponse(404,message)
 
 
     def nowPlaying(content_management_db,session_start_epoch):
@@ -364,32 +1909,25 @@ def lambda_handler(event, context):
         This function will make a call to DynamoDB to get the asset that should be playing right now.
         '''
         ## Get Items from DB
-        getItemToPlayResponse = dbGetItemToPlay(content_management_db)
+        getItemToPlayResponse = dbGetItemToPlay(content_management_db,session_start_epoch)
 
         if len(exceptions) > 0:
             return errorOut("#EXT-X-STATUS: %s" % (exceptions))
 
         ## Find which item should be playing right now
-        listOfPlaybackItems = []
+        # the snapshot is sorted by endtimeepoch, so the items since session start are a bisect away
+        end_times = getItemToPlayResponse['end_times']
+        first_item = bisect.bisect_right(end_times,session_start_epoch)
+
         currentAndFutureItems = dict()
-        for item in getItemToPlayResponse['Items']:
-            endtimeepoch = int(item['endtimeepoch']['N'])
-            assetlocation = item['assetlocation']['S']
-            assetduration = item['duration']['N']
-            assetsegments = item['segments']['N']
-
-            if endtimeepoch > session_start_epoch: #or endtimeepoch > requesttime_epoch - sliding_window:
-                currentAndFutureItems[endtimeepoch] = {"AssetLocation":assetlocation,"AssetDuration":assetduration,"EndTimeEpoch":endtimeepoch,"AssetSegments":assetsegments,"NowPlaying":"False"}
-                listOfPlaybackItems.append(endtimeepoch)
-
-        # sort the list to see which endtimeepoch is closest - that will determine which item should be playing now
-        listOfPlaybackItems.sort()
-        currentItemEndTimeEpoch = 0
+        for item in getItemToPlayResponse['items'][first_item:]:
+            currentAndFutureItems[int(item['endtimeepoch']['N'])] = scheduleItem(item)
 
-        for endtime in listOfPlaybackItems:
-            if endtime > requesttime_epoch:
-                if currentItemEndTimeEpoch == 0:
-                    currentItemEndTimeEpoch = endtime
+        # the first endtimeepoch after the request time determines which item should be playing now
+        currentItemEndTimeEpoch = 0
+        current_item = bisect.bisect_right(end_times,requesttime_epoch,first_item)
+        if current_item < len(end_times):
+            currentItemEndTimeEpoch = end_times[current_item]
 
         # Iterate through 'currentAndFutureItems' dictionary to get asset name corresponding to endtimeepoch. There should only ever be 2 items to iterate through here
         currentPlaybackWindow = []
@@ -405,14 +1943,74 @@ def lambda_handler(event, context):
         return currentPlaybackWindow
 
 
+    def sessionSchedule(content_management_db,session_start_epoch,time_window_start):
+        '''
+        Get the schedule items that overlap the sliding window for a session, along with the media sequence and discontinuity
+        sequence reached by the items that finished before the window. Old schedule history costs a bisect, not a manifest fetch.
+        '''
+        schedule_snapshot = dbGetItemToPlay(content_management_db,session_start_epoch)
+
+        if len(exceptions) > 0:
+            return errorOut("#EXT-X-STATUS: %s" % (exceptions))
+
+        end_times = schedule_snapshot['end_times']
+        first_session_item = bisect.bisect_right(end_times,session_start_epoch)
+
+        # rows written before ingest stored segment timelines get theirs from the asset, once per snapshot row
+        legacy_items = [item for item in schedule_snapshot['items'][first_session_item:] if 'segmenttimeline' not in item]
+        if len(legacy_items) > 0:
+            try:
+                with request_metrics.stage("segment_timelines"):
+                    if CONFIG['fanout_workers'] > 0 and len(legacy_items) > 1:
+                        fanOutWait([fanOut(assetSegmentTimeline,s3_client,item) for item in legacy_items])
+                    for item in legacy_items:
+                        item['segmenttimeline'] = {"S":assetSegmentTimeline(s3_client,item)}
+            except Exception as e:
+                LOGGER.error("Unable to get segment timeline of asset from S3, got exception: %s " % (e))
+                exceptions.append("Unable to get segment timeline of asset from S3, got exception: %s " % (e))
+                return errorOut("#EXT-X-STATUS: ERROR - UNABLE TO GET MANIFEST FROM ORIGIN")
+
+        session_offsets = SCHEDULE_CACHE.sessionOffsets(schedule_snapshot,session_start_epoch)
+
+        first_window_item = bisect.bisect_right(end_times,time_window_start,first_session_item)
+
+        media_sequence = 1
+        discontinuity_sequence = 0
+        asset_start_epoch = session_start_epoch
+        if first_window_item > first_session_item:
+            media_sequence = session_offsets['media_sequence'][first_window_item-1]
+            discontinuity_sequence = session_offsets['discontinuity_sequence'][first_window_item-1]
+            asset_start_epoch = end_times[first_window_item-1]
+
+        return {
+            "schedule":[scheduleItem(item) for item in schedule_snapshot['items'][first_window_item:]],
+            "media_sequence":media_sequence,
+            "discontinuity_sequence":discontinuity_sequence,
+            "asset_start_epoch":asset_start_epoch,
+            "generation":schedule_snapshot['generation']
+        }
+
     ### Creating global variables - START
 
     exceptions = []
     exceptions.clear()
 
+    # filled in by manifestLinearizer : next media sequence to be added to the playlist and when it will be
+    playlist_state = dict()
+
     requesttime_iso8601 = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
     requesttime_epoch = int(datetime.datetime.utcnow().strftime('%s'))
     #requesttime_epoch = 1631849400
+
+    # publisher renders (see publishChannels) carry the epoch they are rendered for, and are not made for any one client
+    publish_epoch = event.get('publishEpoch')
+    if publish_epoch is not None:
+        requesttime_epoch = int(publish_epoch)
+        if timeline_mode != "channel":
+            return errorOut("#EXT-X-STATUS: PLAYLISTS CAN ONLY BE PUBLISHED FOR THE CHANNEL TIMELINE")
+        # static objects can't hold a request or answer _HLS_skip, so published playlists don't advertise either
+        can_skip_until = 0
+        can_block_reload = False
     ### Creating global variables - END
 
     # check request length first
@@ -435,18 +2033,40 @@ def lambda_handler(event, context):
     content_management_db = "%s_ContentManagement" % (enterprise_customer_id)
     clients_db = "%s_Clients" % (enterprise_customer_id)
 
+    # schedule_model : table | channel
+    # table : one schedule per tenant, the ContentManagement table keyed by endtimeepoch is scanned (default)
+    # channel : one schedule per channel, the ChannelSchedule table keyed by channel and endtimeepoch is queried from the session start
+    schedule_channel = None
+    if CONFIG['schedule_model'] == "channel":
+        content_management_db = "%s_ChannelSchedule" % (enterprise_customer_id)
+        schedule_channel = channel_name
+
     # check if client is known
-    try:
-        client_id = event['queryStringParameters']['client_id']
+    if publish_epoch is not None:
+        client_id = None
         new_client = False
-        LOGGER.debug("Known client requesting manifest, id : %s" %(client_id))
-    except:
-        if len(request_path_to_list) == 4:
-            return errorOut("#EXT-X-STATUS: CANNOT PROCESS REQUEST, CLIENT ID NOT SENT OR NOT KNOWN BY SYSTEM")
-        new_client = True
-        client_id = uuid.uuid4().hex
-        LOGGER.debug("New client connected, generating a unique ID for playback tracking, id : %s " % (client_id))
+    else:
+        try:
+            client_id = event['queryStringParameters']['client_id']
+            new_client = False
+            LOGGER.debug("Known client requesting manifest, id : %s" %(client_id))
+        except:
+            if len(request_path_to_list) == 4:
+                return errorOut("#EXT-X-STATUS: CANNOT PROCESS REQUEST, CLIENT ID NOT SENT OR NOT KNOWN BY SYSTEM")
+            new_client = True
+            session_start_epoch = requesttime_epoch
+            if timeline_mode == "snapped":
+                session_start_epoch = requesttime_epoch - requesttime_epoch % timeline_snap
+            if session_mode == "signed":
+                client_id = createSessionToken(session_secret,enterprise_customer_id,session_start_epoch)
+            else:
+                client_id = uuid.uuid4().hex
+            LOGGER.debug("New client connected, generating a unique ID for playback tracking, id : %s " % (client_id))
 
+    # direct bootstrap : the Clients row is written on the fan-out pool while the master playlist is built
+    client_registration = None
+    if new_client and bootstrap_mode == "direct" and (session_mode != "signed" or session_analytics) and CONFIG['fanout_workers'] > 0:
+        client_registration = fanOut(putClient,db_client,clients_db,client_id,session_start_epoch)
 
     if len(request_path_to_list) == 3: # This is a request for master manifest
 
@@ -461,10 +2081,35 @@ def lambda_handler(event, context):
             master_manifest = master_manifest_constructor(now_and_future_playing[1],client_id)
         else:
             master_manifest = master_manifest_constructor(now_and_future_playing[0],client_id)
+        if len(exceptions) > 0:
+            return master_manifest
+
+        if new_client and bootstrap_mode == "direct":
+            # rendition requests of table sessions look the client up, so its row must be written before the player gets
+            # the client_id. Analytics rows of signed sessions are left to finish on their own
+            try:
+                if client_registration is not None and session_mode != "signed":
+                    with request_metrics.stage("client_register"):
+                        client_registration.result()
+                elif client_registration is not None:
+                    client_registration.add_done_callback(clientRegistered)
+                elif session_mode != "signed" or session_analytics:
+                    with request_metrics.stage("client_register"):
+                        putClient(db_client,clients_db,client_id,session_start_epoch)
+            except Exception as e:
+                LOGGER.error("Unable to register client %s, got exception: %s" % (client_id,e))
+                if session_mode != "signed":
+                    return errorOut("#EXT-X-STATUS: UNABLE TO REGISTER CLIENT IN DATABASE, GOT EXCEPTION %s" % (str(e).upper()))
+
+            # the playlist carries this client's id, so caches must not hand it to other players
+            master_response = playlistResponse(master_manifest['master_manifest_client_id'],acceptedEncoding(event))
+            master_response['headers']['Cache-Control'] = "no-store"
+            return master_response
 
         # If Client is new, create DB entry for client
         if new_client:
-            create_client_id = dbCreateClient(clients_db,client_id,requesttime_epoch)
+            if session_mode != "signed" or session_analytics:
+                create_client_id = dbCreateClient(clients_db,client_id,session_start_epoch)
 
             redirect_url = "https://%s%s?client_id=%s" % (event['requestContext']['domainName'],event['requestContext']['path'],client_id)
 
@@ -480,21 +2125,20 @@ def lambda_handler(event, context):
             if len(exceptions) > 0:
                 return errorOut(exceptions)
 
+        if publish_epoch is not None:
+            master_response = playlistResponse(master_manifest['master_manifest_client_id'],"identity")
+            master_response['publishState'] = {"renditions":len(master_manifest['rendition_list'])}
+            return master_response
+
         # Return master manifest back to client
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Content-Type": "application/vnd.apple.mpegURL",
-                "Access-Control-Allow-Origin":"*"
-            },
-            "body": master_manifest['master_manifest_client_id']
-        }
+        return playlistResponse(master_manifest['master_manifest_client_id'],acceptedEncoding(event))
 
     elif len(request_path_to_list) == 4: # this is a request for the child playlist
-        try:
-            client_id = event['queryStringParameters']['client_id']
-        except:
-            return errorOut("#EXT-X-STATUS: YOU MUST REQUEST A RENDITION PLAYLIST WITH A VALID CLIENT ID - PLEASE TRY AGAIN")
+        if publish_epoch is None:
+            try:
+                client_id = event['queryStringParameters']['client_id']
+            except:
+                return errorOut("#EXT-X-STATUS: YOU MUST REQUEST A RENDITION PLAYLIST WITH A VALID CLIENT ID - PLEASE TRY AGAIN")
 
         # Rendition number being requested
 
@@ -505,29 +2149,86 @@ def lambda_handler(event, context):
             return errorOut("#EXT-X-STATUS: YOU ARE REQUESTING AN INVALID RENDITION")
         # use requesttime_epoch to check content_management_db
 
-        # get session start time
-        session_start_epoch = dbGetClientInfo(clients_db,client_id)
-        if len(exceptions) > 0:
-            return errorOut("#EXT-X-STATUS: UNABLE TO GET CLIENT DATA BACK FROM DB")
-
-        session_start_epoch = int(session_start_epoch['Item']['session_start']['N'])
-        schedule_since_session_start = nowPlaying(content_management_db,session_start_epoch)
-        schedule_since_session_start = sorted(schedule_since_session_start, key=lambda k: k['EndTimeEpoch'])
+        # blocking reload request, _HLS_msn is the media sequence the player waits for
+        requested_media_sequence = None
+        if can_block_reload and '_HLS_msn' in (event['queryStringParameters'] or {}):
+            try:
+                requested_media_sequence = int(event['queryStringParameters']['_HLS_msn'])
+            except ValueError:
+                return errorResponse(400,"#EXT-X-STATUS: _HLS_MSN MUST BE A MEDIA SEQUENCE NUMBER")
+
+        # get session start time, signed sessions are verified locally. Clients registered before signed sessions were enabled are still looked up in the DB
+        # in channel mode every client shares the channel clock, so there is nothing to look up
+        if timeline_mode == "channel":
+            session_start_epoch = channel_epoch
+        elif session_mode == "signed" and isSessionToken(client_id):
+            session_start_epoch = verifySessionToken(session_secret,enterprise_customer_id,client_id)
+            if session_start_epoch is None:
+                return errorOut("#EXT-X-STATUS: CANNOT PROCESS REQUEST, CLIENT ID NOT SENT OR NOT KNOWN BY SYSTEM")
+        else:
+            # in the table schedule model the schedule doesn't depend on the session start, it is read while the client is looked up
+            schedule_future = None
+            if CONFIG['fanout_workers'] > 0 and schedule_channel is None and not SCHEDULE_CACHE.fresh(content_management_db):
+                schedule_future = fanOut(SCHEDULE_CACHE.get,db_client,content_management_db)
+            session_start_epoch = dbGetClientInfo(clients_db,client_id)
+            if schedule_future is not None:
+                fanOutWait([schedule_future])
+            if len(exceptions) > 0:
+                return errorOut("#EXT-X-STATUS: UNABLE TO GET CLIENT DATA BACK FROM DB")
 
+            session_start_epoch = int(session_start_epoch['Item']['session_start']['N'])
 
         # get the epoch time window for the manifest
         time_window_end = int(requesttime_epoch)
+        if timeline_mode != "session":
+            time_window_end = time_window_end - time_window_end % timeline_snap
+        if timeline_mode == "snapped":
+            session_start_epoch = session_start_epoch - session_start_epoch % timeline_snap
         time_window_start = time_window_end - sliding_window
 
-        new_child_manifest = manifestLinearizer(schedule_since_session_start,time_window_start,time_window_end,rendition_number)
-
-        # child playlist to grab
-        # Where we are in asset : requesttime_epoch - session_start_epoch - math.floor(requesttime_epoch - session_start_epoch / now_and_future_playing[0]['AssetDuration']) * now_and_future_playing[0]['AssetDuration']
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Content-Type": "application/vnd.apple.mpegURL",
-                "Access-Control-Allow-Origin":"*"
-            },
-            "body": new_child_manifest
-        }
\ No newline at end of file
+        session_schedule = sessionSchedule(content_management_db,session_start_epoch,time_window_start)
+        if len(exceptions) > 0:
+            return session_schedule
+
+        content_encoding = acceptedEncoding(event)
+        skip_requested = can_skip_until > 0 and (event['queryStringParameters'] or {}).get('_HLS_skip') in ("YES","v2")
+
+        # clients on a shared timeline get the same playlist until the next snap boundary, render and encode it once for all of them
+        # published playlists leave out the server control tags, they are rendered once per tick and never shared
+        rendered_playlist_key = None
+        child_response = None
+        if timeline_mode != "session" and publish_epoch is None:
+            rendered_playlist_key = (enterprise_customer_id,channel_name,rendition_number,session_start_epoch,time_window_end,sliding_window,session_schedule['generation'],content_encoding,skip_requested)
+            cached_playlist = RENDERED_PLAYLIST_CACHE.get(rendered_playlist_key)
+            if cached_playlist is not None:
+                child_response, cached_state = cached_playlist
+                playlist_state.update(cached_state)
+
+        if child_response is None:
+            new_child_manifest = manifestLinearizer(session_schedule,time_window_start,time_window_end,rendition_number,skip_requested)
+            if len(exceptions) > 0:
+                return new_child_manifest
+            LOGGER.debug("Manifest cache stats : %s" % (MANIFEST_CACHE.stats()))
+
+            # child playlist to grab
+            # Where we are in asset : requesttime_epoch - session_start_epoch - math.floor(requesttime_epoch - session_start_epoch / now_and_future_playing[0]['AssetDuration']) * now_and_future_playing[0]['AssetDuration']
+            child_response = playlistResponse(new_child_manifest,content_encoding)
+            if rendered_playlist_key is not None:
+                RENDERED_PLAYLIST_CACHE.put(rendered_playlist_key,(child_response,dict(playlist_state)))
+
+        # blocking reload : hold the request until the requested media sequence is in the playlist
+        if requested_media_sequence is not None and requested_media_sequence >= playlist_state['next_media_sequence']:
+            if requested_media_sequence > playlist_state['next_media_sequence'] + BLOCKING_RELOAD_MAX_AHEAD - 1:
+                return errorResponse(400,"#EXT-X-STATUS: REQUESTED MEDIA SEQUENCE IS TOO FAR AHEAD OF THE PLAYLIST")
+            block_until = playlist_state['next_segment_epoch']
+            if timeline_mode != "session":
+                block_until += -block_until % timeline_snap
+            # segment boundaries can fall between seconds, the playlist holds the segment from the next whole second
+            return {"blockUntil":math.ceil(block_until)}
+
+        if publish_epoch is not None:
+            return dict(child_response,headers=dict(child_response['headers']),publishState=dict(playlist_state))
+
+        if rendered_playlist_key is not None:
+            return dict(child_response,headers=dict(child_response['headers']))
+        return child_response
\ No newline at end of file
@@ -0,0 +1,84 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Long running publisher around the linearizer engine. Renders the channel playlists once per timeline snap
+boundary and writes them to S3 (or a local directory), the same way the Lambda function does for {"publish":...} events.
+
+Usage:
+    python hls_vod_linearizer_publisher.py --channels 00001/channel1 --bucket my-playlists --duration 3600
+    python hls_vod_linearizer_publisher.py --channels 00001/channel1 --publish-root ./published --s3-root ./media --tables ./tables.json
+
+Original Author: Scott Cunningham
+'''
+
+import argparse
+import json
+import logging
+import os
+
+import hls_vod_linearizer
+import local_backends
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish channel playlists from the HLS VOD linearizer to storage")
+    parser.add_argument("--channels",required=True,help="Comma separated <tenant>/<channel> list")
+    parser.add_argument("--bucket",default="",help="Bucket the playlists are written to, PUBLISH_BUCKET by default")
+    parser.add_argument("--prefix",default=None,help="Key prefix of the playlists, PUBLISH_PREFIX by default")
+    parser.add_argument("--duration",type=float,default=0,help="Seconds to keep publishing for, 0 publishes once")
+    parser.add_argument("--publish-root",help="Write the playlists to a local directory laid out as <root>/<bucket>/<key> instead of S3")
+    parser.add_argument("--s3-root",help="Serve S3 from a local directory laid out as <root>/<bucket>/<key> instead of AWS")
+    parser.add_argument("--tables",help="Serve DynamoDB from a JSON tables file instead of AWS, see local_backends.MemoryDynamoDB.loadTables")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    # the publisher only renders the shared channel timeline
+    os.environ['TIMELINE_MODE'] = "channel"
+    os.environ['PUBLISH_DURATION'] = str(args.duration)
+    if args.bucket:
+        os.environ['PUBLISH_BUCKET'] = args.bucket
+    if args.prefix is not None:
+        os.environ['PUBLISH_PREFIX'] = args.prefix
+    hls_vod_linearizer.reloadConfig()
+
+    s3_client = None
+    db_client = None
+    publish_client = None
+    if args.s3_root:
+        s3_client = local_backends.MemoryS3()
+        s3_client.loadDirectory(args.s3_root)
+    if args.tables:
+        db_client = local_backends.MemoryDynamoDB()
+        db_client.loadTables(args.tables)
+    if args.publish_root:
+        publish_client = local_backends.DirectoryStorage(args.publish_root)
+    hls_vod_linearizer.setBackends(db_client=db_client,s3_client=s3_client,publish_client=publish_client)
+
+    report = hls_vod_linearizer.publishChannels(args.channels.split(","),None)
+    print(json.dumps(report,indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Long running HTTP server around the linearizer engine. Serves the same /<tenant>/<channel>.m3u8 and
+/<tenant>/<channel>/<n>.m3u8 routes as the API Gateway deployment, so the engine caches and backend connections
+live for the life of the process instead of a Lambda instance.
+
+Usage:
+    python hls_vod_linearizer_server.py --port 8080
+    python hls_vod_linearizer_server.py --port 8080 --s3-root ./media --tables ./tables.json
+
+Original Author: Scott Cunningham
+'''
+
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import logging
+import urllib.parse
+
+import hls_vod_linearizer
+import local_backends
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+HTTP_REASONS = {200:"OK",301:"Moved Permanently",400:"Bad Request",404:"Not Found",405:"Method Not Allowed",500:"Internal Server Error",503:"Service Unavailable"}
+
+
+def apiGatewayEvent(method,target,headers,stage_path=""):
+    '''
+    Build the API Gateway proxy event that lambda_handler expects from an HTTP request line and headers
+    '''
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    return {
+        "httpMethod":method,
+        "path":url.path,
+        "headers":headers,
+        "queryStringParameters":query or None,
+        "requestContext":{
+            "domainName":headers.get('host',''),
+            "path":stage_path+url.path
+        }
+    }
+
+
+def httpResponse(response,keep_alive,head=False):
+    '''
+    Serialize a lambda_handler proxy response as an HTTP/1.1 response. A HEAD response carries the Content-Length of the
+    body a GET would get, without the body
+    '''
+    body = response.get('body') or ""
+    if response.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    elif isinstance(body,str):
+        body = body.encode('utf-8')
+
+    status_code = response['statusCode']
+    response_lines = ["HTTP/1.1 %s %s" % (status_code,HTTP_REASONS.get(status_code,""))]
+    for header_name, header_value in response.get('headers',{}).items():
+        response_lines.append("%s: %s" % (header_name,header_value))
+    response_lines.append("Content-Length: %s" % (len(body)))
+    response_lines.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+    if head:
+        body = b""
+    return ("\r\n".join(response_lines) + "\r\n\r\n").encode('latin-1') + body
+
+
+class LinearizerServer(object):
+    '''
+    asyncio HTTP/1.1 front end. Requests are parsed on the event loop and handed to lambda_handler on a thread pool,
+    so slow backend calls for one player don't hold up the others
+    '''
+    def __init__(self,workers,stage_path=""):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.stage_path = stage_path
+
+    async def handleConnection(self,reader,writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').strip().split(" ",2)
+                    headers = dict()
+                    while True:
+                        header_line = await reader.readline()
+                        if header_line in (b"\r\n",b"\n",b""):
+                            break
+                        header_name, header_value = header_line.decode('latin-1').split(":",1)
+                        headers[header_name.strip().lower()] = header_value.strip()
+                    content_length = int(headers.get('content-length','0'))
+                    if content_length < 0:
+                        raise ValueError("negative content-length")
+                except ValueError:
+                    writer.write(httpResponse(hls_vod_linearizer.errorResponse(400,"#EXT-X-STATUS: MALFORMED REQUEST, NOT VALID"),False))
+                    await writer.drain()
+                    break
+
+                if content_length > 0:
+                    await reader.readexactly(content_length)
+
+                keep_alive = version == "HTTP/1.1" and headers.get('connection','').lower() != "close"
+
+                if method not in ("GET","HEAD"):
+                    response = hls_vod_linearizer.errorResponse(405,"#EXT-X-STATUS: METHOD NOT ALLOWED")
+                else:
+                    response = await self.invoke(apiGatewayEvent(method,target,headers,self.stage_path))
+
+                writer.write(httpResponse(response,keep_alive,method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionResetError,asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def invoke(self,event):
+        '''
+        Build the response on the thread pool. Blocking playlist reloads wait on the event loop, so held requests don't
+        take up worker threads
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = hls_vod_linearizer.blockingReloadDeadline(None)
+        try:
+            response = await loop.run_in_executor(self.executor,hls_vod_linearizer.handleRequest,event,None)
+            renders = 1
+            while 'blockUntil' in response:
+                delay = hls_vod_linearizer.blockingReloadDelay(response['blockUntil'],deadline,renders)
+                if delay is None:
+                    return hls_vod_linearizer.errorResponse(503,"#EXT-X-STATUS: REQUESTED MEDIA SEQUENCE NOT AVAILABLE YET")
+                await asyncio.sleep(delay)
+                response = await loop.run_in_executor(self.executor,hls_vod_linearizer.handleRequest,event,None)
+                renders += 1
+            return response
+        except Exception as e:
+            LOGGER.exception("Unhandled exception while building playlist for %s" % (event['path']))
+            return hls_vod_linearizer.errorResponse(500,"#EXT-X-STATUS: ERROR - %s" % (str(e).upper()))
+
+    async def serve(self,host,port):
+        server = await asyncio.start_server(self.handleConnection,host,port)
+        LOGGER.info("Linearizer listening on %s:%s" % (host,port))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long running HTTP server for the HLS VOD linearizer")
+    parser.add_argument("--host",default="0.0.0.0")
+    parser.add_argument("--port",type=int,default=8080)
+    parser.add_argument("--workers",type=int,default=32,help="Threads used to build playlists concurrently")
+    parser.add_argument("--stage-path",default="",help="Path prefix the load balancer strips before forwarding, used for redirects")
+    parser.add_argument("--s3-root",help="Serve S3 from a local directory laid out as <root>/<bucket>/<key> instead of AWS")
+    parser.add_argument("--tables",help="Serve DynamoDB from a JSON tables file instead of AWS, see local_backends.MemoryDynamoDB.loadTables")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    s3_client = None
+    db_client = None
+    if args.s3_root:
+        s3_client = local_backends.MemoryS3()
+        s3_client.loadDirectory(args.s3_root)
+    if args.tables:
+        db_client = local_backends.MemoryDynamoDB()
+        db_client.loadTables(args.tables)
+    hls_vod_linearizer.setBackends(db_client=db_client,s3_client=s3_client)
+
+    asyncio.run(LinearizerServer(args.workers,args.stage_path).serve(args.host,args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: In-memory stand-ins for the S3 and DynamoDB boto3 clients used by the linearizer and ingest functions.
+Only the calls (and call arguments) those functions make are implemented.
+
+Original Author: Scott Cunningham
+'''
+
+import io
+import re
+import os
+import json
+import hashlib
+import time
+import threading
+import collections
+
+
+class MemoryClientError(Exception):
+    '''
+    Exception shaped like botocore's ClientError, so callers can inspect e.response the same way
+    '''
+    def __init__(self,code,message,status_code,operation_name):
+        super(MemoryClientError,self).__init__("An error occurred (%s) when calling the %s operation: %s" % (code,operation_name,message))
+        self.response = {
+            "Error":{"Code":code,"Message":message},
+            "ResponseMetadata":{"HTTPStatusCode":status_code}
+        }
+        self.operation_name = operation_name
+
+
+class MemoryS3(object):
+    '''
+    Dictionary backed S3 client. Objects are keyed by (bucket, key)
+    '''
+    def __init__(self):
+        self.objects = dict()
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.bytes_out = 0
+        # seconds added to every read, to stand in for the network round trip
+        self.latency = 0
+
+    def put_object(self,Bucket,Key,Body,**kwargs):
+        if isinstance(Body,str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body,'read'):
+            Body = Body.read()
+        etag = '"%s"' % (hashlib.md5(Body).hexdigest())
+        with self.lock:
+            self.calls['put_object'] += 1
+            self.objects[(Bucket,Key)] = {"Body":Body,"ETag":etag,"ContentType":kwargs.get('ContentType',''),"CacheControl":kwargs.get('CacheControl','')}
+        return {"ETag":etag}
+
+    def get_object(self,Bucket,Key,IfNoneMatch=None,Range=None,**kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls['get_object'] += 1
+            s3_object = self.objects.get((Bucket,Key))
+            if s3_object is None:
+                raise MemoryClientError("NoSuchKey","The specified key does not exist.",404,"GetObject")
+            if IfNoneMatch is not None and IfNoneMatch == s3_object['ETag']:
+                raise MemoryClientError("304","Not Modified",304,"GetObject")
+            body = s3_object['Body']
+            if Range is not None:
+                # only the bytes=<first>-<last> form
+                first_byte, last_byte = Range.split("=",1)[1].split("-")
+                body = body[int(first_byte):int(last_byte)+1]
+            self.bytes_out += len(body)
+        return {
+            "Body":io.BytesIO(body),
+            "ETag":s3_object['ETag'],
+            "ContentLength":len(body),
+            "ContentType":s3_object['ContentType']
+        }
+
+    def head_object(self,Bucket,Key,**kwargs):
+        with self.lock:
+            self.calls['head_object'] += 1
+            s3_object = self.objects.get((Bucket,Key))
+        if s3_object is None:
+            raise MemoryClientError("404","Not Found",404,"HeadObject")
+        return {"ETag":s3_object['ETag'],"ContentLength":len(s3_object['Body'])}
+
+    def list_objects_v2(self,Bucket,Prefix="",ContinuationToken=None,MaxKeys=1000,StartAfter="",**kwargs):
+        with self.lock:
+            self.calls['list_objects_v2'] += 1
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix) and key > StartAfter)
+        start = int(ContinuationToken) if ContinuationToken else 0
+        page = keys[start:start+MaxKeys]
+        response = {"Contents":[{"Key":key,"Size":len(self.objects[(Bucket,key)]['Body'])} for key in page],"KeyCount":len(page)}
+        if start + MaxKeys < len(keys):
+            response['IsTruncated'] = True
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        else:
+            response['IsTruncated'] = False
+        return response
+
+    def loadDirectory(self,root):
+        '''
+        Load a local directory into the client, the first directory level is the bucket name: <root>/<bucket>/<key>
+        '''
+        for bucket in sorted(os.listdir(root)):
+            bucket_root = os.path.join(root,bucket)
+            if not os.path.isdir(bucket_root):
+                continue
+            for directory, subdirectories, files in os.walk(bucket_root):
+                for file_name in files:
+                    file_path = os.path.join(directory,file_name)
+                    key = os.path.relpath(file_path,bucket_root).replace(os.sep,"/")
+                    with open(file_path,'rb') as local_file:
+                        self.put_object(Bucket=bucket,Key=key,Body=local_file.read())
+        self.calls.clear()
+
+
+class DirectoryStorage(object):
+    '''
+    put_object writing to a local directory laid out as <root>/<bucket>/<key>, for the publisher. Objects are replaced
+    atomically, so a web server reading the directory never serves a partly written playlist. The headers each object
+    was written with are kept in self.headers
+    '''
+    def __init__(self,root):
+        self.root = root
+        self.headers = dict()
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+
+    def put_object(self,Bucket,Key,Body,**kwargs):
+        if isinstance(Body,str):
+            Body = Body.encode('utf-8')
+        file_path = os.path.join(self.root,Bucket,*Key.split("/"))
+        os.makedirs(os.path.dirname(file_path),exist_ok=True)
+        with open(file_path + ".tmp",'wb') as local_file:
+            local_file.write(Body)
+        os.replace(file_path + ".tmp",file_path)
+        with self.lock:
+            self.calls['put_object'] += 1
+            self.headers[(Bucket,Key)] = {"ContentType":kwargs.get('ContentType',''),"CacheControl":kwargs.get('CacheControl','')}
+        return {"ETag":'"%s"' % (hashlib.md5(Body).hexdigest())}
+
+
+class MemoryDynamoDB(object):
+    '''
+    Dictionary backed DynamoDB client. Items use the DynamoDB attribute value format, eg. {"endtimeepoch":{"N":"1631849400"}}
+    '''
+    def __init__(self):
+        self.tables = dict()
+        self.key_schemas = dict()
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        # requests left unprocessed by batch_write_item calls carrying more than that many, to exercise retries like a throttled table
+        self.unprocessed_per_batch = 0
+        # seconds added to every read, to stand in for the network round trip
+        self.latency = 0
+
+    def createTable(self,table_name,hash_key,range_key=None):
+        with self.lock:
+            self.tables.setdefault(table_name,dict())
+            self.key_schemas[table_name] = [key for key in (hash_key,range_key) if key is not None]
+
+    def itemKey(self,table_name,item):
+        if table_name not in self.tables:
+            raise MemoryClientError("ResourceNotFoundException","Requested resource not found: Table: %s not found" % (table_name),400,"GetItem")
+        return tuple(list(item[key].values())[0] for key in self.key_schemas[table_name])
+
+    def get_item(self,TableName,Key,**kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls['get_item'] += 1
+            item = self.tables.get(TableName,{}).get(self.itemKey(TableName,Key))
+        if item is None:
+            return {}
+        if 'ProjectionExpression' in kwargs:
+            projection = [attribute.strip() for attribute in kwargs['ProjectionExpression'].split(",")]
+            item = dict((attribute,item[attribute]) for attribute in projection if attribute in item)
+        return {"Item":dict(item)}
+
+    def put_item(self,TableName,Item,**kwargs):
+        with self.lock:
+            self.calls['put_item'] += 1
+            self.tables[TableName][self.itemKey(TableName,Item)] = dict(Item)
+        return {}
+
+    def delete_item(self,TableName,Key,**kwargs):
+        with self.lock:
+            self.calls['delete_item'] += 1
+            self.tables[TableName].pop(self.itemKey(TableName,Key),None)
+        return {}
+
+    def batch_get_item(self,RequestItems,**kwargs):
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise MemoryClientError("ValidationException","Too many items requested for the BatchGetItem call",400,"BatchGetItem")
+        if self.latency:
+            time.sleep(self.latency)
+        responses = dict()
+        with self.lock:
+            self.calls['batch_get_item'] += 1
+            for table_name, request in RequestItems.items():
+                projection = [attribute.strip() for attribute in request['ProjectionExpression'].split(",")] if 'ProjectionExpression' in request else None
+                responses[table_name] = []
+                for key in request['Keys']:
+                    item = self.tables[table_name].get(self.itemKey(table_name,key))
+                    if item is not None:
+                        responses[table_name].append(dict((attribute,value) for attribute, value in item.items() if projection is None or attribute in projection))
+        return {"Responses":responses,"UnprocessedKeys":{}}
+
+    def batch_write_item(self,RequestItems,**kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise MemoryClientError("ValidationException","Too many items requested for the BatchWriteItem call",400,"BatchWriteItem")
+        unprocessed = dict()
+        with self.lock:
+            self.calls['batch_write_item'] += 1
+            unprocessed_left = self.unprocessed_per_batch
+            if sum(len(requests) for requests in RequestItems.values()) <= unprocessed_left:
+                unprocessed_left = 0
+            for table_name, requests in RequestItems.items():
+                keys = [self.itemKey(table_name,request.get('PutRequest',{}).get('Item') or request['DeleteRequest']['Key']) for request in requests]
+                if len(set(keys)) < len(keys):
+                    raise MemoryClientError("ValidationException","Provided list of item keys contains duplicates",400,"BatchWriteItem")
+                for key, request in zip(keys,requests):
+                    if unprocessed_left > 0:
+                        unprocessed.setdefault(table_name,[]).append(request)
+                        unprocessed_left -= 1
+                    elif 'PutRequest' in request:
+                        self.tables[table_name][key] = dict(request['PutRequest']['Item'])
+                    else:
+                        self.tables[table_name].pop(key,None)
+        return {"UnprocessedItems":unprocessed}
+
+    def scan(self,TableName,ExclusiveStartKey=None,Limit=None,**kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls['scan'] += 1
+            if TableName not in self.tables:
+                raise MemoryClientError("ResourceNotFoundException","Requested resource not found",400,"Scan")
+            keys = sorted(self.tables[TableName])
+            start = 0
+            if ExclusiveStartKey is not None:
+                start = keys.index(self.itemKey(TableName,ExclusiveStartKey)) + 1
+            end = len(keys) if Limit is None else start + Limit
+            items = [dict(self.tables[TableName][key]) for key in keys[start:end]]
+        response = {"Items":items,"Count":len(items)}
+        if end < len(keys):
+            response['LastEvaluatedKey'] = dict((key,items[-1][key]) for key in self.key_schemas[TableName])
+        return response
+
+    def query(self,TableName,KeyConditionExpression,ExpressionAttributeValues,ExclusiveStartKey=None,Limit=None,ScanIndexForward=True,**kwargs):
+        '''
+        Only the "<hash key> = :value" condition, optionally followed by "AND <range key> <op> :value" with a numeric range key
+        '''
+        condition = re.match(r"^\s*(\w+)\s*=\s*(:\w+)\s*(?:AND\s+(\w+)\s*(<=|>=|<|>|=)\s*(:\w+))?\s*$",KeyConditionExpression)
+        if condition is None:
+            raise MemoryClientError("ValidationException","Unsupported KeyConditionExpression: %s" % (KeyConditionExpression),400,"Query")
+        hash_key, hash_value, range_key, range_operator, range_value = condition.groups()
+        hash_value = list(ExpressionAttributeValues[hash_value].values())[0]
+        range_test = lambda value: True
+        if range_key is not None:
+            bound = float(list(ExpressionAttributeValues[range_value].values())[0])
+            range_test = {
+                "<":lambda value: value < bound,
+                "<=":lambda value: value <= bound,
+                ">":lambda value: value > bound,
+                ">=":lambda value: value >= bound,
+                "=":lambda value: value == bound
+            }[range_operator]
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls['query'] += 1
+            if TableName not in self.tables:
+                raise MemoryClientError("ResourceNotFoundException","Requested resource not found",400,"Query")
+            key_schema = self.key_schemas[TableName]
+            if key_schema[0] != hash_key or (range_key is not None and key_schema[1:] != [range_key]):
+                raise MemoryClientError("ValidationException","Query condition missed key schema element",400,"Query")
+            keys = [key for key in self.tables[TableName] if key[0] == hash_value and (len(key) == 1 or range_test(float(key[1])))]
+            keys.sort(key=lambda key: float(key[1]) if len(key) > 1 else 0,reverse=not ScanIndexForward)
+            start = 0
+            if ExclusiveStartKey is not None:
+                start = keys.index(self.itemKey(TableName,ExclusiveStartKey)) + 1
+            end = len(keys) if Limit is None else start + Limit
+            items = [dict(self.tables[TableName][key]) for key in keys[start:end]]
+        response = {"Items":items,"Count":len(items)}
+        if end < len(keys):
+            response['LastEvaluatedKey'] = dict((key,items[-1][key]) for key in key_schema)
+        return response
+
+    def loadTables(self,tables_file):
+        '''
+        Load tables from a JSON file : {"<table name>":{"key_schema":["<hash key>","<range key>"],"items":[...]}}
+        '''
+        with open(tables_file) as json_file:
+            tables = json.load(json_file)
+        for table_name in tables:
+            self.createTable(table_name,*tables[table_name]['key_schema'])
+            for item in tables[table_name]['items']:
+                self.put_item(TableName=table_name,Item=item)
+        self.calls.clear()
@@ -0,0 +1,101 @@
+'''
+hls_vod_linearizer.backendCall : calls made on the request thread, hedged reads falling back to the attempt still running
+when the other one fails, and only first attempts timed for the hedge delay.
+'''
+
+import os
+import sys
+import time
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_vod_linearizer
+
+
+class Throttled(Exception):
+    pass
+
+
+class ScriptedRead(object):
+    '''
+    Backend read answering each call after the given delay, with the given result or exception
+    '''
+    def __init__(self,*script):
+        self.script = list(script)
+        self.calls = 0
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def __call__(self,**kwargs):
+        with self.lock:
+            delay, result = self.script[self.calls]
+            self.calls += 1
+            self.threads.append(threading.current_thread())
+        time.sleep(delay)
+        if isinstance(result,Exception):
+            raise result
+        return result
+
+
+class BackendCallTest(unittest.TestCase):
+    def setUp(self):
+        hls_vod_linearizer.READ_LATENCIES.clear()
+        self.addCleanup(hls_vod_linearizer.READ_LATENCIES.clear)
+        hls_vod_linearizer.DEADLINE_CONTEXT.deadline = time.time() + 2
+        self.addCleanup(setattr,hls_vod_linearizer.DEADLINE_CONTEXT,'deadline',None)
+
+    def hedgeAfter(self,seconds):
+        hls_vod_linearizer.READ_LATENCIES.delay = seconds
+
+    def testCallsWithoutHedgeRunInline(self):
+        read = ScriptedRead((0,"answer"))
+        self.assertEqual(hls_vod_linearizer.backendCall(read),"answer")
+        self.assertEqual(read.threads,[threading.current_thread()])
+
+    def testBudgetSpent(self):
+        hls_vod_linearizer.DEADLINE_CONTEXT.deadline = time.time() - 1
+        read = ScriptedRead((0,"answer"))
+        self.assertRaises(hls_vod_linearizer.BackendTimeout,hls_vod_linearizer.backendCall,read)
+        self.assertEqual(read.calls,0)
+
+    def testHedgeAnswersWhenFirstAttemptFails(self):
+        self.hedgeAfter(0.05)
+        read = ScriptedRead((0.1,Throttled("slow down")),(0.2,"answer"))
+        self.assertEqual(hls_vod_linearizer.backendCall(read,hedge=True),"answer")
+        self.assertEqual(read.calls,2)
+
+    def testFirstAttemptAnswersWhenHedgeFails(self):
+        self.hedgeAfter(0.05)
+        read = ScriptedRead((0.2,"answer"),(0,Throttled("slow down")))
+        self.assertEqual(hls_vod_linearizer.backendCall(read,hedge=True),"answer")
+
+    def testEveryAttemptFails(self):
+        self.hedgeAfter(0.05)
+        read = ScriptedRead((0.1,Throttled("first")),(0.15,Throttled("hedge")))
+        with self.assertRaisesRegex(Throttled,"first"):
+            hls_vod_linearizer.backendCall(read,hedge=True)
+
+    def testFastFailureIsNotHedged(self):
+        self.hedgeAfter(0.2)
+        read = ScriptedRead((0,Throttled("slow down")))
+        self.assertRaises(Throttled,hls_vod_linearizer.backendCall,read,hedge=True)
+        self.assertEqual(read.calls,1)
+
+    def testOnlyFirstAttemptIsTimed(self):
+        self.hedgeAfter(0.05)
+        read = ScriptedRead((0.3,"first"),(0,"hedge"))
+        with mock.patch.object(hls_vod_linearizer.READ_LATENCIES,"add") as add_latency:
+            self.assertEqual(hls_vod_linearizer.backendCall(read,hedge=True),"hedge")
+            # the first attempt is timed when it answers, after the hedge has won
+            deadline = time.time() + 2
+            while add_latency.call_count == 0 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(add_latency.call_count,1)
+        self.assertGreaterEqual(add_latency.call_args[0][0],0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+'''
+Bulk backfill of a library into ContentLibrary rows : asset names that collide are reported instead of overwritten.
+'''
+
+import os
+import sys
+import logging
+import importlib
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"benchmarks"))
+
+import fixtures
+import local_backends
+
+vod_content_backfill = importlib.import_module("vod-content-backfill")
+
+TABLE = "%s_ContentLibrary" % (fixtures.TENANT)
+
+
+class BackfillNamingTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable,logging.NOTSET)
+        self.s3_client = local_backends.MemoryS3()
+        self.db_client = local_backends.MemoryDynamoDB()
+        self.db_client.createTable(TABLE,"assetname")
+        # a library laid out as <asset>/index.m3u8
+        for asset_name in ("show_a","show_b","show_c"):
+            prefix = "library/%s/" % (asset_name)
+            self.s3_client.put_object(Bucket=fixtures.BUCKET,Key=prefix+"index.m3u8",Body=fixtures.masterManifest("index",1))
+            child_manifest, segments = fixtures.childManifest("index",0,60,6)
+            self.s3_client.put_object(Bucket=fixtures.BUCKET,Key=prefix+"index_0.m3u8",Body=child_manifest)
+        self.playlist_urls = ["s3://%s/library/%s/index.m3u8" % (fixtures.BUCKET,asset_name) for asset_name in ("show_a","show_b","show_c")]
+
+    def backfill(self,naming):
+        return vod_content_backfill.backfill(self.s3_client,self.db_client,TABLE,self.playlist_urls,workers=2,known_masters=True,naming=naming)
+
+    def libraryRows(self):
+        return dict((item['assetname']['S'],item['assetlocation']['S']) for item in self.db_client.scan(TableName=TABLE)['Items'])
+
+    def testFileNamesCollide(self):
+        report = self.backfill("file")
+        self.assertEqual(self.libraryRows(),{"index":self.playlist_urls[0]})
+        self.assertEqual([collision['playlist'] for collision in report['collisions']],self.playlist_urls[1:])
+
+    def testFolderNames(self):
+        report = self.backfill("folder")
+        self.assertEqual(self.libraryRows(),{"show_a":self.playlist_urls[0],"show_b":self.playlist_urls[1],"show_c":self.playlist_urls[2]})
+        self.assertEqual(report['collisions'],[])
+
+    def testRowsFromEarlierRuns(self):
+        self.backfill("file")
+        self.playlist_urls.reverse()
+        report = self.backfill("file")
+        self.assertEqual(self.libraryRows(),{"index":self.playlist_urls[-1]})
+        self.assertEqual(sorted(collision['playlist'] for collision in report['collisions']),sorted(self.playlist_urls[:-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
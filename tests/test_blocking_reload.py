@@ -0,0 +1,74 @@
+'''
+Blocking playlist reloads (_HLS_msn) with segment durations that aren't whole seconds : the held request is rendered
+again once per segment it waits for, not in a loop until the request clock moves on.
+'''
+
+import os
+import sys
+import time
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"benchmarks"))
+
+import fixtures
+import hls_vod_linearizer
+import hls_vod_linearizer_server
+
+
+def mediaSequences(response):
+    '''
+    First and last media sequence numbers of a rendition playlist response
+    '''
+    lines = response['body'].split("\n")
+    media_sequence = [int(line.split(":",1)[1]) for line in lines if line.startswith("#EXT-X-MEDIA-SEQUENCE:")][0]
+    segments = len([line for line in lines if line and not line.startswith("#")])
+    return media_sequence, media_sequence + segments - 1
+
+
+class BlockingReloadTest(unittest.TestCase):
+    def setUp(self):
+        environment = mock.patch.dict(os.environ,{"BLOCKING_RELOAD_TIMEOUT":"6"})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.addCleanup(hls_vod_linearizer.reloadConfig)
+        s3_client, db_client, self.client_id = fixtures.buildChannel(asset_length=60,segment_duration=2.5,sliding_window=30,session_age=301)
+        fixtures.resetEngine(s3_client,db_client,30)
+
+    def nextSegmentEvent(self):
+        '''
+        Request for the media sequence after the last one in the playlist now
+        '''
+        first, last = mediaSequences(hls_vod_linearizer.lambda_handler(fixtures.childEvent(self.client_id),None))
+        event = fixtures.childEvent(self.client_id)
+        event['queryStringParameters']['_HLS_msn'] = str(last + 1)
+        return event, last + 1
+
+    def assertHeldUntilAvailable(self,serve):
+        event, requested = self.nextSegmentEvent()
+        with mock.patch.object(hls_vod_linearizer,"handleRequest",wraps=hls_vod_linearizer.handleRequest) as handle_request:
+            started = time.time()
+            response = serve(event)
+            held = time.time() - started
+        self.assertEqual(response['statusCode'],200,response)
+        self.assertGreaterEqual(mediaSequences(response)[1],requested)
+        # one render up front, then about one per second held at most
+        self.assertLessEqual(handle_request.call_count,int(held) + 3)
+
+    def testLambdaHandler(self):
+        self.assertHeldUntilAvailable(lambda event: hls_vod_linearizer.lambda_handler(event,None))
+
+    def testServer(self):
+        server = hls_vod_linearizer_server.LinearizerServer(2)
+        self.assertHeldUntilAvailable(lambda event: asyncio.run(server.invoke(event)))
+
+    def testBlockUntilWholeSecond(self):
+        event, requested = self.nextSegmentEvent()
+        response = hls_vod_linearizer.handleRequest(event,None)
+        if 'blockUntil' in response:
+            self.assertEqual(response['blockUntil'],int(response['blockUntil']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+'''
+Accept-Encoding negotiation in hls_vod_linearizer.acceptedEncoding.
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_vod_linearizer
+
+
+def encodingFor(accept_encoding):
+    return hls_vod_linearizer.acceptedEncoding({"headers":{"Accept-Encoding":accept_encoding}})
+
+
+class AcceptedEncodingTest(unittest.TestCase):
+    def testGzip(self):
+        self.assertEqual(encodingFor("gzip, deflate"),"gzip")
+
+    def testZeroQualityRefusesEncoding(self):
+        self.assertEqual(encodingFor("gzip;q=0"),"identity")
+
+    def testMalformedQualityIsIgnored(self):
+        self.assertEqual(encodingFor("gzip;q=abc"),"identity")
+        self.assertEqual(encodingFor("gzip;q=abc, *;q=0.5"),"gzip")
+        self.assertEqual(encodingFor("gzip;q=nan"),"identity")
+
+    def testMissingHeader(self):
+        self.assertEqual(hls_vod_linearizer.acceptedEncoding({"headers":None}),"identity")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Single flight manifest fetches in hls_vod_linearizer.ManifestCache, and the lookahead around schedule changes.
+'''
+
+import concurrent.futures
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_vod_linearizer
+import local_backends
+
+
+class ManifestCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.s3_client = local_backends.MemoryS3()
+        self.s3_client.put_object(Bucket="bucket",Key="asset/index_1.m3u8",Body="#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.0,\nsegment_00001.ts\n#EXT-X-ENDLIST\n")
+        self.s3_client.latency = 0.2
+        self.cache = hls_vod_linearizer.ManifestCache(16,60)
+
+    def testConcurrentMissesFetchOnce(self):
+        with mock.patch.dict(hls_vod_linearizer.CONFIG,{"hedge_percentile":0}), concurrent.futures.ThreadPoolExecutor(8) as executor:
+            loads = [executor.submit(self.cache.get,self.s3_client,"bucket","asset/index_1.m3u8",hls_vod_linearizer.parseChildManifest) for request in range(8)]
+            parsed = [load.result() for load in loads]
+        self.assertEqual(self.s3_client.calls['get_object'],1)
+        self.assertEqual(self.cache.stats()['coalesced'],7)
+        self.assertTrue(all(manifest is parsed[0] for manifest in parsed))
+        self.assertEqual(self.cache.loading,{})
+
+    def testWaitersGetTheFetchError(self):
+        with mock.patch.dict(hls_vod_linearizer.CONFIG,{"hedge_percentile":0}), concurrent.futures.ThreadPoolExecutor(4) as executor:
+            loads = [executor.submit(self.cache.get,self.s3_client,"bucket","asset/missing.m3u8",hls_vod_linearizer.parseChildManifest) for request in range(4)]
+            for load in loads:
+                self.assertRaises(Exception,load.result)
+        self.assertEqual(self.s3_client.calls['get_object'],1)
+        self.assertEqual(self.cache.loading,{})
+
+
+class UpcomingItemsTest(unittest.TestCase):
+    def snapshot(self,end_times):
+        return {"end_times":end_times,"items":[{"assetlocation":{"S":"s3://bucket/asset_%s/index.m3u8" % (item)}} for item in range(len(end_times))]}
+
+    def testItemsAboutToStart(self):
+        upcoming = hls_vod_linearizer.upcomingItems(self.snapshot([1000,1100,9999999999]),990,30)
+        self.assertEqual([start for start, item in upcoming],[1000])
+
+    def testItemIngestStartedStraightAway(self):
+        # ingest ends the playing item at the time it runs, so the new item has already started on the next read
+        upcoming = hls_vod_linearizer.upcomingItems(self.snapshot([1000,1100,9999999999]),1005,30)
+        self.assertEqual([start for start, item in upcoming],[1000])
+        self.assertEqual(hls_vod_linearizer.upcomingItems(self.snapshot([1000,1100,9999999999]),1040,30),[])
+
+    def testFirstItemIsNeverUpcoming(self):
+        self.assertEqual(hls_vod_linearizer.upcomingItems(self.snapshot([9999999999]),1000,30),[])
+
+
+class LookaheadPrefetchTest(unittest.TestCase):
+    def setUp(self):
+        hls_vod_linearizer.LOOKAHEAD_STARTED.clear()
+        hls_vod_linearizer.MANIFEST_CACHE.clear()
+        self.snapshot = {"end_times":[1000,9999999999],"items":[{"assetlocation":{"S":"s3://bucket/asset_%s/index.m3u8" % (item)}} for item in range(2)]}
+
+    def waitForStat(self,stat,count):
+        deadline = time.time() + 5
+        while hls_vod_linearizer.LOOKAHEAD_STATS[stat] < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(hls_vod_linearizer.LOOKAHEAD_STATS[stat],count)
+
+    def testFailedPrefetchIsRetried(self):
+        s3_client = local_backends.MemoryS3()
+        failures = hls_vod_linearizer.LOOKAHEAD_STATS['failures']
+        self.assertEqual(hls_vod_linearizer.lookaheadPrefetch(s3_client,self.snapshot,990),1)
+        self.waitForStat('failures',failures + 1)
+        # the asset is there by the next request
+        s3_client.put_object(Bucket="bucket",Key="asset_1/index.m3u8",Body="#EXTM3U\n")
+        prefetches = hls_vod_linearizer.LOOKAHEAD_STATS['prefetches']
+        self.assertEqual(hls_vod_linearizer.lookaheadPrefetch(s3_client,self.snapshot,991),1)
+        self.waitForStat('prefetches',prefetches + 1)
+        self.assertEqual(hls_vod_linearizer.lookaheadPrefetch(s3_client,self.snapshot,992),0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+'''
+Media sequence stability of rendition playlists across schedule item boundaries : once a media sequence number is in a
+playlist it keeps naming the same segment, and the playlist never loses a segment it has published.
+'''
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"benchmarks"))
+
+import fixtures
+import hls_vod_linearizer
+import local_backends
+
+CHANNEL_EPOCH = 1700000000
+
+
+def renditionPlaylist(publish_epoch):
+    '''
+    Media sequence number of every segment of the rendition 0 playlist rendered for publish_epoch
+    '''
+    response = hls_vod_linearizer.handleRequest(hls_vod_linearizer.publishEvent(fixtures.TENANT,fixtures.CHANNEL,0,publish_epoch),None)
+    if response['statusCode'] != 200:
+        raise Exception("Playlist request failed : %s" % (response))
+    segments = dict()
+    media_sequence = None
+    for line in response['body'].split("\n"):
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":",1)[1])
+        elif line and not line.startswith("#"):
+            segments[media_sequence] = line.rsplit("/",1)[-1]
+            media_sequence += 1
+    return segments
+
+
+def playedSegments(schedule,until):
+    '''
+    URIs of the segments of the channel that finished playing by until seconds past the channel epoch, every item looping
+    its asset from where the previous item ended
+    '''
+    played = []
+    item_start = 0
+    for asset_name, segment_durations, end_offset in schedule:
+        item_end = until if end_offset is None else min(end_offset,until)
+        segment_end = item_start
+        while True:
+            for segment, duration in enumerate(segment_durations):
+                segment_end += duration
+                if segment_end > item_end:
+                    break
+                played.append("%s_0_%05d.ts" % (asset_name,segment+1))
+            else:
+                continue
+            break
+        if end_offset is None or end_offset >= until:
+            break
+        item_start = end_offset
+    return played
+
+
+class UnevenSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        environment = mock.patch.dict(os.environ,{"TIMELINE_MODE":"channel","CHANNEL_EPOCH":str(CHANNEL_EPOCH),"TIMELINE_SNAP_SECONDS":"1"})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.addCleanup(hls_vod_linearizer.reloadConfig)
+
+    def buildSchedule(self,schedule,segment_index):
+        '''
+        Channel playing each (asset name, segment durations, end offset from the channel epoch) in turn. Without
+        segment_index the rows are written as they were before ingest indexed assets, with no segment timeline
+        '''
+        s3_client = local_backends.MemoryS3()
+        db_client = local_backends.MemoryDynamoDB()
+        db_client.createTable("%s_ContentManagement" % (fixtures.TENANT),"endtimeepoch")
+        for asset_name, segment_durations, end_offset in schedule:
+            asset = fixtures.putAsset(s3_client,asset_name,0,0,1,segment_index=segment_index,segment_durations=segment_durations)
+            endtimeepoch = hls_vod_linearizer.NOW_PLAYING_EPOCH if end_offset is None else CHANNEL_EPOCH + end_offset
+            db_client.put_item(TableName="%s_ContentManagement" % (fixtures.TENANT),Item=fixtures.scheduleItem(endtimeepoch,asset_name,asset))
+        return s3_client, db_client
+
+    def assertStableMediaSequence(self,sliding_window,schedule,seconds,segment_index=True):
+        s3_client, db_client = self.buildSchedule(schedule,segment_index)
+        fixtures.resetEngine(s3_client,db_client,sliding_window)
+        published = dict()
+        last_media_sequence = 0
+        for offset in range(seconds):
+            segments = renditionPlaylist(CHANNEL_EPOCH + offset)
+            for media_sequence, uri in segments.items():
+                self.assertEqual(published.setdefault(media_sequence,uri),uri,"media sequence %s changed segment at +%ss" % (media_sequence,offset))
+            if len(segments) > 0:
+                self.assertGreaterEqual(max(segments),last_media_sequence,"playlist went back at +%ss" % (offset))
+                last_media_sequence = max(segments)
+        self.assertEqual([published[media_sequence] for media_sequence in sorted(published)],playedSegments(schedule,seconds-1))
+
+    def testItemEndingMidLoop(self):
+        # a ends 13 seconds into its third loop, after its third segment and during its 8 second last one
+        schedule = [("a",[4,4,4,8],53),("b",[4,4,4,8],None)]
+        for sliding_window in (120,20):
+            self.assertStableMediaSequence(sliding_window,schedule,120)
+
+    def testShortLastSegment(self):
+        # a ends 11 seconds into its third loop, after one segment, b ends 7 seconds into its second loop, after two
+        schedule = [("a",[6,6,2],39),("b",[2.5,2.5,2.5,1.5],55),("c",[6,6,2],None)]
+        for sliding_window in (120,12):
+            self.assertStableMediaSequence(sliding_window,schedule,120)
+
+    def testRowsWithoutTimeline(self):
+        schedule = [("a",[6,6,6,2],47),("b",[6,6,6,2],None)]
+        for sliding_window in (120,12):
+            self.assertStableMediaSequence(sliding_window,schedule,120,segment_index=False)
+
+    def testShortRowsWithoutTimeline(self):
+        # 14 seconds in 3 segments could as well be 5 second segments, the durations are read from the asset
+        schedule = [("a",[6,6,2],39),("b",[4,4,1],55),("c",[6,6,2],None)]
+        for sliding_window in (120,12):
+            self.assertStableMediaSequence(sliding_window,schedule,120,segment_index=False)
+
+
+class ChannelEpochTest(unittest.TestCase):
+    def setUp(self):
+        environment = mock.patch.dict(os.environ,{"TIMELINE_MODE":"channel","CHANNEL_EPOCH":str(CHANNEL_EPOCH),"TIMELINE_SNAP_SECONDS":"1"})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.addCleanup(hls_vod_linearizer.reloadConfig)
+        s3_client = local_backends.MemoryS3()
+        db_client = local_backends.MemoryDynamoDB()
+        db_client.createTable("%s_ContentManagement" % (fixtures.TENANT),"endtimeepoch")
+        asset = fixtures.putAsset(s3_client,"a",60,6,1)
+        db_client.put_item(TableName="%s_ContentManagement" % (fixtures.TENANT),Item=fixtures.scheduleItem(hls_vod_linearizer.NOW_PLAYING_EPOCH,"a",asset))
+        fixtures.resetEngine(s3_client,db_client,30)
+
+    def testMediaSequenceCountsFromEpoch(self):
+        # 6 second segments, 10 to a loop : 20 segments have played 125 seconds in, 600 an hour and 5 seconds in
+        self.assertEqual(renditionPlaylist(CHANNEL_EPOCH + 125),{16:"a_0_00006.ts",17:"a_0_00007.ts",18:"a_0_00008.ts",19:"a_0_00009.ts",20:"a_0_00010.ts"})
+        self.assertEqual(renditionPlaylist(CHANNEL_EPOCH + 3605),{596:"a_0_00006.ts",597:"a_0_00007.ts",598:"a_0_00008.ts",599:"a_0_00009.ts",600:"a_0_00010.ts"})
+
+    def testMissingEpoch(self):
+        with mock.patch.dict(os.environ,{"CHANNEL_EPOCH":"0"}), mock.patch.object(hls_vod_linearizer.LOGGER,"error") as log_error:
+            self.assertEqual(hls_vod_linearizer.loadConfig()['timeline_mode'],"session")
+        self.assertEqual(log_error.call_count,1)
+        with mock.patch.dict(os.environ,{"CHANNEL_EPOCH":str(CHANNEL_EPOCH)}):
+            self.assertEqual(hls_vod_linearizer.loadConfig()['timeline_mode'],"channel")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+Raw HTTP requests against hls_vod_linearizer_server.py : malformed request heads are answered with a 400 instead of
+dropping the connection, and HEAD answers with the headers of the matching GET.
+'''
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"benchmarks"))
+
+import fixtures
+import hls_vod_linearizer_server
+
+
+def rawRequest(request):
+    '''
+    Send raw bytes to a server on an ephemeral port and return everything it answers before closing the connection
+    '''
+    async def exchange():
+        server = await asyncio.start_server(hls_vod_linearizer_server.LinearizerServer(1).handleConnection,"127.0.0.1",0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(request)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(),5)
+            writer.close()
+            return response
+    return asyncio.run(exchange())
+
+
+class MalformedRequestTest(unittest.TestCase):
+    def assertBadRequest(self,response):
+        self.assertTrue(response.startswith(b"HTTP/1.1 400 Bad Request\r\n"),response)
+        self.assertIn(b"#EXT-X-STATUS: MALFORMED REQUEST",response)
+
+    def testRequestLineWithoutTarget(self):
+        self.assertBadRequest(rawRequest(b"GET\r\n\r\n"))
+
+    def testHeaderWithoutColon(self):
+        self.assertBadRequest(rawRequest(b"GET /00001/channel.m3u8 HTTP/1.1\r\nHost example.com\r\n\r\n"))
+
+    def testNonNumericContentLength(self):
+        self.assertBadRequest(rawRequest(b"GET /00001/channel.m3u8 HTTP/1.1\r\nHost: example.com\r\nContent-Length: abc\r\n\r\n"))
+
+    def testNegativeContentLength(self):
+        self.assertBadRequest(rawRequest(b"GET /00001/channel.m3u8 HTTP/1.1\r\nHost: example.com\r\nContent-Length: -1\r\n\r\n"))
+
+
+class HeadRequestTest(unittest.TestCase):
+    def setUp(self):
+        s3_client, db_client, self.client_id = fixtures.buildChannel(asset_length=60,sliding_window=30)
+        fixtures.resetEngine(s3_client,db_client,30)
+
+    def request(self,method):
+        event = fixtures.childEvent(self.client_id)
+        request = "%s %s?client_id=%s HTTP/1.1\r\nHost: example.com\r\nConnection: close\r\n\r\n" % (method,event['path'],self.client_id)
+        head, body = rawRequest(request.encode('latin-1')).split(b"\r\n\r\n",1)
+        headers = dict(line.split(": ",1) for line in head.decode('latin-1').split("\r\n")[1:])
+        return head.split(b"\r\n",1)[0], headers, body
+
+    def testContentLengthOfGet(self):
+        get_status, get_headers, get_body = self.request("GET")
+        head_status, head_headers, head_body = self.request("HEAD")
+        self.assertEqual(get_status,b"HTTP/1.1 200 OK")
+        self.assertEqual(head_status,get_status)
+        self.assertGreater(len(get_body),0)
+        self.assertEqual(int(get_headers['Content-Length']),len(get_body))
+        self.assertEqual(head_headers['Content-Length'],get_headers['Content-Length'])
+        self.assertEqual(head_body,b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+'''
+Signed client ids (SESSION_MODE=signed) : hls_vod_linearizer.verifySessionToken, and the handler refusing tokens it
+didn't sign for the tenant.
+'''
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"benchmarks"))
+
+import fixtures
+import hls_vod_linearizer
+
+SECRET = "0123456789abcdef0123456789abcdef"
+
+
+def tampered(token,position):
+    '''
+    token with the character at position swapped for another one
+    '''
+    return token[:position] + ("A" if token[position] != "A" else "B") + token[position+1:]
+
+
+class VerifySessionTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.token = hls_vod_linearizer.createSessionToken(SECRET,"00002",1700000000)
+
+    def testValidToken(self):
+        self.assertTrue(hls_vod_linearizer.isSessionToken(self.token))
+        self.assertEqual(hls_vod_linearizer.verifySessionToken(SECRET,"00002",self.token),1700000000)
+
+    def testTamperedSignature(self):
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",tampered(self.token,len(self.token)-1)))
+
+    def testTamperedSessionStart(self):
+        forged = self.token.replace(".1700000000.",".1600000000.")
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",forged))
+
+    def testOtherTenant(self):
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00003",self.token))
+        other_tenant = hls_vod_linearizer.createSessionToken(SECRET,"00003",1700000000)
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",other_tenant))
+
+    def testTokenFromRetiredSecret(self):
+        # sessions handed out before the secret was rotated are no longer valid
+        retired = hls_vod_linearizer.createSessionToken("f" * 32,"00002",1700000000)
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",retired))
+
+    def testMalformedTokens(self):
+        for client_id in ["","v1.","v1.00002","v1.00002.1700000000.abcd","v2" + self.token[2:],self.token + ".extra",
+                          "v1.00002.start.abcd.%s" % (self.token.rsplit(".",1)[1])]:
+            self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",client_id),client_id)
+
+    def testNonNumericSessionStartSignedByUs(self):
+        payload = "v1.00002.start.abcd1234"
+        client_id = "%s.%s" % (payload,hls_vod_linearizer.sessionSignature(SECRET,payload))
+        self.assertIsNone(hls_vod_linearizer.verifySessionToken(SECRET,"00002",client_id))
+
+
+class SessionConfigTest(unittest.TestCase):
+    def tearDown(self):
+        hls_vod_linearizer.reloadConfig()
+
+    def sessionMode(self,environment):
+        with mock.patch.dict(os.environ,environment):
+            return hls_vod_linearizer.loadConfig()['session_mode']
+
+    def testSigned(self):
+        self.assertEqual(self.sessionMode({"SESSION_MODE":"signed","SESSION_SECRET":SECRET}),"signed")
+
+    def testMissingSecret(self):
+        with mock.patch.object(hls_vod_linearizer.LOGGER,"error") as log_error:
+            self.assertEqual(self.sessionMode({"SESSION_MODE":"signed","SESSION_SECRET":""}),"table")
+        self.assertEqual(log_error.call_count,1)
+
+    def testShortSecret(self):
+        with mock.patch.object(hls_vod_linearizer.LOGGER,"error") as log_error:
+            self.assertEqual(self.sessionMode({"SESSION_MODE":"signed","SESSION_SECRET":"short"}),"table")
+        self.assertEqual(log_error.call_count,1)
+
+
+class SignedSessionHandlerTest(unittest.TestCase):
+    def setUp(self):
+        environment = mock.patch.dict(os.environ,{"SESSION_MODE":"signed","SESSION_SECRET":SECRET})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.addCleanup(hls_vod_linearizer.reloadConfig)
+        s3_client, db_client, client_id = fixtures.buildChannel(asset_length=60,sliding_window=30)
+        fixtures.resetEngine(s3_client,db_client,30)
+        self.token = hls_vod_linearizer.createSessionToken(SECRET,fixtures.TENANT,int(time.time()) - 300)
+
+    def statusFor(self,client_id):
+        return hls_vod_linearizer.lambda_handler(fixtures.childEvent(client_id),None)['statusCode']
+
+    def testValidToken(self):
+        self.assertEqual(self.statusFor(self.token),200)
+
+    def testTamperedToken(self):
+        self.assertEqual(self.statusFor(tampered(self.token,len(self.token)-1)),404)
+
+    def testOtherTenantToken(self):
+        self.assertEqual(self.statusFor(hls_vod_linearizer.createSessionToken(SECRET,"99999",int(time.time()) - 300)),404)
+
+    def testMalformedToken(self):
+        self.assertEqual(self.statusFor("v1.%s.notanumber" % (fixtures.TENANT)),404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,287 @@
+'''
+Bulk ingest of an existing HLS library into a tenant ContentLibrary table. Master playlists are found under an S3 prefix
+(or read from a list of master URLs), every rendition is indexed the same way vod-content-ingest.py does after a
+MediaConvert job, and the library rows are written with BatchWriteItem.
+
+Progress is checkpointed to a local JSON file after every batch, so an interrupted run picks up where it stopped.
+
+Assets are named after their master playlist file as ingest names them, or after the folder holding it with
+--asset-name folder, for libraries laid out as <asset>/index.m3u8. An asset whose name is already taken by another
+playlist, in this run or in the table, is reported as a collision and not written.
+
+Usage:
+    python vod-content-backfill.py --source s3://bucket/library/ --table 00001_ContentLibrary --checkpoint backfill.json
+    python vod-content-backfill.py --masters masters.txt --table 00001_ContentLibrary --workers 32
+    python vod-content-backfill.py --source s3://bucket/library/ --table 00001_ContentLibrary --asset-name folder
+'''
+import argparse
+import collections
+import concurrent.futures
+import importlib
+import json
+import logging
+import os
+import random
+import time
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+vod_content_ingest = importlib.import_module("vod-content-ingest")
+
+# bytes read to tell a master playlist from a rendition playlist
+PLAYLIST_SNIFF_BYTES = 4096
+
+
+def discoverPlaylists(s3_client,bucket,prefix,start_after=""):
+    '''
+    List the .m3u8 keys under a prefix in key order, starting after start_after
+    '''
+    list_arguments = {"Bucket":bucket,"Prefix":prefix}
+    if start_after:
+        list_arguments['StartAfter'] = start_after
+    while True:
+        response = s3_client.list_objects_v2(**list_arguments)
+        for s3_object in response.get('Contents',[]):
+            if s3_object['Key'].endswith(".m3u8"):
+                yield "s3://%s/%s" % (bucket,s3_object['Key'])
+        if not response.get('IsTruncated'):
+            return
+        list_arguments['ContinuationToken'] = response['NextContinuationToken']
+
+
+def readMasterUrls(masters_file,start_after=""):
+    '''
+    Master playlist URLs from a file, one s3:// URL per line, starting after start_after
+    '''
+    with open(masters_file) as url_file:
+        master_urls = [line.strip() for line in url_file if line.strip()]
+    if start_after in master_urls:
+        master_urls = master_urls[master_urls.index(start_after)+1:]
+    return master_urls
+
+
+def assetName(playlist_url,naming="file"):
+    '''
+    ContentLibrary name of the asset of a master playlist : the playlist file name without .m3u8, as vod-content-ingest.py
+    names assets, or with naming "folder" the name of the folder holding the playlist
+    '''
+    if naming == "folder":
+        return playlist_url.split("/")[-2]
+    return playlist_url.split("/")[-1].replace(".m3u8","")
+
+
+def existingLocations(db_client,table_name,asset_names,max_attempts=8):
+    '''
+    assetlocation of the library rows already written for asset_names, read with BatchGetItem 100 names at a time
+    '''
+    locations = dict()
+    asset_names = list(asset_names)
+    for batch_start in range(0,len(asset_names),100):
+        request_items = {table_name:{"Keys":[{"assetname":{"S":asset_name}} for asset_name in asset_names[batch_start:batch_start+100]],"ProjectionExpression":"assetname, assetlocation"}}
+        for attempt in range(max_attempts):
+            response = db_client.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses',{}).get(table_name,[]):
+                locations[item['assetname']['S']] = item.get('assetlocation',{}).get('S')
+            request_items = response.get('UnprocessedKeys') or {}
+            if len(request_items) == 0:
+                break
+            time.sleep(min(5.0,0.05 * (2 ** attempt)) * random.random())
+        else:
+            raise Exception("Unable to read %s library rows from %s after %s attempts" % (sum(len(request['Keys']) for request in request_items.values()),table_name,max_attempts))
+    return locations
+
+
+def analyseAsset(s3_client,playlist_url,known_master=False,naming="file"):
+    '''
+    Index every rendition of a master playlist and return its ContentLibrary row, or None when the playlist is a
+    rendition playlist
+    '''
+    bucket = playlist_url.split("/")[2]
+    key = '/'.join(playlist_url.split("/")[3:])
+
+    if not known_master:
+        head = s3_client.get_object(Bucket=bucket,Key=key,Range="bytes=0-%s" % (PLAYLIST_SNIFF_BYTES-1))['Body'].read().decode('utf-8','ignore')
+        if "#EXT-X-STREAM-INF" not in head:
+            return None
+
+    master_playlist = s3_client.get_object(Bucket=bucket,Key=key)['Body'].read().decode('utf-8')
+    path_to_object = playlist_url.rsplit("/",1)[0] + "/"
+    rendition_playlist_urls = []
+    for line in master_playlist.split("\n"):
+        if ".m3u8" in line and not line.startswith("#"):
+            rendition_playlist_urls.append(path_to_object + line.strip())
+    if len(rendition_playlist_urls) == 0:
+        raise Exception("No renditions listed in master playlist %s" % (playlist_url))
+
+    # the first variant gives the asset duration, as the video rendition does at ingest
+    segment_indexes = [vod_content_ingest.analyseRendition(s3_client,rendition_playlist_url) for rendition_playlist_url in rendition_playlist_urls]
+    asset_index = segment_indexes[0]
+
+    asset_name = assetName(playlist_url,naming)
+    duration = str(asset_index['offsets'][-1] if asset_index['offsets'] else 0)
+    segments = str(len(asset_index['durations']))
+    return {
+        "item":vod_content_ingest.contentLibraryItem(playlist_url,asset_name,duration,segments,vod_content_ingest.segmentTimeline(asset_index['durations'])),
+        "renditions":len(rendition_playlist_urls),
+        "segments":sum(len(segment_index['durations']) for segment_index in segment_indexes)
+    }
+
+
+class BackfillCheckpoint(object):
+    '''
+    Last playlist URL whose library row is written, along with the running totals. Playlists are handed out in order and
+    their results consumed in order, so everything up to the checkpoint is done
+    '''
+    def __init__(self,path):
+        self.path = path
+        self.state = {"last_completed":"","totals":dict(),"failed":[],"collisions":[]}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.state = json.load(checkpoint_file)
+            self.state.setdefault('collisions',[])
+            LOGGER.info("Resuming after %s" % (self.state['last_completed']))
+
+    def save(self,last_completed):
+        self.state['last_completed'] = last_completed
+        if not self.path:
+            return
+        with open(self.path + ".tmp","w") as checkpoint_file:
+            json.dump(self.state,checkpoint_file)
+        os.replace(self.path + ".tmp",self.path)
+
+
+def backfill(s3_client,db_client,table_name,playlist_urls,workers=16,checkpoint=None,known_masters=False,report_every=100,naming="file"):
+    '''
+    Analyse playlists on a bounded worker pool and batch write the library rows. Returns the throughput report
+    '''
+    checkpoint = checkpoint or BackfillCheckpoint(None)
+    previous_totals = collections.Counter(checkpoint.state['totals'])
+    started = time.time()
+    session_totals = collections.Counter()
+
+    # library rows of the batch by asset name, every playlist that had that name
+    pending_rows = dict()
+    last_consumed = checkpoint.state['last_completed']
+
+    def collision(asset_name,playlist_url,other_url):
+        LOGGER.error("Not writing %s : asset name %s is already used by %s" % (playlist_url,asset_name,other_url))
+        session_totals['collisions'] += 1
+        checkpoint.state['collisions'].append({"assetname":asset_name,"playlist":playlist_url,"existing":other_url})
+
+    def flush():
+        if len(pending_rows) > 0:
+            # a name belongs to the playlist already in the table, or else to the first playlist of the run that had it
+            existing_locations = existingLocations(db_client,table_name,pending_rows)
+            rows = []
+            for asset_name, items in pending_rows.items():
+                owner = existing_locations.get(asset_name,items[0]['assetlocation']['S'])
+                owner_written = False
+                for item in items:
+                    if item['assetlocation']['S'] == owner and not owner_written:
+                        rows.append(item)
+                        owner_written = True
+                    else:
+                        collision(asset_name,item['assetlocation']['S'],owner)
+            if len(rows) > 0:
+                session_totals['batch_retries'] += vod_content_ingest.batchWriteItems(db_client,table_name,rows)
+                session_totals['rows_written'] += len(rows)
+            pending_rows.clear()
+        checkpoint.state['totals'] = dict(previous_totals + session_totals)
+        checkpoint.save(last_consumed)
+
+    in_flight = collections.deque()
+    playlist_urls = iter(playlist_urls)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # keep the pool busy, but only a bounded number of playlists ahead of the checkpoint
+            for playlist_url in playlist_urls:
+                in_flight.append((playlist_url,executor.submit(analyseAsset,s3_client,playlist_url,known_masters,naming)))
+                if len(in_flight) >= workers * 2:
+                    break
+            if len(in_flight) == 0:
+                break
+
+            playlist_url, future = in_flight.popleft()
+            session_totals['playlists'] += 1
+            try:
+                asset = future.result()
+            except Exception as e:
+                LOGGER.error("Unable to ingest %s, got exception: %s" % (playlist_url,e))
+                session_totals['failed'] += 1
+                checkpoint.state['failed'].append(playlist_url)
+                asset = None
+
+            if asset is not None:
+                pending_rows.setdefault(asset['item']['assetname']['S'],[]).append(asset['item'])
+                session_totals['assets'] += 1
+                session_totals['renditions'] += asset['renditions']
+                session_totals['segments'] += asset['segments']
+            last_consumed = playlist_url
+
+            if len(pending_rows) >= 25:
+                flush()
+            if session_totals['playlists'] % report_every == 0:
+                LOGGER.info("Backfill progress : %s" % (throughputReport(session_totals,time.time() - started)))
+        flush()
+
+    report = throughputReport(session_totals,time.time() - started)
+    report['totals'] = checkpoint.state['totals']
+    report['last_completed'] = last_consumed
+    report['failed_playlists'] = checkpoint.state['failed']
+    report['collisions'] = checkpoint.state['collisions']
+    return report
+
+
+def throughputReport(totals,elapsed):
+    elapsed = max(elapsed,0.000001)
+    return {
+        "elapsed_seconds":round(elapsed,3),
+        "playlists":totals['playlists'],
+        "assets":totals['assets'],
+        "renditions":totals['renditions'],
+        "segments":totals['segments'],
+        "rows_written":totals['rows_written'],
+        "batch_retries":totals['batch_retries'],
+        "failed":totals['failed'],
+        "collisions":totals['collisions'],
+        "assets_per_second":round(totals['assets'] / elapsed,2),
+        "segments_per_second":round(totals['segments'] / elapsed,2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest an existing HLS library into a ContentLibrary table")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source",help="s3://bucket/prefix/ to search for master playlists")
+    source.add_argument("--masters",help="File listing master playlist URLs, one per line")
+    parser.add_argument("--table",required=True,help="ContentLibrary table, eg. 00001_ContentLibrary")
+    parser.add_argument("--workers",type=int,default=16,help="Playlists analysed concurrently")
+    parser.add_argument("--checkpoint",help="Checkpoint file, the run resumes from it when it exists")
+    parser.add_argument("--asset-name",choices=("file","folder"),default="file",help="Name assets after the master playlist file, or after the folder holding it (<asset>/index.m3u8 layouts)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    import boto3
+    import botocore.config
+    client_config = botocore.config.Config(max_pool_connections=args.workers * 2,retries={"max_attempts":5,"mode":"standard"})
+    s3_client = boto3.client('s3',config=client_config)
+    db_client = boto3.client('dynamodb',config=client_config)
+
+    checkpoint = BackfillCheckpoint(args.checkpoint)
+    if args.source:
+        bucket = args.source.split("/")[2]
+        prefix = '/'.join(args.source.split("/")[3:])
+        start_after = '/'.join(checkpoint.state['last_completed'].split("/")[3:])
+        playlist_urls = discoverPlaylists(s3_client,bucket,prefix,start_after)
+    else:
+        playlist_urls = readMasterUrls(args.masters,checkpoint.state['last_completed'])
+
+    report = backfill(s3_client,db_client,args.table,playlist_urls,args.workers,checkpoint,known_masters=args.masters is not None,naming=args.asset_name)
+    print(json.dumps(report,indent=2))
+
+
+if __name__ == "__main__":
+    main()
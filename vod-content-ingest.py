@@ -4,14 +4,163 @@ This script will calculate media duration and number of segments of an asset fro
 import json
 import boto3
 import datetime
+import time
 import math
 import os
+import random
+import re
+import concurrent.futures
 from botocore.vendored import requests
 import logging
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# version of the segment index artifact, stored on the schedule rows so the linearizer knows it can load the index
+SEGMENT_INDEX_VERSION = "1"
+
+def segmentIndexKey(playlist_key):
+    '''
+    S3 key of the segment index written next to a child playlist. hls_vod_linearizer.py uses the same naming
+    '''
+    return playlist_key.rsplit(".m3u8",1)[0] + ".index.json"
+
+def uriPattern(uris):
+    '''
+    Describe the segment URIs as prefix + zero padded running number + suffix when they follow one, eg. asset_0_00001.ts
+    Returns None when they don't, the URIs are then listed in the index
+    '''
+    pattern = None
+    for position, uri in enumerate(uris):
+        match = re.match(r"^(.*?)(\d+)(\.[A-Za-z0-9]+)$",uri)
+        if match is None:
+            return None
+        prefix, number, suffix = match.groups()
+        if pattern is None:
+            pattern = {"prefix":prefix,"suffix":suffix,"width":len(number),"first":int(number)}
+        if uri != "%s%0*d%s" % (pattern['prefix'],pattern['width'],pattern['first'] + position,pattern['suffix']):
+            return None
+    return pattern
+
+def segmentIndex(playlist):
+    '''
+    Build the segment index of a child playlist : float segment durations, cumulative end offsets and the URI pattern,
+    plus the playlist headers the linearizer starts every rendition playlist with
+    '''
+    durations = []
+    offsets = []
+    uris = []
+    playlist_offset = 0.0
+    for line in playlist.split("#"):
+        if 'EXTINF' in line:
+            duration = float(line.split(",")[0].split(":")[1])
+            playlist_offset = round(playlist_offset + duration,6)
+            durations.append(duration)
+            offsets.append(playlist_offset)
+            uris.append([uri for uri in line.split("\n")[1:] if uri.strip()][0].strip())
+
+    segment_index = {
+        "version":SEGMENT_INDEX_VERSION,
+        "headers":'#'.join(playlist.split("#")[0:4]),
+        "durations":durations,
+        "offsets":offsets
+    }
+    pattern = uriPattern(uris)
+    if pattern is not None:
+        segment_index['uri_pattern'] = pattern
+    else:
+        segment_index['uris'] = uris
+    return segment_index
+
+def segmentTimeline(durations):
+    '''
+    Run length encoded segment durations of an asset, eg. "6.0:99,2.0:1", stored on its schedule and library rows.
+    hls_vod_linearizer.py counts the segments played in a loop of the asset from it
+    '''
+    runs = []
+    for duration in durations:
+        if len(runs) > 0 and runs[-1][0] == duration:
+            runs[-1][1] += 1
+        else:
+            runs.append([duration,1])
+    return ",".join("%s:%s" % (duration,count) for duration, count in runs)
+
+def analyseRendition(s3_client,playlist_url):
+    '''
+    Read one rendition playlist from S3 and write its segment index next to it
+    '''
+    bucket = playlist_url.split("/")[2]
+    playlist_key = '/'.join(playlist_url.split("/")[3:])
+    response = s3_client.get_object(Bucket=bucket,Key=playlist_key)
+    segment_index = segmentIndex(response['Body'].read().decode('utf-8'))
+    s3_client.put_object(Bucket=bucket,Key=segmentIndexKey(playlist_key),Body=json.dumps(segment_index,separators=(",",":")),ContentType="application/json")
+    LOGGER.info("Wrote segment index for %s : %s segments" % (playlist_url,len(segment_index['durations'])))
+    return segment_index
+
+def scheduleKey(endtimeepoch,channel=None):
+    '''
+    Key of a schedule row, ContentManagement tables are keyed by endtimeepoch, ChannelSchedule tables by channel and
+    endtimeepoch. hls_vod_linearizer.py uses the same keys
+    '''
+    key = {"endtimeepoch":{"N":str(endtimeepoch)}}
+    if channel is not None:
+        key['channel'] = {"S":channel}
+    return key
+
+def contentLibraryItem(asset_url,asset_name,duration,segments,segment_timeline):
+    '''
+    ContentLibrary row of an indexed asset
+    '''
+    return {
+        "assetlocation": {
+            "S": asset_url
+        },
+        "assetname": {
+            "S": asset_name
+        },
+        "duration": {
+            "S": duration
+        },
+        "segments": {
+            "S": segments
+        },
+        "genre": {
+            "S": "demo"
+        },
+        "segmentindex": {
+            "S": SEGMENT_INDEX_VERSION
+        },
+        "segmenttimeline": {
+            "S": segment_timeline
+        }
+    }
+
+def batchWriteItems(db_client,table_name,items,max_attempts=8):
+    '''
+    Write items with BatchWriteItem, 25 at a time. Unprocessed items are retried with exponential backoff and jitter.
+    Returns the number of retried requests
+    '''
+    retries = 0
+    for batch_start in range(0,len(items),25):
+        request_items = {table_name:[{"PutRequest":{"Item":item}} for item in items[batch_start:batch_start+25]]}
+        for attempt in range(max_attempts):
+            response = db_client.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if len(request_items) == 0:
+                break
+            retries += sum(len(requests) for requests in request_items.values())
+            time.sleep(min(5.0,0.05 * (2 ** attempt)) * random.random())
+        else:
+            raise Exception("Unable to write %s items to %s after %s attempts" % (sum(len(requests) for requests in request_items.values()),table_name,max_attempts))
+    return retries
+
+def analyseRenditions(s3_client,playlist_urls,workers):
+    '''
+    Analyse every rendition playlist concurrently, returns the segment indexes in the order of playlist_urls
+    '''
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1,min(workers,len(playlist_urls)))) as executor:
+        return list(executor.map(lambda playlist_url: analyseRendition(s3_client,playlist_url),playlist_urls))
+
 def lambda_handler(event, context):
 
     LOGGER.info("Received event : %s " % (event))
@@ -19,9 +168,22 @@ def lambda_handler(event, context):
     db_contentmanagement = os.environ['CONTENT_MANAGEMENT_DB']
     db_contentlibrary = os.environ['CONTENT_LIBRARY_DB']
 
-    LOGGER.info("Content management database : %s " % (db_contentmanagement))
+    # channel schedules : with CHANNEL_SCHEDULE_DB set, the asset is scheduled on the channel named by the "channel" user
+    # metadata of the MediaConvert job, or CHANNEL_NAME, instead of the tenant wide ContentManagement table
+    schedule_channel = None
+    if os.environ.get('CHANNEL_SCHEDULE_DB',''):
+        db_contentmanagement = os.environ['CHANNEL_SCHEDULE_DB']
+        schedule_channel = event['detail'].get('userMetadata',{}).get('channel') or os.environ.get('CHANNEL_NAME','')
+        if not schedule_channel:
+            raise Exception("No channel to schedule the asset on, set CHANNEL_NAME or the channel job user metadata")
+
+    LOGGER.info("Content management database : %s , channel : %s " % (db_contentmanagement,schedule_channel))
     LOGGER.info("Content library database %s " % (db_contentlibrary))
 
+    rendition_workers = int(os.environ.get('RENDITION_WORKERS','8'))
+    # seconds the current item keeps playing before the new asset starts, so linearizer lookahead can load it first
+    schedule_lead = int(os.environ.get('SCHEDULE_LEAD_SECONDS','0'))
+
     # Initialize AWS service boto3 clients#
     db_client = boto3.client('dynamodb')
     s3_client = boto3.client('s3')
@@ -37,36 +199,25 @@ def lambda_handler(event, context):
         return response
 
     ##
-    def durationCalculator(asset_bucket,asset_playlist_key):
+    def durationCalculator(rendition_playlist_urls,video_playlist_url):
         LOGGER.info("Running durationCalculator function")
         #
-        # get child manifest / playlist and work out total duration
+        # index every rendition playlist, and work out total duration and segment count from the video rendition
         #
 
         try:
-            LOGGER.info("Getting object from S3")
-            response = s3_client.get_object(Bucket=asset_bucket,Key=asset_playlist_key)
+            LOGGER.info("Analysing %s rendition playlists" % (len(rendition_playlist_urls)))
+            segment_indexes = analyseRenditions(s3_client,rendition_playlist_urls,rendition_workers)
         except Exception as e:
-            LOGGER.error("Unable to get object from S3, got exception: %s " % (e))
-            exceptions.append("Unable to get object from S3, got exception: %s " % (e))
-
+            LOGGER.error("Unable to index rendition playlists, got exception: %s " % (e))
+            raise Exception("Unable to index rendition playlists, got exception: %s " % (e))
 
-        asset_playlist_manifest = response['Body'].read().decode('utf-8')
-        LOGGER.debug("Child playlist contents : %s " % (asset_playlist_manifest))
+        video_index = segment_indexes[rendition_playlist_urls.index(video_playlist_url)]
 
-        duration = 0
-        segments = 0
         filedetails = dict()
-
-        LOGGER.info("Iterating through manifest to get segmennt count and duration")
-        for line in asset_playlist_manifest.split("#"):
-            if 'EXTINF' in line:
-                segments = segments + 1
-                duration = duration + float(line.split(",")[0].split(":")[1])
-        duration = [{'duration': duration}]
-        segments = [{'segments': segments}]
-        filedetails['duration'] = duration
-        filedetails['segments'] = segments
+        filedetails['duration'] = [{'duration': video_index['offsets'][-1] if video_index['offsets'] else 0}]
+        filedetails['segments'] = [{'segments': len(video_index['durations'])}]
+        filedetails['segmenttimeline'] = segmentTimeline(video_index['durations'])
 
         LOGGER.info("Completed analysis of playlist: %s " % (filedetails))
         return filedetails
@@ -89,11 +240,14 @@ def lambda_handler(event, context):
             # HLS S3 URI
             asset_url = outputGroup['playlistFilePaths'][0]
 
-            # iterate through playlist files and get s3 uri for a video rendition
+            # iterate through playlist files and get s3 uri for every rendition, the first video rendition gives the asset duration
             outputGroupDetails = outputGroup['outputDetails']
 
+            rendition_playlist_urls = []
+            asset_playlist_url = None
             for outputGroupDetail in outputGroupDetails:
-                if "videoDetails" in outputGroupDetail:
+                rendition_playlist_urls.append(outputGroupDetail['outputFilePaths'][0])
+                if "videoDetails" in outputGroupDetail and asset_playlist_url is None:
                     asset_playlist_url = outputGroupDetail['outputFilePaths'][0]
 
     asset_name = asset_url.split("/")[-1].replace(".m3u8","")
@@ -105,28 +259,13 @@ def lambda_handler(event, context):
     LOGGER.info("Asset bucket: %s " % (asset_bucket))
     LOGGER.info("Asset playlist key: %s " % (asset_playlist_key))
 
-    filedetails = durationCalculator(asset_bucket,asset_playlist_key)
+    filedetails = durationCalculator(rendition_playlist_urls,asset_playlist_url)
 
     duration = str(filedetails['duration'][0]['duration'])
     segments = str(filedetails['segments'][0]['segments'])
+    segment_timeline = filedetails['segmenttimeline']
 
-    item_for_content_library = {
-        "assetlocation": {
-            "S": asset_url
-        },
-        "assetname": {
-            "S": asset_name
-        },
-        "duration": {
-            "S": duration
-        },
-        "segments": {
-            "S": segments
-        },
-        "genre": {
-            "S": "demo"
-        }
-    }
+    item_for_content_library = contentLibraryItem(asset_url,asset_name,duration,segments,segment_timeline)
 
     if duration == 0:
         LOGGER.error("Error getting asset information or parsing manifest correctly")
@@ -144,7 +283,7 @@ def lambda_handler(event, context):
 
 
     try:
-        get_item_response = db_client.get_item(TableName=db_contentmanagement,Key={"endtimeepoch":{"N":"999999999999"}})
+        get_item_response = db_client.get_item(TableName=db_contentmanagement,Key=scheduleKey("999999999999",schedule_channel))
         LOGGER.info("Got existing now Playing item...")
         LOGGER.debug("Response from current playing item check : %s " % (get_item_response))
     except Exception as e:
@@ -156,12 +295,12 @@ def lambda_handler(event, context):
         nowPlaying = get_item_response['Item']
         nowPlayingPrimaryKey = nowPlaying['endtimeepoch']['N']
 
-        nowPlaying['endtimeepoch']['N'] = str(int(datetime.datetime.utcnow().strftime('%s')))
+        nowPlaying['endtimeepoch']['N'] = str(int(datetime.datetime.utcnow().strftime('%s')) + schedule_lead)
         nowPlayingToLast = nowPlaying
 
         try:
             # delete item 999999998
-            delete_item_response = db_client.delete_item(TableName=db_contentmanagement,Key={"endtimeepoch":{"N":"999999999999"}})
+            delete_item_response = db_client.delete_item(TableName=db_contentmanagement,Key=scheduleKey("999999999999",schedule_channel))
             LOGGER.info("Current now playing item has been deleted")
         except Exception as e:
             LOGGER.error("Unable to delete current now playing item, got exception: %s " % (e))
@@ -177,6 +316,9 @@ def lambda_handler(event, context):
 
     endtime = "999999999999"
 
+    # bump the schedule version so that warm linearizer instances reload their schedule snapshot
+    scheduleversion = str(int(time.time() * 1000))
+
     newPlayingItem = {
         "endtimeepoch": {
             "N": endtime
@@ -195,8 +337,18 @@ def lambda_handler(event, context):
         },
         "genre": {
             "S": "demo"
+        },
+        "scheduleversion": {
+            "N": scheduleversion
+        },
+        "segmentindex": {
+            "S": SEGMENT_INDEX_VERSION
+        },
+        "segmenttimeline": {
+            "S": segment_timeline
         }
     }
+    newPlayingItem.update(scheduleKey(endtime,schedule_channel))
 
     try:
         newItemResponse = createItem(db_contentmanagement,newPlayingItem)
@@ -0,0 +1,120 @@
+'''
+Copy a tenant ContentManagement schedule (keyed by endtimeepoch) into a ChannelSchedule table (keyed by channel and
+endtimeepoch), as the schedule of one channel. The source table is left as it is, so the linearizer can be switched to
+SCHEDULE_MODEL=channel once the copy is verified, and switched back if needed.
+
+Usage:
+    python vod-schedule-migrate.py --source 00001_ContentManagement --target 00001_ChannelSchedule --channel channel1
+    python vod-schedule-migrate.py --source 00001_ContentManagement --target 00001_ChannelSchedule --channel channel1 --verify-only
+'''
+import argparse
+import importlib
+import json
+import logging
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+vod_content_ingest = importlib.import_module("vod-content-ingest")
+
+
+def scanSchedule(db_client,table_name):
+    '''
+    Every row of a ContentManagement table, sorted by endtimeepoch
+    '''
+    items = []
+    scan_args = {"TableName":table_name}
+    while True:
+        response = db_client.scan(**scan_args)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    items.sort(key=lambda item: int(item['endtimeepoch']['N']))
+    return items
+
+
+def queryChannel(db_client,table_name,channel):
+    '''
+    Every row of one channel of a ChannelSchedule table, sorted by endtimeepoch
+    '''
+    items = []
+    query_args = {
+        "TableName":table_name,
+        "KeyConditionExpression":"channel = :channel",
+        "ExpressionAttributeValues":{":channel":{"S":channel}}
+    }
+    while True:
+        response = db_client.query(**query_args)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return items
+
+
+def channelScheduleItem(item,channel):
+    '''
+    ChannelSchedule row for a ContentManagement row
+    '''
+    channel_item = dict(item)
+    channel_item.update(vod_content_ingest.scheduleKey(item['endtimeepoch']['N'],channel))
+    return channel_item
+
+
+def verifySchedule(source_items,target_items,channel):
+    '''
+    Compare the channel rows with the source rows, returns the list of endtimeepoch values that differ
+    '''
+    expected = dict((item['endtimeepoch']['N'],channelScheduleItem(item,channel)) for item in source_items)
+    copied = dict((item['endtimeepoch']['N'],item) for item in target_items)
+    return sorted((endtimeepoch for endtimeepoch in set(expected) | set(copied) if expected.get(endtimeepoch) != copied.get(endtimeepoch)),key=int)
+
+
+def migrate(db_client,source_table,target_table,channel,verify_only=False):
+    '''
+    Copy the schedule into the channel, then read it back and compare. Returns the migration report
+    '''
+    source_items = scanSchedule(db_client,source_table)
+    LOGGER.info("Read %s schedule rows from %s" % (len(source_items),source_table))
+
+    batch_retries = 0
+    if not verify_only:
+        batch_retries = vod_content_ingest.batchWriteItems(db_client,target_table,[channelScheduleItem(item,channel) for item in source_items])
+        LOGGER.info("Wrote %s schedule rows to %s, channel %s" % (len(source_items),target_table,channel))
+
+    target_items = queryChannel(db_client,target_table,channel)
+    mismatched = verifySchedule(source_items,target_items,channel)
+    if len(mismatched) > 0:
+        LOGGER.error("%s schedule rows differ between %s and %s channel %s" % (len(mismatched),source_table,target_table,channel))
+
+    return {
+        "source_rows":len(source_items),
+        "channel_rows":len(target_items),
+        "batch_retries":batch_retries,
+        "mismatched":mismatched,
+        "status":"VERIFIED" if len(mismatched) == 0 else "MISMATCHED"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy a ContentManagement schedule into a channel of a ChannelSchedule table")
+    parser.add_argument("--source",required=True,help="ContentManagement table, eg. 00001_ContentManagement")
+    parser.add_argument("--target",required=True,help="ChannelSchedule table, eg. 00001_ChannelSchedule")
+    parser.add_argument("--channel",required=True,help="Channel name, as requested in /<tenant>/<channel>.m3u8")
+    parser.add_argument("--verify-only",action="store_true",help="Only compare the channel with the source table")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    import boto3
+    db_client = boto3.client('dynamodb')
+
+    report = migrate(db_client,args.source,args.target,args.channel,args.verify_only)
+    print(json.dumps(report,indent=2))
+    if report['status'] != "VERIFIED":
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()